@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Бенчмарк офлайн-планировщика: планов в секунду на одно ядро.
+
+    python bench_planner.py [секунд] [процессов]
+"""
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from bot.services.planner import MACRO_SPLITS, OfflinePlanner
+
+GOALS = ('lose_weight', 'gain_muscle', 'maintain')
+CALORIES = (1500, 2000, 2500, 3000)
+
+def run(seconds: float) -> tuple:
+    """Сколько дневных и недельных планов строит один процесс за seconds"""
+    planner = OfflinePlanner()
+    cases = [
+        ({'goal': goal, 'calories': calories}, meal_type)
+        for goal in GOALS for calories in CALORIES for meal_type in MACRO_SPLITS
+    ]
+    results = []
+    for days in (1, 7):
+        count = 0
+        started = time.perf_counter()
+        deadline = started + seconds / 2
+        while time.perf_counter() < deadline:
+            profile, meal_type = cases[count % len(cases)]
+            planner.plan(profile, days, meal_type)
+            count += 1
+        results.append(count / (time.perf_counter() - started))
+    return tuple(results)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+
+    daily, weekly = run(seconds)
+    print(f"1 ядро:    {daily:8.0f} дневных планов/с, {weekly:6.0f} недельных планов/с")
+    print(f"           {1000 / daily:8.2f} мс на дневной план")
+
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.map(run, [seconds] * processes)
+        total_daily = sum(r[0] for r in results)
+        total_weekly = sum(r[1] for r in results)
+        print(f"{processes} процессов: {total_daily:8.0f} дневных планов/с, {total_weekly:6.0f} недельных планов/с "
+              f"({total_daily / processes:.0f} дневных на ядро)")
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,144 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Several Gemini keys to spread generation over, "key1,key2:model,..."
+# (a key without a model uses GEMINI_MODEL); empty means GEMINI_API_KEY only
+GEMINI_API_KEYS = os.getenv("GEMINI_API_KEYS", "")
 FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS")
 PAYMENT_TOKEN = os.getenv("PAYMENT_TOKEN")
 
+# SQLite storage
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# Group-commit history/meal inserts instead of one transaction per write
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_FLUSH_INTERVAL_MS = int(os.getenv("DB_FLUSH_INTERVAL_MS", "50"))
+DB_FLUSH_MAX_ROWS = int(os.getenv("DB_FLUSH_MAX_ROWS", "200"))
+DB_MAX_PENDING_WRITES = int(os.getenv("DB_MAX_PENDING_WRITES", "10000"))
+# LRU+TTL cache for profiles and subscription status (0 disables it)
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "10000"))
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", "300"))
+
+# Model backend: genai (SDK), rest (plain HTTP, e.g. against
+# fake_gemini_server.py via GEMINI_API_ENDPOINT) or fake (in-process)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "genai")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "https://generativelanguage.googleapis.com")
+# Fake backend: log-normal latency to first token (median seconds, sigma),
+# stream chunk timing and share of failing calls
+FAKE_LATENCY_MEDIAN = float(os.getenv("FAKE_LATENCY_MEDIAN", "2.0"))
+FAKE_LATENCY_SIGMA = float(os.getenv("FAKE_LATENCY_SIGMA", "0.5"))
+FAKE_CHUNK_INTERVAL = float(os.getenv("FAKE_CHUNK_INTERVAL", "0.05"))
+FAKE_CHUNK_SIZE = int(os.getenv("FAKE_CHUNK_SIZE", "80"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_SEED = int(os.getenv("FAKE_SEED")) if os.getenv("FAKE_SEED") else None
+
+# Gemini client: model, cap on concurrent calls (size it to the API quota)
+# and per-call timeout in seconds
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+# Retries of timeouts and 429/5xx errors with jittered exponential backoff
+GEMINI_RETRY_ATTEMPTS = int(os.getenv("GEMINI_RETRY_ATTEMPTS", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+# Send a duplicate request when a call outlives this latency percentile
+# (needs GEMINI_HEDGE_MIN_SAMPLES calls to be measured first); streams are
+# hedged on their time to the first chunk, before anything reaches the user
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "1") == "1"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# Consecutive failures that open the circuit breaker (0 disables it) and
+# seconds before a trial call is let through
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RECOVERY = float(os.getenv("GEMINI_BREAKER_RECOVERY", "30"))
+# Answer with a locally computed plan when Gemini fails and nothing is cached
+PLANNER_FALLBACK = os.getenv("PLANNER_FALLBACK", "1") == "1"
+# Weekly plans are generated as concurrent parts of this many days each
+# (0 sends the whole week as one request)
+GEMINI_DAYS_PER_PART = int(os.getenv("GEMINI_DAYS_PER_PART", "1"))
+
+# Request compact JSON plans (response schema) and render them locally
+# instead of asking the model for formatted text; streaming does not apply
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "0") == "1"
+
+# Stream Gemini output into a progressively edited Telegram message
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") == "1"
+# Minimum seconds between edits of the streamed message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Generated plan cache: in-process LRU over the plan_cache table
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1000"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# Distinct plans kept per key; one of them is served at random
+PLAN_CACHE_VARIANTS = int(os.getenv("PLAN_CACHE_VARIANTS", "3"))
+PLAN_CACHE_MAX_ROWS = int(os.getenv("PLAN_CACHE_MAX_ROWS", "50000"))
+# Bucketing granularity of the cache key
+PLAN_CACHE_WEIGHT_STEP = int(os.getenv("PLAN_CACHE_WEIGHT_STEP", "5"))
+PLAN_CACHE_HEIGHT_STEP = int(os.getenv("PLAN_CACHE_HEIGHT_STEP", "5"))
+PLAN_CACHE_AGE_STEP = int(os.getenv("PLAN_CACHE_AGE_STEP", "10"))
+PLAN_CACHE_CALORIES_STEP = int(os.getenv("PLAN_CACHE_CALORIES_STEP", "100"))
+
+# Pool of daily plans pre-generated off-peak for the most requested
+# buckets (goal, gender, calorie band, diet type)
+PLAN_POOL_ENABLED = os.getenv("PLAN_POOL_ENABLED", "1") == "1"
+# Fresh plans kept per bucket and their maximum age in seconds
+PLAN_POOL_DEPTH = int(os.getenv("PLAN_POOL_DEPTH", "3"))
+PLAN_POOL_MAX_AGE = float(os.getenv("PLAN_POOL_MAX_AGE", str(36 * 60 * 60)))
+# Local hours when the pool is filled, e.g. "2-7" or "22-6"
+PLAN_POOL_HOURS = os.getenv("PLAN_POOL_HOURS", "2-7")
+PLAN_POOL_TOP_BUCKETS = int(os.getenv("PLAN_POOL_TOP_BUCKETS", "20"))
+# Days of generation history mined for popular buckets
+PLAN_POOL_HISTORY_DAYS = int(os.getenv("PLAN_POOL_HISTORY_DAYS", "14"))
+# Gemini requests the pool may spend per day, and at once
+PLAN_POOL_DAILY_BUDGET = int(os.getenv("PLAN_POOL_DAILY_BUDGET", "200"))
+PLAN_POOL_CONCURRENCY = int(os.getenv("PLAN_POOL_CONCURRENCY", "2"))
+PLAN_POOL_INTERVAL = float(os.getenv("PLAN_POOL_INTERVAL", "600"))
+
+# Persistent generation queue: handlers enqueue, this many workers generate
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Seconds a worker holds a job before another may take it over (renewed while running)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "180"))
+# Attempts per job, including ones lost to a crash, before it is reported failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Idle workers look for jobs left by other processes this often
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2.0"))
+# Weighted fair queuing between subscribers' and free users' jobs: shares
+# of the workers under contention
+JOB_PAID_WEIGHT = float(os.getenv("JOB_PAID_WEIGHT", "3"))
+JOB_FREE_WEIGHT = float(os.getenv("JOB_FREE_WEIGHT", "1"))
+# Workers free users' jobs can never take
+JOB_PAID_RESERVED = int(os.getenv("JOB_PAID_RESERVED", "1"))
+# Finished jobs are kept this many hours
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+
+# Free users: generations per RATE_LIMIT_PERIOD seconds (token bucket)
+FREE_GENERATIONS_PER_DAY = int(os.getenv("FREE_GENERATIONS_PER_DAY", "1"))
+RATE_LIMIT_PERIOD = float(os.getenv("RATE_LIMIT_PERIOD", str(24 * 60 * 60)))
+# Changed buckets are saved to the rate_limits table this often
+RATE_LIMIT_PERSIST_INTERVAL = float(os.getenv("RATE_LIMIT_PERSIST_INTERVAL", "30"))
+
+# Quota of each Gemini key: requests and tokens per minute (0 = no limit)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "0"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "0"))
+# A key answering 429/5xx leaves the rotation for this many seconds
+# (doubled for each further failure in a row)
+GEMINI_KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "60"))
+# A model call that would wait longer than this for quota is refused
+GEMINI_QUOTA_MAX_WAIT = float(os.getenv("GEMINI_QUOTA_MAX_WAIT", "30"))
+# New plan requests are turned away when the estimated quota wait exceeds this
+GEMINI_ADMISSION_MAX_WAIT = float(os.getenv("GEMINI_ADMISSION_MAX_WAIT", "300"))
+
+# Per-request model telemetry (model_calls table and in-process histograms)
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+# Telemetry rows are written in batches this often
+TELEMETRY_FLUSH_INTERVAL_MS = int(os.getenv("TELEMETRY_FLUSH_INTERVAL_MS", "1000"))
+
+# Background deactivation of expired subscriptions
+SUBSCRIPTION_SWEEP_INTERVAL = float(os.getenv("SUBSCRIPTION_SWEEP_INTERVAL", "60"))
+# Days before end_date to send a renewal reminder (0 disables reminders)
+SUBSCRIPTION_REMINDER_DAYS = float(os.getenv("SUBSCRIPTION_REMINDER_DAYS", "3"))
+
 # Subscription prices (in cents)
 SUBSCRIPTION_PRICES = {
     'RUB': {
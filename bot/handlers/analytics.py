@@ -1,12 +1,10 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
-from bot.services.database import DatabaseService
-from datetime import datetime, timedelta
+from bot.services.database import AsyncDatabaseService
 import logging
 
 router = Router()
-db = DatabaseService()
 
 # Словари для преобразования технических значений в читаемые
 GOAL_MAP = {
@@ -20,34 +18,48 @@ PLAN_TYPE_MAP = {
     'weekly': 'Недельный план'
 }
 
+WEEKDAY_NAMES = (
+    'Понедельник',
+    'Вторник',
+    'Среда',
+    'Четверг',
+    'Пятница',
+    'Суббота',
+    'Воскресенье'
+)
+
+HOUR_BUCKET_MAP = {
+    'morning': 'Утро (6-12)',
+    'day': 'День (12-18)',
+    'evening': 'Вечер (18-24)',
+    'night': 'Ночь (0-6)'
+}
+
 @router.message(Command("analytics"))
-async def cmd_analytics(message: Message):
+async def cmd_analytics(message: Message, db: AsyncDatabaseService):
     """Show basic analytics"""
     logging.info(f"Received /analytics command from user {message.from_user.id}")
     try:
         user_id = message.from_user.id
         
-        # Get user profile
-        profile = db.get_profile(user_id)
+        # Get profile and subscription status in one round trip
+        context = await db.get_user_context(user_id, meals_limit=0)
+        if context is None:
+            raise RuntimeError("Failed to load user context")
+        profile = context['profile']
         if not profile:
             await message.answer(
                 "❌ У вас еще нет профиля. Пожалуйста, создайте его с помощью команды /profile"
             )
             return
+        is_subscribed = context['is_subscribed']
         
-        # Get subscription status
-        is_subscribed = db.get_subscription_status(user_id)
-        
-        # Get generation history
-        history = db.get_generation_history(user_id)
-        total_generations = len(history)
-        last_week_generations = len([h for h in history if datetime.fromtimestamp(h['timestamp']) > datetime.now() - timedelta(days=7)])
-        
-        # Count plan types
-        plan_types = {}
-        for h in history:
-            plan_type = PLAN_TYPE_MAP.get(h['plan_type'], h['plan_type'])
-            plan_types[plan_type] = plan_types.get(plan_type, 0) + 1
+        # Get aggregated generation stats
+        stats = await db.get_generation_stats(user_id)
+        if stats is None:
+            raise RuntimeError("Failed to load generation stats")
+        total_generations = stats['total']
+        last_week_generations = stats['last_week']
         
         # Create analytics message
         analytics = (
@@ -64,8 +76,8 @@ async def cmd_analytics(message: Message):
             f"📊 *Распределение по типам планов:*\n"
         )
         
-        for plan_type, count in plan_types.items():
-            analytics += f"• {plan_type}: *{count}*\n"
+        for plan_type, count in stats['plan_types'].items():
+            analytics += f"• {PLAN_TYPE_MAP.get(plan_type, plan_type)}: *{count}*\n"
         
         analytics += "\nИспользуйте /detailed_analytics для просмотра детальной статистики."
         
@@ -76,58 +88,28 @@ async def cmd_analytics(message: Message):
         await message.answer("❌ Произошла ошибка при получении аналитики. Пожалуйста, попробуйте позже.")
 
 @router.message(Command("detailed_analytics"))
-async def cmd_detailed_analytics(message: Message):
+async def cmd_detailed_analytics(message: Message, db: AsyncDatabaseService):
     """Show detailed analytics"""
     logging.info(f"Received /detailed_analytics command from user {message.from_user.id}")
     try:
         user_id = message.from_user.id
         
-        # Get user profile
-        profile = db.get_profile(user_id)
+        # Get profile and subscription status in one round trip
+        context = await db.get_user_context(user_id, meals_limit=0)
+        if context is None:
+            raise RuntimeError("Failed to load user context")
+        profile = context['profile']
         if not profile:
             await message.answer(
                 "❌ У вас еще нет профиля. Пожалуйста, создайте его с помощью команды /profile"
             )
             return
+        is_subscribed = context['is_subscribed']
         
-        # Get subscription status
-        is_subscribed = db.get_subscription_status(user_id)
-        
-        # Get generation history
-        history = db.get_generation_history(user_id)
-        
-        # Count generations by day of week
-        day_stats = {
-            'Понедельник': 0,
-            'Вторник': 0,
-            'Среда': 0,
-            'Четверг': 0,
-            'Пятница': 0,
-            'Суббота': 0,
-            'Воскресенье': 0
-        }
-        
-        # Count generations by time of day
-        time_stats = {
-            'Утро (6-12)': 0,
-            'День (12-18)': 0,
-            'Вечер (18-24)': 0,
-            'Ночь (0-6)': 0
-        }
-        
-        for h in history:
-            dt = datetime.fromtimestamp(h['timestamp'])
-            day_stats[dt.strftime('%A')] += 1
-            
-            hour = dt.hour
-            if 6 <= hour < 12:
-                time_stats['Утро (6-12)'] += 1
-            elif 12 <= hour < 18:
-                time_stats['День (12-18)'] += 1
-            elif 18 <= hour < 24:
-                time_stats['Вечер (18-24)'] += 1
-            else:
-                time_stats['Ночь (0-6)'] += 1
+        # Get aggregated generation stats
+        stats = await db.get_generation_stats(user_id, detailed=True)
+        if stats is None:
+            raise RuntimeError("Failed to load generation stats")
         
         # Create detailed analytics message
         analytics = (
@@ -141,17 +123,15 @@ async def cmd_detailed_analytics(message: Message):
             f"📈 *Генерации по дням недели:*\n"
         )
         
-        for day, count in day_stats.items():
+        for day, count in zip(WEEKDAY_NAMES, stats['weekdays']):
             analytics += f"• {day}: *{count}*\n"
         
         analytics += f"\n⏰ *Генерации по времени суток:*\n"
-        for time, count in time_stats.items():
-            analytics += f"• {time}: *{count}*\n"
+        for bucket, label in HOUR_BUCKET_MAP.items():
+            analytics += f"• {label}: *{stats['hours'][bucket]}*\n"
         
-        if len(history) > 1:
-            dates = [datetime.fromtimestamp(h['timestamp']) for h in history]
-            dates.sort()
-            avg_days = (dates[-1] - dates[0]).days / (len(dates) - 1)
+        if stats['total'] > 1:
+            avg_days = (stats['last_at'] - stats['first_at']) // 86400 / (stats['total'] - 1)
             analytics += f"\n📅 *Средняя частота генераций:* {avg_days:.1f} дней"
         
         await message.answer(analytics, parse_mode="Markdown")
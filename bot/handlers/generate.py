@@ -1,64 +1,64 @@
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from bot.services.database import DatabaseService
-from bot.services.gemini import GeminiService
+from bot.services.database import AsyncDatabaseService
+from bot.services.gemini import ERROR_MESSAGE, GeminiService
+from bot.services.jobs import GenerationQueue
+from bot.services.limiter import LimiterService
+from bot.services.quota import quota_message
+from bot.middlewares.limiter import limit_message
 from bot.keyboards.inline import get_meal_type_keyboard
+from bot.config import GEMINI_ADMISSION_MAX_WAIT
 import logging
 
 router = Router()
-db = DatabaseService()
-gemini = GeminiService()
 
 class GenerateStates(StatesGroup):
     waiting_for_meal_type = State()
     waiting_for_calories = State()
 
 @router.message(Command("generateforday"))
-async def cmd_generate_day(message: Message, state: FSMContext):
+async def cmd_generate_day(message: Message, state: FSMContext, db: AsyncDatabaseService):
     """Start daily meal plan generation"""
     # Check if user has a profile
-    profile = db.get_profile(message.from_user.id)
+    profile = await db.get_profile(message.from_user.id)
     if not profile:
         await message.answer(
             "❌ У вас еще нет профиля. Пожалуйста, создайте его с помощью команды /profile"
         )
         return
 
-    # Get existing meals for the day
-    existing_meals = db.get_user_meals(message.from_user.id, limit=5)  # Get last 5 meals
-
     await state.set_state(GenerateStates.waiting_for_meal_type)
+    await state.update_data(days=1)
     await message.answer(
         "Выберите тип плана питания:",
         reply_markup=get_meal_type_keyboard()
     )
 
 @router.message(Command("generateforweek"))
-async def cmd_generate_week(message: Message, state: FSMContext):
+async def cmd_generate_week(message: Message, state: FSMContext, db: AsyncDatabaseService):
     """Start weekly meal plan generation"""
-    # Check if user has a profile
-    profile = db.get_profile(message.from_user.id)
-    if not profile:
+    # Profile and subscription in one round trip
+    context = await db.get_user_context(message.from_user.id, meals_limit=0)
+    if not context or not context['profile']:
         await message.answer(
             "❌ У вас еще нет профиля. Пожалуйста, создайте его с помощью команды /profile"
         )
         return
 
     # Check subscription
-    if not db.get_subscription_status(message.from_user.id):
+    if not context['is_subscribed']:
         await message.answer(
             "❌ Генерация недельного плана доступна только для подписчиков.\n"
             "Используйте команду /subscribe для оформления подписки."
         )
         return
 
-    # Get existing meals for the week
-    existing_meals = db.get_user_meals(message.from_user.id, limit=20)  # Get last 20 meals
-
     await state.set_state(GenerateStates.waiting_for_meal_type)
+    await state.update_data(days=7)
     await message.answer(
         "Выберите тип плана питания:",
         reply_markup=get_meal_type_keyboard()
@@ -76,72 +76,65 @@ async def process_meal_type(callback: CallbackQuery, state: FSMContext):
     )
 
 @router.message(GenerateStates.waiting_for_calories)
-async def process_calories(message: Message, state: FSMContext):
-    """Process calories input and generate meal plan"""
+async def process_calories(message: Message, state: FSMContext, db: AsyncDatabaseService,
+                           gemini: GeminiService, jobs: GenerationQueue,
+                           limiter: Optional[LimiterService] = None):
+    """Process calories input and queue the meal plan generation"""
     try:
         calories = int(message.text)
         if not (1000 <= calories <= 5000):
             raise ValueError
             
-        # Get user profile
-        profile = db.get_profile(message.from_user.id)
-        if not profile:
-            await message.answer("❌ Профиль не найден. Используйте /profile для создания профиля.")
-            await state.clear()
-            return
-            
         # Get meal type from state
         data = await state.get_data()
         meal_type = data.get('meal_type', 'balanced')
         
-        # Check if this is a weekly plan
-        is_weekly = message.text.startswith('/generateforweek')
-        
-        # Check subscription for weekly plan
-        if is_weekly and not db.get_subscription_status(message.from_user.id):
-            await message.answer(
-                "❌ Генерация недельного плана доступна только для подписчиков.\n"
-                "Используйте команду /subscribe для оформления подписки."
-            )
-            await state.clear()
-            return
-        
-        # Generate meal plan
-        await message.answer("🔄 Генерирую план питания...")
-        
-        # Add calories to profile
-        profile['calories'] = calories
+        # Plan length was chosen by the command that started the flow
+        days = data.get('days', 1)
         
-        # Get existing meals
-        existing_meals = db.get_user_meals(message.from_user.id, limit=20 if is_weekly else 5)
+        # Don't queue work the Gemini quota can't serve soon
+        wait = 0.0
+        if gemini.quota:
+            queued = (await db.count_jobs()).get('queued', 0)
+            wait = gemini.admission_wait(days, queued)
+            if wait > GEMINI_ADMISSION_MAX_WAIT:
+                await message.answer(quota_message(wait))
+                await state.clear()
+                return
         
-        # Generate meal plan
-        meal_plan = await gemini.generate_meal_plan(profile, 7 if is_weekly else 1, existing_meals)
-        
-        # Check if response is an error message
-        if meal_plan.startswith("❌"):
-            await message.answer(meal_plan)
+        # Free users' generation is taken from their bucket (LimiterMiddleware
+        # passes no limiter for subscribers)
+        if limiter and not limiter.consume(message.from_user.id):
+            await message.answer(limit_message(limiter.retry_after(message.from_user.id)))
             await state.clear()
             return
         
-        # Split long message if needed
-        if len(meal_plan) > 4000:
-            parts = [meal_plan[i:i+4000] for i in range(0, len(meal_plan), 4000)]
-            for part in parts:
-                await message.answer(part)
-        else:
-            await message.answer(meal_plan)
-            
-        # Save generation history
-        db.save_generation(
+        # Subscribers' jobs are scheduled ahead of free ones; a job paid
+        # from the bucket stays free so the worker can give it back
+        is_subscribed = not limiter and await db.get_subscription_status(message.from_user.id)
+        
+        # A worker replaces this message with the plan once it is ready
+        status_text = "🔄 Генерирую план питания..."
+        if wait >= 60:
+            status_text += f"\n⏳ Из-за высокой нагрузки это займет около {int(wait // 60) + 1} мин."
+        status = await message.answer(status_text)
+        job_id = await jobs.enqueue(
             message.from_user.id,
-            'weekly' if is_weekly else 'daily',
-            calories
+            message.chat.id,
+            status.message_id,
+            days,
+            meal_type,
+            calories,
+            priority='paid' if is_subscribed else 'free'
         )
+        if job_id is None:
+            await status.edit_text(ERROR_MESSAGE)
+            if limiter:
+                limiter.refund(message.from_user.id)
             
         await state.clear()
         
     except ValueError:
         await message.answer(
             "Пожалуйста, введите корректное количество калорий (1000-5000):"
-        ) 
\ No newline at end of file
+        )
@@ -1,7 +1,7 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
 from aiogram.filters import Command
-from bot.services.database import DatabaseService
+from bot.services.database import AsyncDatabaseService
 from bot.keyboards.inline import get_subscription_keyboard
 from bot.config import (
     PAYMENT_TOKEN,
@@ -13,7 +13,6 @@ from bot.config import (
 import logging
 
 router = Router()
-db = DatabaseService()
 
 @router.message(Command("subscribe"))
 async def cmd_subscribe(message: Message):
@@ -84,14 +83,14 @@ async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
     await pre_checkout_query.answer(ok=True)
 
 @router.message(F.successful_payment)
-async def process_successful_payment(message: Message):
+async def process_successful_payment(message: Message, db: AsyncDatabaseService):
     """Process successful payment"""
     try:
         # Получаем тип подписки и валюту из payload
         _, plan, currency = message.successful_payment.invoice_payload.split(":")
         
         # Обновляем статус подписки в базе
-        if db.update_subscription(
+        if await db.update_subscription(
             message.from_user.id,
             plan,
             SUBSCRIPTION_DURATIONS[plan]
@@ -6,11 +6,10 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardRemove
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from bot.keyboards.inline import get_goal_keyboard
-from bot.services.database import DatabaseService
+from bot.services.database import AsyncDatabaseService
 import logging
 
 router = Router()
-db = DatabaseService()
 
 # Словари для преобразования технических значений в читаемые
 GOAL_MAP = {
@@ -42,10 +41,10 @@ def get_gender_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 @router.message(Command("profile"))
-async def cmd_profile(message: Message, state: FSMContext):
+async def cmd_profile(message: Message, state: FSMContext, db: AsyncDatabaseService):
     """Start profile setup"""
     # Check if user already has a profile
-    existing_profile = db.get_profile(message.from_user.id)
+    existing_profile = await db.get_profile(message.from_user.id)
     if existing_profile:
         # Load existing profile data into state
         await state.update_data(
@@ -138,7 +137,7 @@ async def process_height(message: Message, state: FSMContext):
         )
 
 @router.callback_query(ProfileStates.waiting_for_goal)
-async def process_goal(callback: CallbackQuery, state: FSMContext):
+async def process_goal(callback: CallbackQuery, state: FSMContext, db: AsyncDatabaseService):
     """Process goal selection"""
     try:
         goal = callback.data.split(":")[1]
@@ -150,7 +149,7 @@ async def process_goal(callback: CallbackQuery, state: FSMContext):
         logging.info(f"Current profile data: {profile_data}")
         
         # Save profile to database
-        if db.save_profile(callback.from_user.id, profile_data):
+        if await db.save_profile(callback.from_user.id, profile_data):
             logging.info("Profile saved successfully")
             # Create profile summary message with readable values
             profile_summary = (
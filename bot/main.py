@@ -1,9 +1,60 @@
+import time
+
+# Отметка времени для отчета о холодном старте
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from bot.config import BOT_TOKEN
+from datetime import datetime
+from bot.config import (
+    BOT_TOKEN,
+    GEMINI_MODEL,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_TIMEOUT,
+    GEMINI_DAYS_PER_PART,
+    GEMINI_STRUCTURED_OUTPUT,
+    GEMINI_STREAMING,
+    STREAM_EDIT_INTERVAL,
+    JOB_WORKERS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETENTION_HOURS,
+    JOB_PAID_WEIGHT,
+    JOB_FREE_WEIGHT,
+    JOB_PAID_RESERVED,
+    FREE_GENERATIONS_PER_DAY,
+    RATE_LIMIT_PERIOD,
+    RATE_LIMIT_PERSIST_INTERVAL,
+    PLANNER_FALLBACK,
+    PLAN_POOL_HOURS,
+    PLAN_POOL_TOP_BUCKETS,
+    PLAN_POOL_HISTORY_DAYS,
+    PLAN_POOL_DAILY_BUDGET,
+    PLAN_POOL_CONCURRENCY,
+    PLAN_POOL_INTERVAL,
+    SUBSCRIPTION_SWEEP_INTERVAL,
+    SUBSCRIPTION_REMINDER_DAYS
+)
 from bot.handlers import start, profile, generate, payment, analytics, help
+from bot.middlewares.limiter import LimiterMiddleware
+from bot.services.database import create_database
+from bot.services.gemini import GeminiService
+from bot.services.generation import GenerationPipeline
+from bot.services.jobs import GenerationQueue
+from bot.services.limiter import LimiterService
+from bot.services.model_backends import create_backend
+from bot.services.plan_cache import create_plan_cache
+from bot.services.plan_pool import PoolFiller, create_plan_pool
+from bot.services.quota import create_quota_governor
+from bot.services.planner import OfflinePlanner
+from bot.services.resilience import create_resilience
+from bot.services.subscriptions import SubscriptionSweeper
+from bot.services.telemetry import create_telemetry
+
+IMPORTED_AT = time.perf_counter()
 
 # Настройка логирования
 logging.basicConfig(
@@ -12,10 +63,66 @@ logging.basicConfig(
     filename='bot.log'
 )
 
+# Общие сервисы: один экземпляр на процесс, передаются в хендлеры
+# через workflow data диспетчера (аргументы db, gemini и jobs)
+db = create_database()
+plan_pool = create_plan_pool(db)
+gemini = GeminiService(
+    plan_cache=create_plan_cache(db),
+    plan_pool=plan_pool,
+    planner=OfflinePlanner() if PLANNER_FALLBACK else None,
+    model_name=GEMINI_MODEL,
+    backend=create_backend(GEMINI_MODEL),
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    timeout=GEMINI_TIMEOUT,
+    days_per_part=GEMINI_DAYS_PER_PART,
+    structured=GEMINI_STRUCTURED_OUTPUT,
+    telemetry=create_telemetry(db),
+    quota=create_quota_governor(),
+    **create_resilience()
+)
+
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
 storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+
+# Лимит бесплатных генераций: корзины в памяти, сохраняются в rate_limits
+limiter = LimiterService(
+    db,
+    capacity=FREE_GENERATIONS_PER_DAY,
+    period=RATE_LIMIT_PERIOD,
+    persist_interval=RATE_LIMIT_PERSIST_INTERVAL
+)
+
+# Очередь генераций в базе: хендлер ставит задачу и сразу отвечает,
+# воркеры генерируют план и отправляют его в чат; недоставленный
+# бесплатный план возвращается в корзину пользователя
+pipeline = GenerationPipeline(
+    bot,
+    db,
+    gemini,
+    streaming=GEMINI_STREAMING,
+    edit_interval=STREAM_EDIT_INTERVAL,
+    limiter=limiter
+)
+jobs = GenerationQueue(
+    db,
+    pipeline.run,
+    workers=JOB_WORKERS,
+    lease_seconds=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    poll_interval=JOB_POLL_INTERVAL,
+    retention=JOB_RETENTION_HOURS * 60 * 60,
+    on_failed=pipeline.fail,
+    # Подписчики получают большую долю воркеров и зарезервированные слоты
+    weights={'paid': JOB_PAID_WEIGHT, 'free': JOB_FREE_WEIGHT},
+    reserved={'paid': JOB_PAID_RESERVED}
+)
+
+dp = Dispatcher(storage=storage, db=db, gemini=gemini, jobs=jobs)
+
+# Лимит проверяется middleware роутера генерации
+generate.router.message.outer_middleware(LimiterMiddleware(limiter, db))
 
 # Регистрация роутеров
 dp.include_router(start.router)
@@ -25,9 +132,96 @@ dp.include_router(payment.router)
 dp.include_router(analytics.router)
 dp.include_router(help.router)
 
+async def notify_users(user_ids, text):
+    for user_id in user_ids:
+        try:
+            await bot.send_message(user_id, text)
+        except Exception as e:
+            logging.warning(f"Could not notify user {user_id}: {e}")
+
+async def on_subscriptions_expired(expired):
+    await notify_users(
+        [s['user_id'] for s in expired],
+        "⌛ Ваша подписка закончилась.\n"
+        "Используйте команду /subscribe, чтобы продлить её."
+    )
+
+async def on_subscriptions_expiring(expiring):
+    for s in expiring:
+        end_date = datetime.fromtimestamp(s['end_date']).strftime('%d.%m.%Y')
+        await notify_users(
+            [s['user_id']],
+            f"⏳ Ваша подписка заканчивается {end_date}.\n"
+            "Используйте команду /subscribe, чтобы продлить её."
+        )
+
+sweeper = SubscriptionSweeper(
+    db,
+    interval=SUBSCRIPTION_SWEEP_INTERVAL,
+    on_expired=on_subscriptions_expired,
+    remind_before=SUBSCRIPTION_REMINDER_DAYS * 24 * 60 * 60,
+    on_reminder=on_subscriptions_expiring
+)
+
+# Заполнение пула готовых планов в часы низкой нагрузки
+pool_filler = PoolFiller(
+    plan_pool,
+    gemini,
+    interval=PLAN_POOL_INTERVAL,
+    hours=PLAN_POOL_HOURS,
+    top_buckets=PLAN_POOL_TOP_BUCKETS,
+    history_days=PLAN_POOL_HISTORY_DAYS,
+    daily_budget=PLAN_POOL_DAILY_BUDGET,
+    concurrency=PLAN_POOL_CONCURRENCY
+) if plan_pool else None
+
+SETUP_DONE_AT = time.perf_counter()
+
+async def on_startup():
+    # Отчет о времени холодного старта
+    ready_at = time.perf_counter()
+    logging.info(
+        "Startup time: "
+        f"imports {(IMPORTED_AT - STARTED_AT) * 1000:.0f} ms, "
+        f"setup {(SETUP_DONE_AT - IMPORTED_AT) * 1000:.0f} ms, "
+        f"total {(ready_at - STARTED_AT) * 1000:.0f} ms until polling"
+    )
+    # Фоновая деактивация истекших подписок
+    sweeper.start()
+    # Восстанавливаем лимиты, сохраненные до перезапуска
+    await limiter.load()
+    limiter.start()
+    # Воркеры подхватывают и задачи, не завершенные до перезапуска
+    jobs.start()
+    if pool_filler:
+        pool_filler.start()
+
+async def on_shutdown():
+    await sweeper.stop()
+    # Незавершенные задачи возвращаются в очередь до следующего запуска
+    await jobs.stop()
+    logging.info(f"Generation queue stats: {await jobs.stats()}")
+    await limiter.stop()
+    logging.info(f"Limiter stats: {limiter.stats()}")
+    if pool_filler:
+        await pool_filler.stop()
+        logging.info(f"Plan pool stats: {pool_filler.stats()}")
+    logging.info(f"Gemini stats: {gemini.stats()}")
+    if gemini.plan_cache:
+        logging.info(f"Plan cache stats: {gemini.plan_cache.stats()}")
+    gemini.close()
+    if gemini.telemetry:
+        # Дописываем накопленные строки model_calls до закрытия базы
+        await asyncio.get_running_loop().run_in_executor(None, gemini.telemetry.close)
+    # Закрываем пул соединений с базой
+    await db.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 async def main():
     # Запуск бота
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
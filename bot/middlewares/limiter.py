@@ -0,0 +1,65 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from bot.services.limiter import LimiterService
+
+# Messages that start or complete a free generation
+LIMITED_COMMANDS = ('/generateforday',)
+LIMITED_STATES = ('GenerateStates:waiting_for_calories',)
+
+def limit_message(retry_after: float) -> str:
+    hours, minutes = divmod(int(retry_after // 60) + 1, 60)
+    wait = f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+    return (
+        "⏳ Лимит бесплатных генераций исчерпан.\n"
+        f"Следующий план будет доступен через {wait}.\n"
+        "Используйте команду /subscribe для неограниченной генерации."
+    )
+
+class LimiterMiddleware(BaseMiddleware):
+    """Outer message middleware of the generate router enforcing the free limit.
+
+    Subscribers pass untouched; their status comes from the database's
+    subscription cache, so only a cache miss costs a query. Free users with
+    an empty bucket are stopped at /generateforday and at the calories
+    step; otherwise the handler gets the limiter as `limiter` and takes the
+    generation from the bucket when it queues the job.
+    """
+
+    def __init__(self, limiter: LimiterService, db):
+        self.limiter = limiter
+        self.db = db
+
+    @staticmethod
+    def _is_generation(event: Message, raw_state) -> bool:
+        if raw_state in LIMITED_STATES:
+            return True
+        # Commands may carry the bot's username: /generateforday@bot
+        words = (event.text or "").split(maxsplit=1)
+        return bool(words) and words[0].split('@')[0] in LIMITED_COMMANDS
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not event.from_user or not self._is_generation(event, data.get('raw_state')):
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        is_subscribed = self.db.cached_subscription_status(user_id)
+        if is_subscribed is None:
+            is_subscribed = await self.db.get_subscription_status(user_id)
+        if is_subscribed:
+            return await handler(event, data)
+
+        if not self.limiter.can_generate(user_id):
+            await event.answer(limit_message(self.limiter.retry_after(user_id)))
+            if data.get('raw_state') and data.get('state'):
+                await data['state'].clear()
+            return None
+        data['limiter'] = self.limiter
+        return await handler(event, data)
@@ -1,69 +1,328 @@
 import sqlite3
-from typing import Dict, Optional, List
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, List
 from datetime import datetime
+import time
 import logging
+from bot.services.cache import MISSING, TTLCache
+from bot.services.migrations import (
+    HOUR_BUCKETS,
+    MAX_USER_ID,
+    PLAN_TYPES,
+    STATS_COLUMNS,
+    migrate,
+    rebuild_user_stats_batch
+)
 
-class DatabaseService:
-    def __init__(self, db_path: str = "bot.db"):
+# Applied to every pooled connection. WAL lets readers run concurrently with
+# the single writer, NORMAL sync is durable across app crashes in WAL mode.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+class ConnectionPool:
+    """Small pool of long-lived SQLite connections shared between threads"""
+
+    def __init__(self, db_path: str, size: int = 4,
+                 initializer: Optional[Callable[[sqlite3.Connection], None]] = None):
         self.db_path = db_path
-        self._init_db()
+        self.size = size
+        self._initializer = initializer
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
 
-    def _init_db(self):
-        """Initialize database with required tables"""
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                # Create user profiles table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_profiles (
-                        user_id INTEGER PRIMARY KEY,
-                        age INTEGER,
-                        gender TEXT,
-                        weight INTEGER,
-                        height INTEGER,
-                        goal TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                # Create subscriptions table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS subscriptions (
-                        user_id INTEGER PRIMARY KEY,
-                        plan TEXT,
-                        start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        end_date TIMESTAMP,
-                        is_active BOOLEAN DEFAULT TRUE,
-                        FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
-                    )
-                """)
-                # Create generation history table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS generation_history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        plan_type TEXT,
-                        calories INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
-                    )
-                """)
-                # Create meals table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS meals (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        type TEXT,
-                        name TEXT,
-                        calories INTEGER,
-                        protein INTEGER,
-                        carbs INTEGER,
-                        fat INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
-                    )
-                """)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            # Runs once, on the first connection, instead of at import time
+            if self._initializer:
+                self._initializer(conn)
+                self._initializer = None
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error"""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+class WriteBehindQueue:
+    """Bounded in-memory buffer of INSERTs flushed in one transaction per batch"""
+
+    def __init__(self, writer: Callable[[Dict[str, List[tuple]]], None],
+                 flush_interval_ms: int = 50, max_batch: int = 200, max_pending: int = 10000):
+        self._writer = writer
+        self._interval = flush_interval_ms / 1000
+        self._max_batch = max_batch
+        self._max_pending = max(max_pending, max_batch)
+        self._pending: Dict[str, List[tuple]] = {}
+        self._count = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, kind: str, row: tuple, block: bool = True) -> bool:
+        """Queue a row; blocks the caller while the buffer is full, or
+        drops the row and returns False when `block` is off"""
+        with self._cond:
+            while self._count >= self._max_pending and not self._closed:
+                self._cond.notify_all()
+                if not block:
+                    return False
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._pending.setdefault(kind, []).append(row)
+            self._count += 1
+            if self._count >= self._max_batch:
+                self._cond.notify_all()
+        return True
+
+    def _take(self) -> Dict[str, List[tuple]]:
+        batch, self._pending, self._count = self._pending, {}, 0
+        self._cond.notify_all()
+        return batch
+
+    def _write(self, batch: Dict[str, List[tuple]]):
+        if not batch:
+            return
+        try:
+            self._writer(batch)
+        except Exception as e:
+            lost = sum(len(rows) for rows in batch.values())
+            logging.error(f"Error flushing write-behind batch, {lost} rows lost: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and self._count < self._max_batch:
+                    self._cond.wait(self._interval)
+                if self._closed:
+                    return
+                batch = self._take()
+            self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        with self._cond:
+            batch = self._take()
+        self._write(batch)
+
+    def close(self):
+        """Stop the flusher thread and write the remaining rows"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+INSERT_GENERATION_SQL = """
+    INSERT INTO generation_history
+    (user_id, plan_type, calories, created_at, meal_type)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+INSERT_MODEL_CALL_SQL = """
+    INSERT INTO model_calls
+    (created_at, model, plan_type, outcome, cache_hit, wall_ms, ttfc_ms, prompt_tokens, output_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_MEAL_SQL = """
+    INSERT INTO meals
+    (user_id, type, name, calories, protein, carbs, fat, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+STATS_INDEX = {column: i for i, column in enumerate(STATS_COLUMNS)}
+
+UPSERT_USER_STATS_SQL = f"""
+    INSERT INTO user_stats (user_id, {', '.join(STATS_COLUMNS)}, first_at, last_at)
+    VALUES ({', '.join('?' * (len(STATS_COLUMNS) + 3))})
+    ON CONFLICT(user_id) DO UPDATE SET
+        {', '.join(f'{c} = {c} + excluded.{c}' for c in STATS_COLUMNS)},
+        first_at = MIN(COALESCE(first_at, excluded.first_at), excluded.first_at),
+        last_at = MAX(COALESCE(last_at, excluded.last_at), excluded.last_at)
+"""
+
+def _profile_from_row(r: tuple) -> Dict:
+    return {
+        'age': r[0],
+        'gender': r[1],
+        'weight': r[2],
+        'height': r[3],
+        'goal': r[4]
+    }
+
+def _meal_row(user_id: int, meal_data: Dict, source: str = 'user') -> tuple:
+    return (
+        user_id,
+        meal_data['type'],
+        meal_data['name'],
+        meal_data['calories'],
+        meal_data['protein'],
+        meal_data['carbs'],
+        meal_data['fat'],
+        source
+    )
+
+def _meal_from_row(r: tuple) -> Dict:
+    return {
+        'type': r[0],
+        'name': r[1],
+        'calories': r[2],
+        'protein': r[3],
+        'carbs': r[4],
+        'fat': r[5],
+        'timestamp': r[6]
+    }
+
+JOB_COLUMNS = (
+    'id', 'user_id', 'chat_id', 'message_id', 'days', 'meal_type', 'calories',
+    'priority', 'attempts', 'created_at', 'enqueued_at'
+)
+
+def _stats_deltas(rows: List[tuple]) -> List[tuple]:
+    """Fold generation_history rows into per-user user_stats increments"""
+    deltas = {}
+    for user_id, plan_type, _, created_at, _ in rows:
+        counts, first_at, last_at = deltas.get(user_id, ([0] * len(STATS_COLUMNS), created_at, created_at))
+        local = datetime.fromtimestamp(created_at)
+        counts[STATS_INDEX['total']] += 1
+        if plan_type in PLAN_TYPES:
+            counts[STATS_INDEX[f'plan_{plan_type}']] += 1
+        counts[STATS_INDEX[f'weekday_{local.weekday()}']] += 1
+        counts[STATS_INDEX[f'hour_{HOUR_BUCKETS[local.hour // 6]}']] += 1
+        deltas[user_id] = (counts, min(first_at, created_at), max(last_at, created_at))
+    return [
+        (user_id, *counts, first_at, last_at)
+        for user_id, (counts, first_at, last_at) in deltas.items()
+    ]
+
+class DatabaseService:
+    def __init__(self, db_path: str = "bot.db", pool_size: int = 4,
+                 write_behind: bool = False, flush_interval_ms: int = 50,
+                 flush_max_rows: int = 200, max_pending_writes: int = 10000,
+                 cache_size: int = 10000, cache_ttl: float = 300.0):
+        self.db_path = db_path
+        self._pool = ConnectionPool(db_path, pool_size, initializer=self._init_db)
+        self._profile_cache = TTLCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._subscription_cache = TTLCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._write_queue = None
+        if write_behind:
+            self._write_queue = WriteBehindQueue(
+                self._write_batch,
+                flush_interval_ms=flush_interval_ms,
+                max_batch=flush_max_rows,
+                max_pending=max_pending_writes
+            )
+
+    def _insert_generations(self, conn: sqlite3.Connection, rows: List[tuple]):
+        """Insert history rows and bump user_stats in the caller's transaction"""
+        conn.executemany(INSERT_GENERATION_SQL, rows)
+        conn.executemany(UPSERT_USER_STATS_SQL, _stats_deltas(rows))
+
+    def _write_batch(self, batch: Dict[str, List[tuple]]):
+        """Insert a write-behind batch in a single transaction"""
+        with self._pool.connection() as conn:
+            if 'generation' in batch:
+                self._insert_generations(conn, batch['generation'])
+            if 'meal' in batch:
+                conn.executemany(INSERT_MEAL_SQL, batch['meal'])
+        logging.info(f"Flushed write-behind batch: { {k: len(v) for k, v in batch.items()} }")
+
+    @contextmanager
+    def _durable_connection(self):
+        """Connection whose commit is fsynced before returning (synchronous=FULL)"""
+        with self._pool.connection() as conn:
+            conn.execute("PRAGMA synchronous=FULL")
+            try:
+                yield conn
                 conn.commit()
-                logging.info("Database initialized successfully")
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                # The level can't change inside a transaction, so only after
+                # the commit or rollback above
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit/miss counters of the profile and subscription caches"""
+        return {
+            name: cache.stats()
+            for name, cache in (('profile', self._profile_cache), ('subscription', self._subscription_cache))
+            if cache
+        }
+
+    def flush(self):
+        """Write out queued write-behind rows"""
+        if self._write_queue:
+            self._write_queue.flush()
+
+    def close(self):
+        """Flush queued writes and release pooled connections"""
+        logging.info(f"Cache stats: {self.cache_stats()}")
+        if self._write_queue:
+            self._write_queue.close()
+            self._write_queue = None
+        self._pool.close()
+
+    def _init_db(self, conn: sqlite3.Connection):
+        """Bring the database schema up to date (called for the first pooled connection)"""
+        try:
+            started = time.perf_counter()
+            applied = migrate(conn)
+            if applied:
+                logging.info(f"Applied migrations: {applied}")
+            logging.info(f"Database initialized successfully in {(time.perf_counter() - started) * 1000:.0f} ms")
         except Exception as e:
             logging.error(f"Error initializing database: {e}")
             raise
@@ -72,7 +331,7 @@ class DatabaseService:
         """Save user profile to database"""
         try:
             logging.info(f"Saving profile for user {user_id} with data: {data}")
-            with sqlite3.connect(self.db_path) as conn:
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR REPLACE INTO user_profiles 
@@ -88,16 +347,32 @@ class DatabaseService:
                 ))
                 conn.commit()
                 logging.info("Profile saved successfully")
+            if self._profile_cache:
+                self._profile_cache.invalidate(user_id)
             return True
         except Exception as e:
             logging.error(f"Error saving profile: {e}")
             return False
 
     def get_profile(self, user_id: int) -> Optional[Dict]:
-        """Get user profile from database"""
+        """Get user profile, served from the cache when possible"""
+        cache = self._profile_cache
+        if cache:
+            cached = cache.get(user_id)
+            if cached is not MISSING:
+                # Callers add request-specific keys to the returned dict
+                return dict(cached) if cached else None
+            token = cache.token()
+        profile = self._load_profile(user_id)
+        if cache and profile is not MISSING:
+            cache.set(user_id, profile, token=token)
+        return dict(profile) if profile else None
+
+    def _load_profile(self, user_id: int):
+        """Get user profile from database (MISSING on error)"""
         try:
             logging.info(f"Getting profile for user {user_id}")
-            with sqlite3.connect(self.db_path) as conn:
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT age, gender, weight, height, goal
@@ -107,26 +382,21 @@ class DatabaseService:
                 result = cursor.fetchone()
                 
                 if result:
-                    profile = {
-                        'age': result[0],
-                        'gender': result[1],
-                        'weight': result[2],
-                        'height': result[3],
-                        'goal': result[4]
-                    }
+                    profile = _profile_from_row(result)
                     logging.info(f"Found profile: {profile}")
                     return profile
                 logging.info("No profile found")
                 return None
         except Exception as e:
             logging.error(f"Error getting profile: {e}")
-            return None
+            return MISSING
 
     def update_subscription(self, user_id: int, plan: str, duration_days: int) -> bool:
         """Update user subscription"""
         try:
             logging.info(f"Updating subscription for user {user_id} with plan {plan} for {duration_days} days")
-            with sqlite3.connect(self.db_path) as conn:
+            # Payment writes never go through write-behind and are fsynced on commit
+            with self._durable_connection() as conn:
                 cursor = conn.cursor()
                 end_date = datetime.now().timestamp() + (duration_days * 24 * 60 * 60)
                 cursor.execute("""
@@ -134,48 +404,145 @@ class DatabaseService:
                     (user_id, plan, end_date, is_active)
                     VALUES (?, ?, ?, ?)
                 """, (user_id, plan, end_date, True))
-                conn.commit()
                 logging.info("Subscription updated successfully")
+            if self._subscription_cache:
+                self._subscription_cache.invalidate(user_id)
             return True
         except Exception as e:
             logging.error(f"Error updating subscription: {e}")
             return False
 
     def get_subscription_status(self, user_id: int) -> bool:
-        """Check if user has active subscription"""
+        """Check if user has active subscription, served from the cache when possible"""
+        cache = self._subscription_cache
+        if cache:
+            cached = cache.get(user_id)
+            if cached is not MISSING:
+                return cached
+            token = cache.token()
+        end_date = self._load_subscription_end(user_id)
+        if end_date is MISSING:
+            return False
+        is_active = end_date is not None
+        if cache:
+            # An active entry expires exactly when the subscription does
+            expires_at = min(end_date, time.time() + cache.ttl) if is_active else None
+            cache.set(user_id, is_active, expires_at=expires_at, token=token)
+        return is_active
+
+    def cached_subscription_status(self, user_id: int) -> Optional[bool]:
+        """Subscription status if it is in the cache, None otherwise; never queries"""
+        if not self._subscription_cache:
+            return None
+        cached = self._subscription_cache.get(user_id)
+        return None if cached is MISSING else cached
+
+    def _load_subscription_end(self, user_id: int):
+        """End date of the active subscription, None if there is none, MISSING on error"""
         try:
             logging.info(f"Checking subscription status for user {user_id}")
-            with sqlite3.connect(self.db_path) as conn:
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
+                # Lapsed rows are deactivated by the sweeper, the end_date
+                # check only covers the gap until its next pass
                 cursor.execute("""
-                    SELECT is_active, end_date
+                    SELECT end_date
                     FROM subscriptions
-                    WHERE user_id = ? AND is_active = TRUE
-                """, (user_id,))
+                    WHERE user_id = ? AND is_active = TRUE AND end_date > ?
+                """, (user_id, time.time()))
                 result = cursor.fetchone()
                 
                 if result:
-                    is_active, end_date = result
-                    if is_active and datetime.now().timestamp() < end_date:
-                        logging.info("Active subscription found")
-                        return True
+                    logging.info("Active subscription found")
+                    return result[0]
                 logging.info("No active subscription found")
-                return False
+                return None
         except Exception as e:
             logging.error(f"Error checking subscription: {e}")
-            return False
+            return MISSING
 
-    def save_generation(self, user_id: int, plan_type: str, calories: int) -> bool:
-        """Save generation history"""
+    def deactivate_expired_subscriptions(self, batch_size: int = 500) -> List[Dict]:
+        """Clear is_active on up to batch_size lapsed subscriptions and return them"""
         try:
-            logging.info(f"Saving generation for user {user_id}: {plan_type}, {calories} calories")
-            with sqlite3.connect(self.db_path) as conn:
+            now = time.time()
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
                 cursor.execute("""
-                    INSERT INTO generation_history 
-                    (user_id, plan_type, calories)
-                    VALUES (?, ?, ?)
-                """, (user_id, plan_type, calories))
+                    SELECT user_id, plan, end_date
+                    FROM subscriptions
+                    WHERE is_active = TRUE AND end_date <= ?
+                    ORDER BY end_date
+                    LIMIT ?
+                """, (now, batch_size))
+                expired = [{
+                    'user_id': r[0],
+                    'plan': r[1],
+                    'end_date': r[2]
+                } for r in cursor.fetchall()]
+                cursor.executemany(
+                    "UPDATE subscriptions SET is_active = FALSE WHERE user_id = ?",
+                    [(e['user_id'],) for e in expired]
+                )
+                conn.commit()
+            if self._subscription_cache:
+                for e in expired:
+                    self._subscription_cache.invalidate(e['user_id'])
+            if expired:
+                logging.info(f"Deactivated {len(expired)} expired subscriptions")
+            return expired
+        except Exception as e:
+            logging.error(f"Error deactivating expired subscriptions: {e}")
+            return []
+
+    def get_subscriptions_to_remind(self, within_seconds: float, batch_size: int = 500) -> List[Dict]:
+        """Active subscriptions ending within the window that were not reminded yet"""
+        try:
+            now = time.time()
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT user_id, plan, end_date
+                    FROM subscriptions
+                    WHERE is_active = TRUE AND end_date > ? AND end_date <= ?
+                        AND reminded_at IS NULL
+                    ORDER BY end_date
+                    LIMIT ?
+                """, (now, now + within_seconds, batch_size))
+                return [{
+                    'user_id': r[0],
+                    'plan': r[1],
+                    'end_date': r[2]
+                } for r in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error getting subscriptions to remind: {e}")
+            return []
+
+    def mark_subscriptions_reminded(self, user_ids: List[int]) -> bool:
+        """Record that a renewal reminder was sent"""
+        try:
+            with self._pool.connection() as conn:
+                conn.executemany(
+                    "UPDATE subscriptions SET reminded_at = ? WHERE user_id = ?",
+                    [(int(time.time()), user_id) for user_id in user_ids]
+                )
+                conn.commit()
+            return True
+        except Exception as e:
+            logging.error(f"Error marking subscriptions reminded: {e}")
+            return False
+
+    def save_generation(self, user_id: int, plan_type: str, calories: int,
+                        meal_type: Optional[str] = None, durable: bool = False) -> bool:
+        """Save generation history (queued in write-behind mode unless durable)"""
+        try:
+            logging.info(f"Saving generation for user {user_id}: {plan_type}, {calories} calories")
+            row = (user_id, plan_type, calories, int(time.time()), meal_type)
+            if self._write_queue and not durable:
+                self._write_queue.put('generation', row)
+                return True
+            with self._pool.connection() as conn:
+                self._insert_generations(conn, [row])
                 conn.commit()
                 logging.info("Generation saved successfully")
             return True
@@ -187,7 +554,7 @@ class DatabaseService:
         """Get user's generation history"""
         try:
             logging.info(f"Getting generation history for user {user_id}")
-            with sqlite3.connect(self.db_path) as conn:
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT plan_type, calories, created_at
@@ -208,58 +575,659 @@ class DatabaseService:
             logging.error(f"Error getting generation history: {e}")
             return []
 
+    def get_generation_stats(self, user_id: int, detailed: bool = False) -> Optional[Dict]:
+        """Get user's generation stats from the user_stats rollup.
+
+        Returns totals per plan type, the last 7 days count and first/last
+        generation time; with detailed=True also weekday (Monday first) and
+        time-of-day histograms in local time.
+        """
+        try:
+            logging.info(f"Getting generation stats for user {user_id}")
+            week_ago = int(time.time()) - 7 * 24 * 60 * 60
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {', '.join(STATS_COLUMNS)}, first_at, last_at
+                    FROM user_stats
+                    WHERE user_id = ?
+                """, (user_id,))
+                row = cursor.fetchone() or (0,) * len(STATS_COLUMNS) + (None, None)
+                counts = dict(zip(STATS_COLUMNS, row))
+                stats = {
+                    'total': counts['total'],
+                    'plan_types': {
+                        plan_type: counts[f'plan_{plan_type}']
+                        for plan_type in PLAN_TYPES
+                        if counts[f'plan_{plan_type}']
+                    },
+                    'first_at': row[-2],
+                    'last_at': row[-1]
+                }
+                # Index range scan over the last week only
+                cursor.execute("""
+                    SELECT COUNT(*)
+                    FROM generation_history
+                    WHERE user_id = ? AND created_at >= ?
+                """, (user_id, week_ago))
+                stats['last_week'] = cursor.fetchone()[0]
+
+                if detailed:
+                    stats['weekdays'] = [counts[f'weekday_{day}'] for day in range(7)]
+                    stats['hours'] = {bucket: counts[f'hour_{bucket}'] for bucket in HOUR_BUCKETS}
+
+                logging.info(f"Generation stats: {stats}")
+                return stats
+        except Exception as e:
+            logging.error(f"Error getting generation stats: {e}")
+            return None
+
+    def rebuild_user_stats(self, batch_size: int = 500) -> int:
+        """Recompute user_stats from generation_history, batch_size users per transaction"""
+        self.flush()
+        rebuilt = 0
+        after = -1
+        with self._pool.connection() as conn:
+            while after != MAX_USER_ID:
+                conn.execute("BEGIN IMMEDIATE")
+                users, after = rebuild_user_stats_batch(conn, after, batch_size)
+                conn.commit()
+                rebuilt += users
+                logging.info(f"Rebuilt user_stats for {rebuilt} users")
+        return rebuilt
+
     def get_user_meals(self, user_id: int, limit: int = 5) -> List[Dict]:
-        """Get user's recent meals"""
+        """Get user's recent meals (entered by the user, not from generated plans)"""
         try:
             logging.info(f"Getting meals for user {user_id} with limit {limit}")
-            with sqlite3.connect(self.db_path) as conn:
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT type, name, calories, protein, carbs, fat, created_at
                     FROM meals
-                    WHERE user_id = ?
+                    WHERE user_id = ? AND source = 'user'
                     ORDER BY created_at DESC
                     LIMIT ?
                 """, (user_id, limit))
                 results = cursor.fetchall()
                 
-                meals = [{
-                    'type': r[0],
-                    'name': r[1],
-                    'calories': r[2],
-                    'protein': r[3],
-                    'carbs': r[4],
-                    'fat': r[5],
-                    'timestamp': r[6]
-                } for r in results]
+                meals = [_meal_from_row(r) for r in results]
                 logging.info(f"Found {len(meals)} meals")
                 return meals
         except Exception as e:
             logging.error(f"Error getting user meals: {e}")
             return []
 
-    def save_meal(self, user_id: int, meal_data: Dict) -> bool:
-        """Save a meal to the database"""
+    def get_user_context(self, user_id: int, meals_limit: int = 5) -> Optional[Dict]:
+        """Get profile, subscription flag and recent meals in one read transaction.
+
+        Returns {'profile', 'is_subscribed', 'meals'} or None on error.
+        """
+        profile_cache, subscription_cache = self._profile_cache, self._subscription_cache
+        if profile_cache and subscription_cache and meals_limit <= 0:
+            profile = profile_cache.get(user_id)
+            is_subscribed = subscription_cache.get(user_id)
+            if profile is not MISSING and is_subscribed is not MISSING:
+                return {
+                    'profile': dict(profile) if profile else None,
+                    'is_subscribed': is_subscribed,
+                    'meals': []
+                }
+        tokens = (
+            profile_cache.token() if profile_cache else None,
+            subscription_cache.token() if subscription_cache else None
+        )
         try:
-            logging.info(f"Saving meal for user {user_id}: {meal_data}")
-            with sqlite3.connect(self.db_path) as conn:
+            logging.info(f"Getting context for user {user_id} with {meals_limit} meals")
+            now = time.time()
+            with self._pool.connection() as conn:
                 cursor = conn.cursor()
+                # Both reads see the same WAL snapshot
+                cursor.execute("BEGIN")
                 cursor.execute("""
-                    INSERT INTO meals 
-                    (user_id, type, name, calories, protein, carbs, fat)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    user_id,
-                    meal_data['type'],
-                    meal_data['name'],
-                    meal_data['calories'],
-                    meal_data['protein'],
-                    meal_data['carbs'],
-                    meal_data['fat']
-                ))
+                    SELECT p.age, p.gender, p.weight, p.height, p.goal, s.end_date
+                    FROM user_profiles p
+                    LEFT JOIN subscriptions s
+                        ON s.user_id = p.user_id AND s.is_active = TRUE AND s.end_date > ?
+                    WHERE p.user_id = ?
+                """, (now, user_id))
+                result = cursor.fetchone()
+                meals = []
+                if result and meals_limit > 0:
+                    # Meals of generated plans would make every later plan
+                    # personal and bypass the plan cache and pool
+                    cursor.execute("""
+                        SELECT type, name, calories, protein, carbs, fat, created_at
+                        FROM meals
+                        WHERE user_id = ? AND source = 'user'
+                        ORDER BY created_at DESC
+                        LIMIT ?
+                    """, (user_id, meals_limit))
+                    meals = [_meal_from_row(r) for r in cursor.fetchall()]
+                conn.commit()
+        except Exception as e:
+            logging.error(f"Error getting user context: {e}")
+            return None
+
+        profile = _profile_from_row(result) if result else None
+        end_date = result[5] if result else None
+        if profile_cache:
+            profile_cache.set(user_id, profile, token=tokens[0])
+        # Without a profile the join tells nothing about the subscription
+        if subscription_cache and result:
+            expires_at = min(end_date, now + subscription_cache.ttl) if end_date else None
+            subscription_cache.set(user_id, end_date is not None, expires_at=expires_at, token=tokens[1])
+        return {
+            'profile': dict(profile) if profile else None,
+            'is_subscribed': end_date is not None,
+            'meals': meals
+        }
+
+    def save_meal(self, user_id: int, meal_data: Dict, durable: bool = False) -> bool:
+        """Save a meal to the database (queued in write-behind mode unless durable)"""
+        try:
+            logging.info(f"Saving meal for user {user_id}: {meal_data}")
+            row = _meal_row(user_id, meal_data)
+            if self._write_queue and not durable:
+                self._write_queue.put('meal', row)
+                return True
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(INSERT_MEAL_SQL, row)
                 conn.commit()
                 logging.info("Meal saved successfully")
             return True
         except Exception as e:
             logging.error(f"Error saving meal: {e}")
-            return False 
\ No newline at end of file
+            return False 
+
+    def save_meals(self, user_id: int, meals: List[Dict], durable: bool = False,
+                   source: str = 'user') -> bool:
+        """Save several meals in one transaction (queued in write-behind mode unless durable).
+
+        source is 'plan' for meals of a generated plan.
+        """
+        try:
+            logging.info(f"Saving {len(meals)} meals for user {user_id}")
+            rows = [_meal_row(user_id, meal_data, source) for meal_data in meals]
+            if self._write_queue and not durable:
+                for row in rows:
+                    self._write_queue.put('meal', row)
+                return True
+            with self._pool.connection() as conn:
+                conn.executemany(INSERT_MEAL_SQL, rows)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving meals: {e}")
+            return False
+
+    def get_cached_plans(self, cache_key: str, min_created_at: int) -> List[tuple]:
+        """(created_at, plan) variants cached under the key, newest first"""
+        try:
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT created_at, plan
+                    FROM plan_cache
+                    WHERE cache_key = ? AND created_at >= ?
+                    ORDER BY created_at DESC
+                """, (cache_key, min_created_at))
+                return cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Error getting cached plans: {e}")
+            return []
+
+    def save_cached_plan(self, cache_key: str, plan: str, max_variants: int,
+                         max_rows: int, min_created_at: int) -> bool:
+        """Store a plan variant and trim the key, expired rows and the table size"""
+        try:
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO plan_cache (cache_key, plan, created_at) VALUES (?, ?, ?)",
+                    (cache_key, plan, int(time.time()))
+                )
+                cursor.execute("""
+                    DELETE FROM plan_cache
+                    WHERE cache_key = ? AND id NOT IN (
+                        SELECT id FROM plan_cache
+                        WHERE cache_key = ?
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
+                    )
+                """, (cache_key, cache_key, max_variants))
+                cursor.execute("DELETE FROM plan_cache WHERE created_at < ?", (min_created_at,))
+                # Ids grow with insertion time, so this drops the oldest rows
+                cursor.execute("""
+                    DELETE FROM plan_cache
+                    WHERE id <= (SELECT id FROM plan_cache ORDER BY id DESC LIMIT 1 OFFSET ?)
+                """, (max_rows,))
+                conn.commit()
+            return True
+        except Exception as e:
+            logging.error(f"Error saving cached plan: {e}")
+            return False
+
+    def get_top_buckets(self, since: int, limit: int, calories_step: int) -> List[Dict]:
+        """Most requested daily plan buckets (goal, gender, calorie band, diet type)
+        since the given time, with the average profile of each bucket"""
+        try:
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT
+                        p.goal,
+                        p.gender,
+                        CAST(ROUND(gh.calories * 1.0 / ?) * ? AS INTEGER) AS band,
+                        COALESCE(gh.meal_type, 'balanced') AS diet,
+                        COUNT(*) AS requests,
+                        CAST(ROUND(AVG(p.age)) AS INTEGER),
+                        CAST(ROUND(AVG(p.weight)) AS INTEGER),
+                        CAST(ROUND(AVG(p.height)) AS INTEGER)
+                    FROM generation_history gh
+                    JOIN user_profiles p ON p.user_id = gh.user_id
+                    WHERE gh.created_at >= ? AND gh.plan_type = 'daily'
+                    GROUP BY p.goal, p.gender, band, diet
+                    ORDER BY requests DESC
+                    LIMIT ?
+                """, (calories_step, calories_step, since, limit))
+                return [
+                    {
+                        'goal': r[0],
+                        'gender': r[1],
+                        'calories': r[2],
+                        'meal_type': r[3],
+                        'requests': r[4],
+                        'age': r[5],
+                        'weight': r[6],
+                        'height': r[7]
+                    }
+                    for r in cursor.fetchall()
+                ]
+        except Exception as e:
+            logging.error(f"Error getting top buckets: {e}")
+            return []
+
+    def count_pool_plans(self, min_created_at: int) -> Dict[str, int]:
+        """Number of fresh pre-generated plans per bucket"""
+        try:
+            with self._pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT bucket_key, COUNT(*)
+                    FROM plan_pool
+                    WHERE created_at >= ?
+                    GROUP BY bucket_key
+                """, (min_created_at,))
+                return dict(cursor.fetchall())
+        except Exception as e:
+            logging.error(f"Error counting pool plans: {e}")
+            return {}
+
+    def add_pool_plan(self, bucket_key: str, plan: str) -> bool:
+        try:
+            with self._pool.connection() as conn:
+                conn.execute(
+                    "INSERT INTO plan_pool (bucket_key, plan, created_at) VALUES (?, ?, ?)",
+                    (bucket_key, plan, int(time.time()))
+                )
+            return True
+        except Exception as e:
+            logging.error(f"Error adding pool plan: {e}")
+            return False
+
+    def take_pool_plan(self, bucket_key: str, min_created_at: int) -> Optional[str]:
+        """Remove and return the oldest fresh plan of the bucket"""
+        try:
+            with self._pool.connection() as conn:
+                # A single statement, so two takers never get the same row
+                rows = conn.execute("""
+                    DELETE FROM plan_pool
+                    WHERE id = (
+                        SELECT id FROM plan_pool
+                        WHERE bucket_key = ? AND created_at >= ?
+                        ORDER BY created_at
+                        LIMIT 1
+                    )
+                    RETURNING plan
+                """, (bucket_key, min_created_at)).fetchall()
+                return rows[0][0] if rows else None
+        except Exception as e:
+            logging.error(f"Error taking pool plan: {e}")
+            return None
+
+    def save_model_calls(self, rows: List[tuple]):
+        """Insert telemetry rows (INSERT_MODEL_CALL_SQL order) in one transaction"""
+        with self._pool.connection() as conn:
+            conn.executemany(INSERT_MODEL_CALL_SQL, rows)
+
+    def get_model_calls(self, since: int) -> List[Dict]:
+        """Telemetry rows recorded since the given epoch time"""
+        try:
+            with self._pool.connection() as conn:
+                cursor = conn.execute("""
+                    SELECT model, plan_type, outcome, cache_hit, wall_ms, ttfc_ms, prompt_tokens, output_tokens
+                    FROM model_calls
+                    WHERE created_at >= ?
+                """, (since,))
+                columns = [c[0] for c in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error getting model calls: {e}")
+            return []
+
+    def enqueue_job(self, user_id: int, chat_id: int, message_id: Optional[int],
+                    days: int, meal_type: str, calories: int, priority: str = 'free') -> Optional[int]:
+        """Queue a plan generation in a scheduling class, return the job id"""
+        try:
+            enqueued_at = time.time()
+            now = int(enqueued_at)
+            with self._pool.connection() as conn:
+                return conn.execute("""
+                    INSERT INTO generation_jobs
+                    (user_id, chat_id, message_id, days, meal_type, calories, priority,
+                     enqueued_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (user_id, chat_id, message_id, days, meal_type, calories, priority,
+                      enqueued_at, now, now)).lastrowid
+        except Exception as e:
+            logging.error(f"Error enqueuing generation job: {e}")
+            return None
+
+    def lease_jobs(self, limit: int, lease_seconds: float, priority: Optional[str] = None) -> List[Dict]:
+        """Mark up to `limit` queued jobs, or running jobs whose lease ran
+        out, as running until now + lease_seconds; oldest first, only of
+        the given scheduling class if set"""
+        now = int(time.time())
+        with self._pool.connection() as conn:
+            # A single statement, so two workers never lease the same job
+            rows = conn.execute(f"""
+                UPDATE generation_jobs
+                SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM generation_jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?))
+                      AND (? IS NULL OR priority = ?)
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING {', '.join(JOB_COLUMNS)}
+            """, (now + int(lease_seconds), now, now, priority, priority, limit)).fetchall()
+        return sorted((dict(zip(JOB_COLUMNS, row)) for row in rows), key=lambda job: job['id'])
+
+    def renew_job_lease(self, job_id: int, lease_seconds: float) -> bool:
+        try:
+            now = int(time.time())
+            with self._pool.connection() as conn:
+                return conn.execute("""
+                    UPDATE generation_jobs SET lease_until = ?, updated_at = ?
+                    WHERE id = ? AND status = 'running'
+                """, (now + int(lease_seconds), now, job_id)).rowcount > 0
+        except Exception as e:
+            logging.error(f"Error renewing job lease: {e}")
+            return False
+
+    def finish_job(self, job_id: int, status: str, error: Optional[str] = None) -> bool:
+        """Set a leased job to done, failed, or back to queued for a retry"""
+        try:
+            with self._pool.connection() as conn:
+                conn.execute("""
+                    UPDATE generation_jobs
+                    SET status = ?, error = ?, lease_until = NULL, updated_at = ?
+                    WHERE id = ?
+                """, (status, error, int(time.time()), job_id))
+            return True
+        except Exception as e:
+            logging.error(f"Error finishing job {job_id}: {e}")
+            return False
+
+    def release_jobs(self, job_ids: List[int]) -> int:
+        """Requeue jobs interrupted by a shutdown without counting the attempt"""
+        if not job_ids:
+            return 0
+        try:
+            with self._pool.connection() as conn:
+                return conn.executemany("""
+                    UPDATE generation_jobs
+                    SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_until = NULL
+                    WHERE id = ? AND status = 'running'
+                """, [(job_id,) for job_id in job_ids]).rowcount
+        except Exception as e:
+            logging.error(f"Error releasing jobs: {e}")
+            return 0
+
+    def count_jobs(self, by_priority: bool = False) -> Dict:
+        """Number of jobs per status, or per (priority, status) with by_priority"""
+        try:
+            with self._pool.connection() as conn:
+                if by_priority:
+                    rows = conn.execute(
+                        "SELECT priority, status, COUNT(*) FROM generation_jobs GROUP BY priority, status"
+                    ).fetchall()
+                    return {(priority, status): count for priority, status, count in rows}
+                return dict(conn.execute(
+                    "SELECT status, COUNT(*) FROM generation_jobs GROUP BY status"
+                ).fetchall())
+        except Exception as e:
+            logging.error(f"Error counting jobs: {e}")
+            return {}
+
+    def prune_jobs(self, min_updated_at: int) -> int:
+        """Delete finished jobs last updated before the given time"""
+        try:
+            with self._pool.connection() as conn:
+                return conn.execute("""
+                    DELETE FROM generation_jobs
+                    WHERE status IN ('done', 'failed') AND updated_at < ?
+                """, (min_updated_at,)).rowcount
+        except Exception as e:
+            logging.error(f"Error pruning jobs: {e}")
+            return 0
+
+    def load_rate_limits(self, min_updated_at: float) -> List[tuple]:
+        """(user_id, tokens, updated_at) of buckets updated since the given time"""
+        try:
+            with self._pool.connection() as conn:
+                return conn.execute(
+                    "SELECT user_id, tokens, updated_at FROM rate_limits WHERE updated_at >= ?",
+                    (min_updated_at,)
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Error loading rate limits: {e}")
+            return []
+
+    def save_rate_limits(self, rows: List[tuple]) -> bool:
+        """Upsert (user_id, tokens, updated_at) rows in one transaction"""
+        try:
+            with self._pool.connection() as conn:
+                conn.executemany("""
+                    INSERT INTO rate_limits (user_id, tokens, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        tokens = excluded.tokens,
+                        updated_at = excluded.updated_at
+                """, rows)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving rate limits: {e}")
+            return False
+
+    def prune_rate_limits(self, max_updated_at: float) -> int:
+        """Delete buckets that have refilled since (last update before the given time)"""
+        try:
+            with self._pool.connection() as conn:
+                return conn.execute(
+                    "DELETE FROM rate_limits WHERE updated_at < ?", (max_updated_at,)
+                ).rowcount
+        except Exception as e:
+            logging.error(f"Error pruning rate limits: {e}")
+            return 0
+
+    def prune_pool(self, min_created_at: int) -> int:
+        """Delete stale pre-generated plans, return how many"""
+        try:
+            with self._pool.connection() as conn:
+                return conn.execute(
+                    "DELETE FROM plan_pool WHERE created_at < ?", (min_created_at,)
+                ).rowcount
+        except Exception as e:
+            logging.error(f"Error pruning plan pool: {e}")
+            return 0
+
+class AsyncDatabaseService:
+    """Awaitable DatabaseService that runs queries on a dedicated thread pool"""
+
+    def __init__(self, db_path: str = "bot.db", pool_size: int = 4, **options):
+        self.sync = DatabaseService(db_path, pool_size=pool_size, **options)
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix="db"
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(func, *args, **kwargs)
+        )
+
+    async def save_profile(self, user_id: int, data: Dict) -> bool:
+        return await self._run(self.sync.save_profile, user_id, data)
+
+    async def get_profile(self, user_id: int) -> Optional[Dict]:
+        return await self._run(self.sync.get_profile, user_id)
+
+    async def update_subscription(self, user_id: int, plan: str, duration_days: int) -> bool:
+        return await self._run(self.sync.update_subscription, user_id, plan, duration_days)
+
+    async def get_subscription_status(self, user_id: int) -> bool:
+        return await self._run(self.sync.get_subscription_status, user_id)
+
+    async def deactivate_expired_subscriptions(self, batch_size: int = 500) -> List[Dict]:
+        return await self._run(self.sync.deactivate_expired_subscriptions, batch_size)
+
+    async def get_subscriptions_to_remind(self, within_seconds: float, batch_size: int = 500) -> List[Dict]:
+        return await self._run(self.sync.get_subscriptions_to_remind, within_seconds, batch_size)
+
+    async def mark_subscriptions_reminded(self, user_ids: List[int]) -> bool:
+        return await self._run(self.sync.mark_subscriptions_reminded, user_ids)
+
+    async def save_generation(self, user_id: int, plan_type: str, calories: int,
+                              meal_type: Optional[str] = None, durable: bool = False) -> bool:
+        return await self._run(self.sync.save_generation, user_id, plan_type, calories, meal_type, durable)
+
+    async def get_generation_history(self, user_id: int) -> List[Dict]:
+        return await self._run(self.sync.get_generation_history, user_id)
+
+    async def get_generation_stats(self, user_id: int, detailed: bool = False) -> Optional[Dict]:
+        return await self._run(self.sync.get_generation_stats, user_id, detailed)
+
+    async def rebuild_user_stats(self, batch_size: int = 500) -> int:
+        return await self._run(self.sync.rebuild_user_stats, batch_size)
+
+    async def get_user_meals(self, user_id: int, limit: int = 5) -> List[Dict]:
+        return await self._run(self.sync.get_user_meals, user_id, limit)
+
+    async def get_user_context(self, user_id: int, meals_limit: int = 5) -> Optional[Dict]:
+        return await self._run(self.sync.get_user_context, user_id, meals_limit)
+
+    async def save_meal(self, user_id: int, meal_data: Dict, durable: bool = False) -> bool:
+        return await self._run(self.sync.save_meal, user_id, meal_data, durable)
+
+    async def save_meals(self, user_id: int, meals: List[Dict], durable: bool = False,
+                         source: str = 'user') -> bool:
+        return await self._run(self.sync.save_meals, user_id, meals, durable, source)
+
+    async def get_cached_plans(self, cache_key: str, min_created_at: int) -> List[tuple]:
+        return await self._run(self.sync.get_cached_plans, cache_key, min_created_at)
+
+    async def save_cached_plan(self, cache_key: str, plan: str, max_variants: int,
+                               max_rows: int, min_created_at: int) -> bool:
+        return await self._run(
+            self.sync.save_cached_plan, cache_key, plan, max_variants, max_rows, min_created_at
+        )
+
+    async def get_top_buckets(self, since: int, limit: int, calories_step: int) -> List[Dict]:
+        return await self._run(self.sync.get_top_buckets, since, limit, calories_step)
+
+    async def count_pool_plans(self, min_created_at: int) -> Dict[str, int]:
+        return await self._run(self.sync.count_pool_plans, min_created_at)
+
+    async def add_pool_plan(self, bucket_key: str, plan: str) -> bool:
+        return await self._run(self.sync.add_pool_plan, bucket_key, plan)
+
+    async def take_pool_plan(self, bucket_key: str, min_created_at: int) -> Optional[str]:
+        return await self._run(self.sync.take_pool_plan, bucket_key, min_created_at)
+
+    async def prune_pool(self, min_created_at: int) -> int:
+        return await self._run(self.sync.prune_pool, min_created_at)
+
+    async def enqueue_job(self, user_id: int, chat_id: int, message_id: Optional[int],
+                          days: int, meal_type: str, calories: int, priority: str = 'free') -> Optional[int]:
+        return await self._run(
+            self.sync.enqueue_job, user_id, chat_id, message_id, days, meal_type, calories, priority
+        )
+
+    async def lease_jobs(self, limit: int, lease_seconds: float, priority: Optional[str] = None) -> List[Dict]:
+        return await self._run(self.sync.lease_jobs, limit, lease_seconds, priority)
+
+    async def renew_job_lease(self, job_id: int, lease_seconds: float) -> bool:
+        return await self._run(self.sync.renew_job_lease, job_id, lease_seconds)
+
+    async def finish_job(self, job_id: int, status: str, error: Optional[str] = None) -> bool:
+        return await self._run(self.sync.finish_job, job_id, status, error)
+
+    async def release_jobs(self, job_ids: List[int]) -> int:
+        return await self._run(self.sync.release_jobs, job_ids)
+
+    async def count_jobs(self, by_priority: bool = False) -> Dict:
+        return await self._run(self.sync.count_jobs, by_priority)
+
+    async def prune_jobs(self, min_updated_at: int) -> int:
+        return await self._run(self.sync.prune_jobs, min_updated_at)
+
+    async def load_rate_limits(self, min_updated_at: float) -> List[tuple]:
+        return await self._run(self.sync.load_rate_limits, min_updated_at)
+
+    async def save_rate_limits(self, rows: List[tuple]) -> bool:
+        return await self._run(self.sync.save_rate_limits, rows)
+
+    async def prune_rate_limits(self, max_updated_at: float) -> int:
+        return await self._run(self.sync.prune_rate_limits, max_updated_at)
+
+    def cached_subscription_status(self, user_id: int) -> Optional[bool]:
+        return self.sync.cached_subscription_status(user_id)
+
+    async def flush(self):
+        await self._run(self.sync.flush)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        return self.sync.cache_stats()
+
+    async def close(self):
+        """Wait for in-flight queries, flush queued writes and close the pool"""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.sync.close()
+
+def create_database() -> AsyncDatabaseService:
+    """Build the AsyncDatabaseService configured in bot.config"""
+    from bot.config import (
+        DB_PATH,
+        DB_POOL_SIZE,
+        DB_WRITE_BEHIND,
+        DB_FLUSH_INTERVAL_MS,
+        DB_FLUSH_MAX_ROWS,
+        DB_MAX_PENDING_WRITES,
+        DB_CACHE_SIZE,
+        DB_CACHE_TTL
+    )
+    return AsyncDatabaseService(
+        DB_PATH,
+        pool_size=DB_POOL_SIZE,
+        write_behind=DB_WRITE_BEHIND,
+        flush_interval_ms=DB_FLUSH_INTERVAL_MS,
+        flush_max_rows=DB_FLUSH_MAX_ROWS,
+        max_pending_writes=DB_MAX_PENDING_WRITES,
+        cache_size=DB_CACHE_SIZE,
+        cache_ttl=DB_CACHE_TTL
+    )
@@ -1,44 +1,93 @@
-import google.generativeai as genai
-from bot.config import GEMINI_API_KEY
 import logging
 import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from bot.services.model_backends import GenAIBackend, ModelBackend, ModelResponse
+from bot.services.key_pool import KeyPool
+from bot.services.plan_render import Plan, compact_json, merge_plans, parse_plan, render_plan
+from bot.services.quota import QuotaExceededError, quota_message
+from bot.services.resilience import CircuitOpenError, RetryPolicy, is_retryable
+from bot.services.singleflight import SingleFlight
 
-genai.configure(api_key=GEMINI_API_KEY)
+MEAL_TYPE_NAMES = {
+    'balanced': 'сбалансированное',
+    'high_protein': 'высокобелковое',
+    'low_carb': 'низкоуглеводное',
+    'mediterranean': 'средиземноморское'
+}
 
-class GeminiService:
-    @staticmethod
-    async def generate_meal_plan(profile: dict, days: int, existing_meals: list = None) -> str:
-        """Generate meal plan using Gemini API"""
-        try:
-            # Validate profile
-            required_fields = ['age', 'gender', 'weight', 'height', 'goal']
-            missing_fields = [field for field in required_fields if field not in profile]
-            if missing_fields:
-                return f"❌ Необходимо предоставить полный профиль пользователя. Отсутствуют поля: {', '.join(missing_fields)}"
-
-            # Create model for each request
-            model = genai.GenerativeModel ('gemini-1.5-flash')
-            
-            # Format existing meals info
-            existing_meals_info = ""
-            if existing_meals and len(existing_meals) > 0:
-                existing_meals_info = "\nСуществующие приемы пищи:\n"
-                for meal in existing_meals:
-                    existing_meals_info += f"- {meal['type']}: {meal['name']} ({meal['calories']} ккал, {meal['protein']}г белка, {meal['carbs']}г углеводов, {meal['fat']}г жиров)\n"
+# Main protein source per day of a split weekly plan, so that days generated
+# in parallel don't end up with the same dishes
+WEEK_FOCUS = [
+    'курица',
+    'рыба',
+    'говядина',
+    'бобовые',
+    'яйца и творог',
+    'индейка',
+    'морепродукты'
+]
+
+def split_days(days: int, days_per_part: int) -> List[Tuple[int, int]]:
+    """(first_day, days) of each part of a plan generated in pieces"""
+    if days_per_part <= 0 or days <= days_per_part:
+        return [(1, days)]
+    return [(first, min(days_per_part, days - first + 1))
+            for first in range(1, days + 1, days_per_part)]
+
+def _week_focus(first_day: int, days: int, total_days: int) -> Tuple[List[str], List[str]]:
+    """Protein focus of the requested days and of the rest of the plan"""
+    last_day = first_day + days - 1
+    own = [WEEK_FOCUS[(day - 1) % len(WEEK_FOCUS)] for day in range(first_day, last_day + 1)]
+    others = [WEEK_FOCUS[(day - 1) % len(WEEK_FOCUS)] for day in range(1, total_days + 1)
+              if not first_day <= day <= last_day]
+    return own, others
 
-            # Convert gender to readable format
-            gender_display = "мужской" if profile['gender'] == 'male' else "женский"
+def build_prompt(profile: dict, days: int, existing_meals: list = None,
+                 meal_type: str = 'balanced', first_day: int = 1,
+                 total_days: Optional[int] = None) -> str:
+    """Render the meal plan prompt.
 
-            prompt = f"""Создай детальный план питания на {days} {'день' if days == 1 else 'дня'} для человека со следующими параметрами:
+    With total_days set the prompt asks for days first_day..first_day+days-1
+    of a longer plan and shares what the other days are built around.
+    """
+    # Format existing meals info
+    existing_meals_info = ""
+    if existing_meals and len(existing_meals) > 0:
+        existing_meals_info = "\nСуществующие приемы пищи:\n"
+        for meal in existing_meals:
+            existing_meals_info += f"- {meal['type']}: {meal['name']} ({meal['calories']} ккал, {meal['protein']}г белка, {meal['carbs']}г углеводов, {meal['fat']}г жиров)\n"
+
+    # Convert gender to readable format
+    gender_display = "мужской" if profile['gender'] == 'male' else "женский"
+
+    week_info = ""
+    final_notes = "5. В конце добавь общие рекомендации по приготовлению"
+    if total_days:
+        last_day = first_day + days - 1
+        own, others = _week_focus(first_day, days, total_days)
+        week_info = f"""
+
+Это часть плана на {total_days} дней: дни с {first_day} по {last_day}. Нумеруй дни начиная с {first_day}.
+Основной источник белка в эти дни (если не противоречит предпочтениям): {', '.join(own)}.
+Остальные дни плана построены вокруг: {', '.join(others)}. Не повторяй их блюда."""
+        if last_day < total_days:
+            final_notes = "5. Общие рекомендации по приготовлению не добавляй, они будут в конце плана"
+
+    prompt = f"""Создай детальный план питания на {days} {'день' if days == 1 else 'дня'} для человека со следующими параметрами:
 - Возраст: {profile['age']} лет
 - Пол: {gender_display}
 - Вес: {profile['weight']} кг
 - Рост: {profile['height']} см
 - Цель: {profile['goal']}
 - Калории в день: {profile.get('calories', 2000)}
+- Тип питания: {MEAL_TYPE_NAMES.get(meal_type, meal_type)}
 - Предпочтения в еде: {profile.get('food_preferences', 'нет ограничений')}
 - Аллергии: {profile.get('allergies', 'нет')}
-- Уровень активности: {profile.get('activity_level', 'умеренный')}{existing_meals_info}
+- Уровень активности: {profile.get('activity_level', 'умеренный')}{existing_meals_info}{week_info}
 
 План должен включать:
 1. Расписание приемов пищи (завтрак, обед, ужин, перекусы)
@@ -56,7 +105,7 @@ class GeminiService:
 2. Используй эмодзи для лучшей читаемости
 3. Разделяй приемы пищи и дни четкими заголовками
 4. Добавляй статистику в конце каждого дня
-5. В конце добавь общие рекомендации по приготовлению
+{final_notes}
 
 Пример формата:
 🍽️ ДЕНЬ 1
@@ -81,19 +130,728 @@ class GeminiService:
 
 👨‍🍳 РЕКОМЕНДАЦИИ:
 • Рекомендации по приготовлению..."""
+    return prompt
+
+def build_structured_prompt(profile: dict, days: int, existing_meals: list = None,
+                            meal_type: str = 'balanced', first_day: int = 1,
+                            total_days: Optional[int] = None) -> str:
+    """Short prompt for JSON output; layout is rendered locally (plan_render)"""
+    lines = [
+        f"План питания на {days} дн. (JSON по схеме, без пояснений).",
+        f"Возраст {profile['age']}, пол {'мужской' if profile['gender'] == 'male' else 'женский'}, "
+        f"вес {profile['weight']} кг, рост {profile['height']} см, цель: {profile['goal']}.",
+        f"Калории в день: {profile.get('calories', 2000)}. "
+        f"Тип питания: {MEAL_TYPE_NAMES.get(meal_type, meal_type)}.",
+        f"Предпочтения: {profile.get('food_preferences', 'нет ограничений')}. "
+        f"Аллергии: {profile.get('allergies', 'нет')}. "
+        f"Активность: {profile.get('activity_level', 'умеренный')}.",
+        "Приемы пищи: завтрак, обед, ужин, перекус; time в формате ЧЧ:ММ; "
+        "calories в ккал, protein/carbs/fat в граммах; ингредиенты с количеством."
+    ]
+    if existing_meals:
+        lines.append("Существующие приемы пищи: " + "; ".join(
+            f"{meal['type']}: {meal['name']}" for meal in existing_meals
+        ))
+    if total_days:
+        own, others = _week_focus(first_day, days, total_days)
+        lines.append(
+            f"Дни {first_day}-{first_day + days - 1} из {total_days}, нумерация с {first_day}. "
+            f"Основной белок: {', '.join(own)}. Другие дни: {', '.join(others)}, не повторяй их блюда."
+        )
+        if first_day + days - 1 < total_days:
+            lines.append("tips оставь пустым.")
+    if not total_days or first_day + days - 1 >= total_days:
+        lines.append("tips: 2-4 коротких совета по приготовлению.")
+    return '\n'.join(lines)
+
+ERROR_MESSAGE = "❌ Извините, произошла ошибка при генерации плана питания. Пожалуйста, попробуйте позже."
+INTERRUPTED_MESSAGE = "\n\n❌ Генерация прервана. Пожалуйста, попробуйте позже."
+MODEL_NAME = 'gemini-1.5-flash'
+
+class GeminiService:
+    """Meal plan generation on top of a ModelBackend (the Gemini SDK by default).
+
+    Blocking backend calls run on a dedicated thread pool, at most
+    `max_concurrency` at a time, and each call is bounded by `timeout`
+    seconds both in the SDK request and on the awaiting side.
+
+    Retryable failures are retried per `retry_policy`; with `latency` set a
+    duplicate request is sent once a call outlives the tracked percentile
+    (`stream_latency` does the same for a stream's first chunk);
+    `breaker` fails calls fast while Gemini keeps failing. Failed requests
+    are answered from the plan cache or pool when possible, and otherwise
+    by the offline `planner`.
+
+    With `structured` set the model returns JSON (plan_render.Plan) that is
+    kept and cached in compact form; generate_structured_plan parses it.
+    """
+
+    def __init__(self, plan_cache=None, plan_pool=None, planner=None, model_name: str = MODEL_NAME,
+                 max_concurrency: int = 8, timeout: float = 60.0,
+                 days_per_part: int = 0, retry_policy: Optional[RetryPolicy] = None,
+                 latency=None, stream_latency=None, breaker=None, structured: bool = False,
+                 backend: Optional[ModelBackend] = None, telemetry=None, quota=None):
+        self.plan_cache = plan_cache
+        self.plan_pool = plan_pool
+        self.planner = planner
+        self.model_name = model_name
+        self.backend = backend or GenAIBackend(model_name)
+        self.timeout = timeout
+        # Plans longer than this many days are generated as concurrent parts
+        # (0 keeps one call per plan)
+        self.days_per_part = days_per_part
+        self.structured = structured
+        # Cache and pool entries are only shared between calls of one format
+        self.plan_format = 'json' if structured else 'text'
+        self.retry_policy = retry_policy or RetryPolicy(attempts=1)
+        self.latency = latency
+        self.stream_latency = stream_latency
+        self.breaker = breaker
+        self.telemetry = telemetry
+        # Optional QuotaGovernor every model call is admitted through
+        self.quota = quota
+        self.in_flight = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._flights = SingleFlight()
+        # Streams hold a thread for their whole duration, so one per slot,
+        # plus room for calls left running by a timeout or a losing hedge
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency * 2,
+            thread_name_prefix="gemini"
+        )
+
+    def _generation_config(self) -> Optional[dict]:
+        if not self.structured:
+            return None
+        return {
+            'response_mime_type': 'application/json',
+            'response_schema': Plan
+        }
+
+    def _build_prompt(self, profile: dict, days: int, existing_meals: list, meal_type: str,
+                      first_day: int = 1, total_days: Optional[int] = None) -> str:
+        builder = build_structured_prompt if self.structured else build_prompt
+        return builder(profile, days, existing_meals, meal_type, first_day=first_day, total_days=total_days)
+
+    def _new_call(self, plan_type: str) -> Dict:
+        """Telemetry record of one plan request, filled in as it is served"""
+        return {
+            'plan_type': plan_type,
+            'model': self.model_name,
+            'outcome': None,
+            'cache_hit': False,
+            'started': time.perf_counter(),
+            'ttfc_ms': None,
+            'calls': 0,
+            'prompt_tokens': None,
+            'output_tokens': None
+        }
+
+    @staticmethod
+    def _mark_first(call: Optional[Dict]):
+        """Note the time the first part of the answer became available"""
+        if call is not None and call['ttfc_ms'] is None:
+            call['ttfc_ms'] = round((time.perf_counter() - call['started']) * 1000)
+
+    @staticmethod
+    def _count_tokens(call: Optional[Dict], response: ModelResponse):
+        """Add the usage of a completed model call to the request's record"""
+        if call is None:
+            return
+        call['calls'] += 1
+        if response.model:
+            # The backend picked the model (a key pool member's)
+            call['model'] = response.model
+        for field in ('prompt_tokens', 'output_tokens'):
+            value = getattr(response, field)
+            if value is not None:
+                call[field] = (call[field] or 0) + value
+
+    @staticmethod
+    def _error_outcome(error: BaseException) -> str:
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+            return 'timeout'
+        if isinstance(error, CircuitOpenError):
+            return 'circuit_open'
+        if isinstance(error, QuotaExceededError):
+            return 'quota'
+        return 'error'
+
+    @staticmethod
+    def _error_message(error: BaseException) -> str:
+        """What the user sees when a request fails without a fallback"""
+        if isinstance(error, QuotaExceededError):
+            return quota_message(error.retry_after)
+        return ERROR_MESSAGE
+
+    def admission_wait(self, days: int, queued: int = 0) -> float:
+        """Estimated quota wait of a new plan request behind `queued` others"""
+        if not self.quota:
+            return 0.0
+        return self.quota.eta(requests=queued + len(split_days(days, self.days_per_part)))
+
+    async def _admit(self, prompt: str) -> int:
+        """Wait for the quota to allow a call, return the tokens reserved"""
+        if not self.quota:
+            return 0
+        return await self.quota.acquire(self.quota.estimate(prompt))
+
+    def _settle(self, reserved: int, response: Optional[ModelResponse]):
+        """Correct a call's reservation; no response means it used nothing"""
+        if not self.quota:
+            return
+        if response is None:
+            self.quota.release(reserved)
+        else:
+            self.quota.settle(reserved, response.prompt_tokens, response.output_tokens)
+
+    def _finish_call(self, call: Dict):
+        if not self.telemetry:
+            return
+        # No outcome means the caller went away before the answer was ready
+        call['outcome'] = call['outcome'] or 'cancelled'
+        call['wall_ms'] = round((time.perf_counter() - call['started']) * 1000)
+        try:
+            self.telemetry.record(call)
+        except Exception as e:
+            logging.error(f"Error recording model call telemetry: {e}")
+
+    async def _call_model(self, prompt: str, call: Optional[Dict] = None) -> str:
+        """Run one blocking generate_content call under the concurrency cap"""
+        loop = asyncio.get_running_loop()
+        # Quota waits happen before taking a slot
+        reserved = await self._admit(prompt)
+        response = None
+        try:
+            async with self._semaphore:
+                self.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            self._executor,
+                            lambda: self.backend.generate(prompt, self._generation_config(), self.timeout)
+                        ),
+                        # Slack for the SDK to raise its own deadline error first
+                        self.timeout + 5
+                    )
+                    if self.latency:
+                        self.latency.record(time.perf_counter() - started)
+                finally:
+                    self.in_flight -= 1
+        finally:
+            # Failed, cancelled and losing hedged calls give their tokens back
+            self._settle(reserved, response)
+        self._count_tokens(call, response)
+        text = response.text or ""
+        if self.structured and text:
+            plan = parse_plan(text)
+            if plan is None:
+                raise ValueError("Gemini returned JSON that does not match the plan schema")
+            text = compact_json(plan)
+        return text
+
+    async def _hedged_call(self, prompt: str, call: Optional[Dict] = None) -> str:
+        """_call_model, duplicated once it runs longer than the latency percentile"""
+        delay = self.latency.hedge_delay() if self.latency else None
+        primary = asyncio.ensure_future(self._call_model(prompt, call))
+        if delay is None:
+            return await primary
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._may_hedge():
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(self._call_model(prompt, call)))
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _may_hedge(self) -> bool:
+        """Only hedge into a free slot and spare quota so duplicates never
+        queue ahead of users"""
+        return not self._semaphore.locked() and (not self.quota or self.quota.available())
+
+    def _allow_call(self):
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+
+    def _release_call(self):
+        """A call let through by _allow_call ended without an outcome"""
+        if self.breaker:
+            self.breaker.release_trial()
+
+    def _record_outcome(self, error: Optional[BaseException] = None):
+        """Only failures that mean Gemini is degraded count against the breaker"""
+        if self.quota and getattr(error, 'code', None) == 429:
+            self.quota.throttle()
+        if not self.breaker:
+            return
+        if error is not None and is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def _retry_wait(self, attempt: int, error: BaseException):
+        self.retries += 1
+        delay = self.retry_policy.delay(attempt)
+        logging.warning(f"Gemini call failed ({error!r}), retry {attempt + 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def _call_resilient(self, prompt: str, call: Optional[Dict] = None) -> str:
+        """_call_model behind the circuit breaker, with hedging and retries"""
+        attempts = self.retry_policy.attempts
+        for attempt in range(attempts):
+            self._allow_call()
+            try:
+                meal_plan = await self._hedged_call(prompt, call)
+            except (QuotaExceededError, asyncio.CancelledError):
+                # Nothing to judge Gemini by: neither the breaker nor a
+                # retry applies, but a half-open trial slot must be freed
+                self._release_call()
+                raise
+            except Exception as e:
+                self._record_outcome(e)
+                if not is_retryable(e) or attempt + 1 >= attempts:
+                    raise
+                await self._retry_wait(attempt, e)
+            else:
+                self._record_outcome()
+                return meal_plan
+
+    async def _fallback(self, profile: dict, days: int, meal_type: str,
+                        call: Optional[Dict] = None) -> Optional[str]:
+        """A cached, pre-generated or offline plan to serve instead of an error"""
+        meal_plan = None
+        if self.plan_cache:
+            meal_plan = await self.plan_cache.any(self.plan_cache.key(profile, days, meal_type, self.plan_format))
+        if not meal_plan and self.plan_pool and days == 1:
+            meal_plan = await self.plan_pool.take(profile, meal_type, self.plan_format)
+        if not meal_plan and self.planner:
+            plan = self.planner.plan(profile, days, meal_type)
+            meal_plan = compact_json(plan) if self.structured else '\n\n'.join(render_plan(plan))
+        if meal_plan:
+            self.fallbacks += 1
+            logging.warning("Serving a fallback meal plan after a Gemini failure")
+            if call is not None:
+                call['outcome'] = 'fallback'
+                self._mark_first(call)
+        return meal_plan
+
+    def stats(self) -> dict:
+        """In-flight calls and request coalescing counters"""
+        return {
+            'in_flight': self.in_flight,
+            'coalescing': self._flights.stats(),
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'fallbacks': self.fallbacks,
+            'latency': self.latency.stats() if self.latency else None,
+            'stream_latency': self.stream_latency.stats() if self.stream_latency else None,
+            'breaker': self.breaker.stats() if self.breaker else None,
+            'telemetry': self.telemetry.stats() if self.telemetry else None,
+            'quota': self.quota.stats() if self.quota else None,
+            'keys': self.backend.stats() if isinstance(self.backend, KeyPool) else None
+        }
+
+    def close(self):
+        """Stop the worker threads; running SDK calls end at their timeout"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _prepare(self, profile: dict, days: int, existing_meals: list, meal_type: str,
+                       call: Dict) -> Tuple[Optional[str], List[str], Optional[str]]:
+        """Validate and consult the plan cache.
+
+        Returns (ready_text, prompts, cache_key): ready_text is an error or a
+        cached plan, otherwise prompts are what should be sent to the model,
+        one per part of the plan in day order.
+        """
+        # Validate profile
+        required_fields = ['age', 'gender', 'weight', 'height', 'goal']
+        missing_fields = [field for field in required_fields if field not in profile]
+        if missing_fields:
+            call['outcome'] = 'rejected'
+            return f"❌ Необходимо предоставить полный профиль пользователя. Отсутствуют поля: {', '.join(missing_fields)}", [], None
+
+        # Plans that reference the user's own meals are not shareable
+        cache_key = None
+        if self.plan_cache and not existing_meals:
+            cache_key = self.plan_cache.key(profile, days, meal_type, self.plan_format)
+            cached_plan = await self.plan_cache.get(cache_key)
+            if cached_plan:
+                logging.info(f"Serving meal plan from cache: {cache_key}")
+                call.update(outcome='cache', cache_hit=True)
+                self._mark_first(call)
+                return cached_plan, [], cache_key
+        if self.plan_pool and days == 1 and not existing_meals:
+            pooled_plan = await self.plan_pool.take(profile, meal_type, self.plan_format)
+            if pooled_plan:
+                call.update(outcome='pool', cache_hit=True)
+                self._mark_first(call)
+                return pooled_plan, [], None
+        if cache_key:
+            # Generate for the bucket so the plan fits everyone sharing the key
+            profile = self.plan_cache.canonical_profile(profile)
+
+        parts = split_days(days, self.days_per_part)
+        if len(parts) == 1:
+            prompts = [self._build_prompt(profile, days, existing_meals, meal_type)]
+        else:
+            prompts = [
+                self._build_prompt(profile, part_days, existing_meals, meal_type,
+                                   first_day=first_day, total_days=days)
+                for first_day, part_days in parts
+            ]
+        for prompt in prompts:
+            logging.debug(f"Generating meal plan with prompt: {prompt}")
+        return None, prompts, cache_key
+
+    async def generate_meal_plan(self, profile: dict, days: int, existing_meals: list = None,
+                                 meal_type: str = 'balanced') -> str:
+        """Generate meal plan using Gemini API, served from the plan cache when possible"""
+        call = self._new_call('daily' if days == 1 else 'weekly')
+        try:
+            ready_text, prompts, cache_key = await self._prepare(profile, days, existing_meals, meal_type, call)
+            if ready_text:
+                return ready_text
             
-            logging.info(f"Generating meal plan with prompt: {prompt}")
-            
-            # Use asyncio for async call
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(None, lambda: model.generate_content(prompt))
+            if len(prompts) == 1:
+                # Identical concurrent prompts share one API call
+                prompt = prompts[0]
+                meal_plan = await self._flights.do(
+                    self._flight_key(prompt),
+                    lambda: self._generate(prompt, cache_key, call)
+                )
+            else:
+                # Parts run concurrently under the cap, joined in day order
+                parts = await self._gather_parts([
+                    self._flights.do(self._flight_key(prompt), lambda prompt=prompt: self._generate(prompt, None, call))
+                    for prompt in prompts
+                ])
+                meal_plan = self._join_parts(parts) if all(parts) else ""
+                if meal_plan and cache_key:
+                    await self.plan_cache.put(cache_key, meal_plan)
             
-            if not response or not response.text:
+            if not meal_plan:
                 logging.error("Empty response from Gemini API")
-                return "❌ Извините, произошла ошибка при генерации плана питания. Пожалуйста, попробуйте позже."
+                call['outcome'] = 'empty'
+                return ERROR_MESSAGE
             
-            return response.text
+            # Without a model call of its own the request joined another one
+            call['outcome'] = 'ok' if call['calls'] else 'coalesced'
+            self._mark_first(call)
+            return meal_plan
             
+        except asyncio.TimeoutError as e:
+            logging.error(f"Gemini call timed out after {self.timeout}s")
+            call['outcome'] = self._error_outcome(e)
+            return await self._fallback(profile, days, meal_type, call) or ERROR_MESSAGE
         except Exception as e:
             logging.error(f"Error generating meal plan: {str(e)}")
-            return "❌ Извините, произошла ошибка при генерации плана питания. Пожалуйста, попробуйте позже." 
\ No newline at end of file
+            call['outcome'] = self._error_outcome(e)
+            return await self._fallback(profile, days, meal_type, call) or self._error_message(e)
+        finally:
+            self._finish_call(call)
+
+    @staticmethod
+    async def _gather_parts(calls: List) -> List[str]:
+        """Results of all part calls; when one fails the others are
+        cancelled instead of spending quota on a plan that is lost anyway"""
+        tasks = [asyncio.ensure_future(part) for part in calls]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _join_parts(self, parts: List[str]) -> str:
+        if self.structured:
+            return compact_json(merge_plans([parse_plan(part) for part in parts]))
+        return '\n\n'.join(part.strip() for part in parts)
+
+    async def generate_structured_plan(self, profile: dict, days: int, existing_meals: list = None,
+                                       meal_type: str = 'balanced') -> Union[Plan, str]:
+        """generate_meal_plan for structured mode: the parsed plan, or the "❌" message"""
+        meal_plan = await self.generate_meal_plan(profile, days, existing_meals, meal_type)
+        if meal_plan.startswith("❌"):
+            return meal_plan
+        return parse_plan(meal_plan) or ERROR_MESSAGE
+
+    async def stream_meal_plan(self, profile: dict, days: int, existing_meals: list = None,
+                               meal_type: str = 'balanced') -> AsyncIterator[str]:
+        """Yield the meal plan in chunks as the model produces them.
+
+        Errors follow generate_meal_plan: a failure before any output yields
+        the "❌" message, a failure mid-stream appends a note and stops.
+        """
+        call = self._new_call('daily' if days == 1 else 'weekly')
+        produced = []
+        try:
+            try:
+                ready_text, prompts, cache_key = await self._prepare(profile, days, existing_meals, meal_type, call)
+                if ready_text:
+                    yield ready_text
+                    return
+                if len(prompts) == 1:
+                    # Identical concurrent prompts share one API stream
+                    prompt = prompts[0]
+                    stream = self._flights.stream(
+                        self._flight_key(prompt),
+                        lambda: self._stream_and_cache(prompt, cache_key, call)
+                    )
+                else:
+                    stream = self._stream_parts(prompts, cache_key, call)
+                try:
+                    async for chunk in stream:
+                        self._mark_first(call)
+                        produced.append(chunk)
+                        yield chunk
+                finally:
+                    # Stops the shared stream if this was its last reader
+                    await stream.aclose()
+            except Exception as e:
+                logging.error(f"Error streaming meal plan: {str(e)}")
+                if not produced:
+                    call['outcome'] = self._error_outcome(e)
+                    yield await self._fallback(profile, days, meal_type, call) or self._error_message(e)
+                else:
+                    call['outcome'] = 'interrupted'
+                    yield INTERRUPTED_MESSAGE
+                return
+
+            if not produced:
+                logging.error("Empty response from Gemini API")
+                call['outcome'] = 'empty'
+                yield ERROR_MESSAGE
+                return
+            call['outcome'] = 'ok' if call['calls'] else 'coalesced'
+        finally:
+            self._finish_call(call)
+
+    async def pregenerate(self, profile: dict, days: int = 1,
+                          meal_type: str = 'balanced') -> Optional[str]:
+        """Generate a plan for the plan pool, bypassing the caches; None on failure"""
+        call = self._new_call('pregen')
+        try:
+            meal_plan = await self._call_resilient(self._build_prompt(profile, days, None, meal_type), call)
+            call['outcome'] = 'ok' if meal_plan else 'empty'
+            self._mark_first(call)
+            return meal_plan or None
+        except Exception as e:
+            logging.error(f"Error pre-generating meal plan: {str(e)}")
+            call['outcome'] = self._error_outcome(e)
+            return None
+        finally:
+            self._finish_call(call)
+
+    def _flight_key(self, prompt: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\n{prompt}".encode()).hexdigest()
+
+    async def _generate(self, prompt: str, cache_key: Optional[str], call: Optional[Dict] = None) -> str:
+        """One model call whose result is cached once for all coalesced callers"""
+        meal_plan = await self._call_resilient(prompt, call)
+        if meal_plan and cache_key:
+            await self.plan_cache.put(cache_key, meal_plan)
+        return meal_plan
+
+    async def _stream_and_cache(self, prompt: str, cache_key: Optional[str],
+                                call: Optional[Dict] = None) -> AsyncIterator[str]:
+        produced = []
+        async for chunk in self._stream_resilient(prompt, call):
+            produced.append(chunk)
+            yield chunk
+        if produced and cache_key:
+            await self.plan_cache.put(cache_key, ''.join(produced))
+
+    async def _stream_parts(self, prompts: List[str], cache_key: Optional[str],
+                            call: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Stream all parts at once and yield them in order.
+
+        Every part starts generating immediately (within the concurrency cap);
+        later parts are buffered until the ones before them are finished.
+        When a part fails, the streams of the other parts are closed so they
+        stop generating (unless another request shares them).
+        """
+        streams = [
+            self._flights.stream(
+                self._flight_key(prompt),
+                lambda prompt=prompt: self._stream_and_cache(prompt, None, call)
+            )
+            for prompt in prompts
+        ]
+        produced = []
+        try:
+            for index, stream in enumerate(streams):
+                if index:
+                    produced.append("\n\n")
+                    yield "\n\n"
+                part = []
+                async for chunk in stream:
+                    # Fail as soon as any later part does, not when it is reached
+                    failed = next((other for other in streams[index + 1:] if other.error), None)
+                    if failed:
+                        raise failed.error
+                    part.append(chunk)
+                    yield chunk
+                if not ''.join(part).strip():
+                    raise RuntimeError(f"Empty response for part {index + 1} of {len(prompts)}")
+                produced.extend(part)
+        finally:
+            for stream in streams:
+                await stream.aclose()
+        if cache_key:
+            await self.plan_cache.put(cache_key, ''.join(produced))
+
+    async def _stream_resilient(self, prompt: str, call: Optional[Dict] = None) -> AsyncIterator[str]:
+        """_stream_model behind the circuit breaker, retried until the first chunk"""
+        attempts = self.retry_policy.attempts
+        for attempt in range(attempts):
+            self._allow_call()
+            started = False
+            try:
+                async for chunk in self._hedged_stream(prompt, call):
+                    started = True
+                    yield chunk
+            except (QuotaExceededError, asyncio.CancelledError, GeneratorExit):
+                # Refused, cancelled or abandoned by the consumer
+                self._release_call()
+                raise
+            except Exception as e:
+                self._record_outcome(e)
+                # Output already shown to the user can't be taken back
+                if started or not is_retryable(e) or attempt + 1 >= attempts:
+                    raise
+                await self._retry_wait(attempt, e)
+            else:
+                self._record_outcome()
+                return
+
+    async def _hedged_stream(self, prompt: str, call: Optional[Dict] = None) -> AsyncIterator[str]:
+        """_stream_model, duplicated once its first chunk is later than the
+        first-chunk latency percentile.
+
+        Whichever stream produces first is kept and the other one is
+        closed, so the user only ever sees one of them.
+        """
+        delay = self.stream_latency.hedge_delay() if self.stream_latency else None
+        primary = self._stream_model(prompt, call)
+        pending = {asyncio.ensure_future(primary.__anext__()): primary}
+        streams = [primary]
+        winner, first, error = None, None, None
+        try:
+            timeout = delay
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    timeout = None
+                    if self._may_hedge():
+                        self.hedges += 1
+                        hedge = self._stream_model(prompt, call)
+                        streams.append(hedge)
+                        pending[asyncio.ensure_future(hedge.__anext__())] = hedge
+                    continue
+                for task in done:
+                    stream = pending.pop(task)
+                    if isinstance(task.exception(), StopAsyncIteration):
+                        # Finished without output
+                        winner = stream
+                    elif task.exception() is None:
+                        winner, first = stream, task.result()
+                    else:
+                        error = task.exception()
+                    if winner is not None:
+                        break
+            if winner is None:
+                raise error
+            if winner is not primary:
+                self.hedge_wins += 1
+            # The loser is dropped before anything is yielded
+            await self._close_streams(pending, [stream for stream in streams if stream is not winner])
+            if first is None:
+                return
+            yield first
+            async for chunk in winner:
+                yield chunk
+        finally:
+            await self._close_streams(pending, streams)
+
+    @staticmethod
+    async def _close_streams(pending: Dict, streams: List):
+        for task in pending:
+            task.cancel()
+        # A generator can't be closed while its __anext__ is still running
+        await asyncio.gather(*pending, return_exceptions=True)
+        pending.clear()
+        for stream in streams:
+            await stream.aclose()
+
+    async def _stream_model(self, prompt: str, call: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Bridge the backend's blocking stream iterator onto the event loop.
+
+        Holds a concurrency slot for the whole stream; raises TimeoutError
+        when no chunk arrives within `timeout` seconds. Token usage of the
+        last chunk is added to `call` once the stream completes.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in self.backend.stream(prompt, self._generation_config(), self.timeout):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+
+        reserved = await self._admit(prompt)
+        last = None
+        try:
+            async with self._semaphore:
+                self.in_flight += 1
+                producer = loop.run_in_executor(self._executor, produce)
+                started = time.perf_counter()
+                try:
+                    while True:
+                        item = await asyncio.wait_for(chunks.get(), self.timeout)
+                        if item is done:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        if last is None and self.stream_latency:
+                            self.stream_latency.record(time.perf_counter() - started)
+                        last = item
+                        yield item.text
+                    if last is not None:
+                        self._count_tokens(call, last)
+                finally:
+                    # Lets the worker thread stop reading if the consumer went away
+                    stopped.set()
+                    self.in_flight -= 1
+        finally:
+            # No chunk gives the tokens back, a stream cut short keeps the estimate
+            self._settle(reserved, last)
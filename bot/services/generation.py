@@ -0,0 +1,121 @@
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+from bot.services.gemini import ERROR_MESSAGE, INTERRUPTED_MESSAGE
+from bot.services.plan_render import plan_meals, render_plan
+from bot.services.telegram_stream import MESSAGE_LIMIT, TelegramStreamWriter
+
+NO_PROFILE_MESSAGE = "❌ Профиль не найден. Используйте /profile для создания профиля."
+SUBSCRIPTION_REQUIRED_MESSAGE = (
+    "❌ Генерация недельного плана доступна только для подписчиков.\n"
+    "Используйте команду /subscribe для оформления подписки."
+)
+
+class GenerationPipeline:
+    """Generates the plan of a queued job and delivers it to the user's chat.
+
+    Runs outside of any handler, so everything is sent through `bot` by
+    chat id; the job's `message_id` is the "generating" status message
+    the handler left, which is replaced by the plan (or the error).
+    A free job took a generation from the user's bucket in `limiter` when
+    it was queued; it is given back when no plan reaches the user.
+    """
+
+    def __init__(self, bot: Bot, db, gemini, streaming: bool = True, edit_interval: float = 1.0,
+                 limiter=None):
+        self.bot = bot
+        self.db = db
+        self.gemini = gemini
+        self.limiter = limiter
+        self.streaming = streaming
+        self.edit_interval = edit_interval
+
+    async def _reply(self, job: Dict, text: str):
+        """Replace the status message with text, or send it when there is none"""
+        if job.get('message_id'):
+            await self.bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['message_id'])
+        else:
+            await self.bot.send_message(job['chat_id'], text)
+
+    async def run(self, job: Dict):
+        """Generate, deliver and record the plan of one job"""
+        if not await self._deliver(job):
+            self._refund(job)
+
+    async def _deliver(self, job: Dict) -> bool:
+        """Generate and send the plan; False when the user got an error instead"""
+        user_id = job['user_id']
+        chat_id = job['chat_id']
+        days = job['days']
+        meal_type = job['meal_type'] or 'balanced'
+        is_weekly = days > 1
+
+        # Profile, subscription and recent meals in one round trip
+        context = await self.db.get_user_context(user_id, meals_limit=20 if is_weekly else 5)
+        profile = context['profile'] if context else None
+        if not profile:
+            await self._reply(job, NO_PROFILE_MESSAGE)
+            return False
+
+        # The subscription may have lapsed while the job was queued
+        if is_weekly and not context['is_subscribed']:
+            await self._reply(job, SUBSCRIPTION_REQUIRED_MESSAGE)
+            return False
+
+        profile['calories'] = job['calories']
+
+        if self.gemini.structured:
+            # Compact JSON plan rendered locally, one message per day
+            plan = await self.gemini.generate_structured_plan(profile, days, context['meals'], meal_type=meal_type)
+            if isinstance(plan, str):
+                await self._reply(job, plan)
+                return False
+            messages = render_plan(plan)
+            await self._reply(job, messages[0])
+            for text in messages[1:]:
+                await self.bot.send_message(chat_id, text)
+            await self.db.save_meals(user_id, plan_meals(plan), source='plan')
+        elif self.streaming:
+            # Progressively edit the status message as the plan streams in
+            writer = TelegramStreamWriter(
+                self.bot,
+                chat_id,
+                message_id=job.get('message_id'),
+                edit_interval=self.edit_interval
+            )
+            async for chunk in self.gemini.stream_meal_plan(profile, days, context['meals'], meal_type=meal_type):
+                await writer.write(chunk)
+            meal_plan = await writer.finish()
+            if meal_plan.startswith("❌") or meal_plan.endswith(INTERRUPTED_MESSAGE.strip()):
+                return False
+        else:
+            meal_plan = await self.gemini.generate_meal_plan(profile, days, context['meals'], meal_type=meal_type)
+            if meal_plan.startswith("❌"):
+                await self._reply(job, meal_plan)
+                return False
+            # Split long message if needed, the first part replaces the status message
+            await self._reply(job, meal_plan[:MESSAGE_LIMIT])
+            for i in range(MESSAGE_LIMIT, len(meal_plan), MESSAGE_LIMIT):
+                await self.bot.send_message(chat_id, meal_plan[i:i + MESSAGE_LIMIT])
+
+        await self.db.save_generation(
+            user_id,
+            'weekly' if is_weekly else 'daily',
+            job['calories'],
+            meal_type=meal_type
+        )
+        return True
+
+    def _refund(self, job: Dict):
+        if self.limiter and job.get('priority') == 'free':
+            self.limiter.refund(job['user_id'])
+
+    async def fail(self, job: Dict, error: Optional[str] = None):
+        """Tell the user a job was given up on"""
+        self._refund(job)
+        try:
+            await self._reply(job, ERROR_MESSAGE)
+        except Exception as e:
+            logging.warning(f"Could not report failed job {job['id']} to user {job['user_id']}: {e}")
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bot.services.telemetry import Histogram
+
+# Scheduling classes of generation jobs and their default WFQ weights
+PRIORITY_WEIGHTS = {'paid': 3.0, 'free': 1.0}
+
+JobHandler = Callable[[Dict], Awaitable[None]]
+JobFailure = Callable[[Dict, Optional[str]], Awaitable[None]]
+
+class GenerationQueue:
+    """Pool of async workers consuming the durable generation_jobs table.
+
+    Handlers only enqueue; `workers` tasks lease one job at a time for
+    `lease_seconds` (renewed while it runs) and pass it to `handler`. A
+    job whose worker died keeps its status but its lease runs out, and
+    it is leased again, at most `max_attempts` times in total; after that
+    `on_failed` is told and the job is marked failed.
+
+    Jobs carry a priority class. A free worker picks the class by weighted
+    fair queuing (stride scheduling over `weights`): under contention each
+    class gets workers in proportion to its weight, and an idle class does
+    not bank credit for later. `reserved` keeps that many workers per class
+    out of reach of the other classes, so e.g. a paid job never waits for
+    a wall of free ones to finish.
+    """
+
+    def __init__(self, db, handler: JobHandler, workers: int = 4,
+                 lease_seconds: float = 180.0, max_attempts: int = 3,
+                 poll_interval: float = 2.0, retention: float = 24 * 60 * 60,
+                 on_failed: Optional[JobFailure] = None,
+                 weights: Optional[Dict[str, float]] = None,
+                 reserved: Optional[Dict[str, int]] = None):
+        self.db = db
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.on_failed = on_failed
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self.reserved = {cls: (reserved or {}).get(cls, 0) for cls in self.weights}
+        self.enqueued_total = 0
+        self.done_total = 0
+        self.failed_total = 0
+        self.retried_total = 0
+        self._running: Dict[int, Dict] = {}
+        # Workers busy with (or leasing) a job of each class
+        self._active = Counter()
+        # Stride scheduling: a class is charged 1 / weight per job, the
+        # lowest pass goes first; _vtime is the pass of the last pick
+        self._pass = {cls: 0.0 for cls in self.weights}
+        self._vtime = 0.0
+        self._waits = {cls: Histogram() for cls in self.weights}
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"generation-worker-{n}")
+                for n in range(self.workers)
+            ]
+            self._tasks.append(asyncio.create_task(self._janitor(), name="generation-janitor"))
+
+    async def stop(self):
+        """Cancel the workers and put their jobs back in the queue for the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            released = await self.db.release_jobs(list(self._running))
+            logging.info(f"Released {released} unfinished generation jobs")
+            self._running.clear()
+
+    async def enqueue(self, user_id: int, chat_id: int, message_id: Optional[int],
+                      days: int, meal_type: str, calories: int, priority: str = 'free') -> Optional[int]:
+        """Persist a job and wake an idle worker; None if it could not be stored"""
+        if priority not in self.weights:
+            raise ValueError(f"Unknown job priority: {priority}")
+        job_id = await self.db.enqueue_job(user_id, chat_id, message_id, days, meal_type, calories, priority)
+        if job_id is not None:
+            self.enqueued_total += 1
+            self._wake.set()
+        return job_id
+
+    async def _worker(self):
+        while True:
+            try:
+                self._wake.clear()
+                job = await self._next_job()
+                if job is None:
+                    # Not wait_for: it can swallow a cancel that lands as the
+                    # timeout fires, and stop() would wait on the worker forever
+                    wake = asyncio.ensure_future(self._wake.wait())
+                    try:
+                        await asyncio.wait((wake,), timeout=self.poll_interval)
+                    finally:
+                        wake.cancel()
+                    continue
+                try:
+                    await self._process(job)
+                finally:
+                    self._active[job['priority']] -= 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in generation worker: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _may_start(self, cls: str) -> bool:
+        """Whether a worker can take a job of cls without eating into the
+        workers reserved for other classes"""
+        free = self.workers - sum(self._active.values())
+        owed = sum(
+            max(self.reserved[other] - self._active[other], 0)
+            for other in self.weights if other != cls
+        )
+        return free - owed >= 1
+
+    async def _next_job(self) -> Optional[Dict]:
+        """Lease a job of the class with the lowest pass that has one"""
+        for cls in sorted(self.weights, key=lambda c: self._pass[c]):
+            if not self._may_start(cls):
+                continue
+            # Counted while leasing so concurrent workers see the slot taken
+            self._active[cls] += 1
+            lease = asyncio.ensure_future(self.db.lease_jobs(1, self.lease_seconds, cls))
+            try:
+                jobs = await asyncio.shield(lease)
+            except asyncio.CancelledError:
+                self._active[cls] -= 1
+                # The lease still runs in its thread; put back what it takes,
+                # or stop() would leave the job running until the lease expires
+                jobs = await lease
+                await self.db.release_jobs([job['id'] for job in jobs])
+                raise
+            except BaseException:
+                self._active[cls] -= 1
+                raise
+            if not jobs:
+                self._active[cls] -= 1
+                # An idle class restarts at the current virtual time
+                self._pass[cls] = max(self._pass[cls], self._vtime)
+                continue
+            self._vtime = self._pass[cls]
+            self._pass[cls] += 1 / self.weights[cls]
+            job = jobs[0]
+            if job['attempts'] == 1 and job['enqueued_at']:
+                self._waits[cls].observe((time.time() - job['enqueued_at']) * 1000)
+            return job
+        return None
+
+    async def _process(self, job: Dict):
+        job_id = job['id']
+        if job['attempts'] > self.max_attempts:
+            # Leased again after its last attempt died with the process
+            await self._fail(job, "lease expired after the last attempt")
+            return
+
+        self._running[job_id] = job
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await self.handler(job)
+        except asyncio.CancelledError:
+            # Left in _running for stop() to release
+            raise
+        except Exception as e:
+            logging.error(f"Generation job {job_id} failed (attempt {job['attempts']}): {e}")
+            if job['attempts'] < self.max_attempts:
+                self.retried_total += 1
+                await self.db.finish_job(job_id, 'queued', str(e))
+            else:
+                await self._fail(job, str(e))
+        else:
+            self.done_total += 1
+            await self.db.finish_job(job_id, 'done')
+        finally:
+            heartbeat.cancel()
+        self._running.pop(job_id, None)
+
+    async def _fail(self, job: Dict, error: str):
+        self.failed_total += 1
+        await self.db.finish_job(job['id'], 'failed', error)
+        if self.on_failed:
+            await self.on_failed(job, error)
+
+    async def _heartbeat(self, job_id: int):
+        """Keep the lease of a running job from expiring"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.db.renew_job_lease(job_id, self.lease_seconds)
+
+    async def _janitor(self):
+        """Drop old finished jobs and log the queue depth"""
+        while True:
+            try:
+                await self.db.prune_jobs(int(time.time() - self.retention))
+                counts = await self.db.count_jobs(by_priority=True)
+                logging.info("Generation queue: " + ", ".join(
+                    f"{cls} {counts.get((cls, 'queued'), 0)} queued / {counts.get((cls, 'running'), 0)} running, "
+                    f"wait p95 {self._waits[cls].percentile(95) or 0:.0f} ms"
+                    for cls in self.weights
+                ))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in generation queue janitor: {e}")
+            await asyncio.sleep(max(self.poll_interval, 60.0))
+
+    async def stats(self) -> Dict:
+        """Queue depth from the table plus this process' counters and the
+        queue wait (ms, first attempts) per class"""
+        counts = await self.db.count_jobs(by_priority=True)
+        return {
+            'queued': sum(n for (_, status), n in counts.items() if status == 'queued'),
+            'running': sum(n for (_, status), n in counts.items() if status == 'running'),
+            'classes': {
+                cls: {
+                    'queued': counts.get((cls, 'queued'), 0),
+                    'active_here': self._active[cls],
+                    'wait_ms': self._waits[cls].snapshot()
+                }
+                for cls in self.weights
+            },
+            'active_here': len(self._running),
+            'enqueued': self.enqueued_total,
+            'done': self.done_total,
+            'retried': self.retried_total,
+            'failed': self.failed_total
+        }
@@ -0,0 +1,236 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from bot.services.model_backends import ModelBackend, ModelResponse, estimate_tokens
+from bot.services.quota import QuotaExceededError, TokenBucket
+
+def parse_api_keys(value: str, default_model: str) -> List[tuple]:
+    """(api_key, model) pairs from "key1,key2:model2,..." """
+    keys = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        api_key, _, model = entry.partition(':')
+        keys.append((api_key.strip(), model.strip() or default_model))
+    return keys
+
+class PoolMember:
+    """One API key (and model) of a KeyPool with its quota and health"""
+
+    def __init__(self, label: str, model: str, backend: ModelBackend, rpm: int = 0, tpm: int = 0):
+        self.label = label
+        self.model = model
+        self.backend = backend
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # Moving averages of a whole generate call and of a stream's first
+        # chunk in seconds, None until measured
+        self.latency: Optional[float] = None
+        self.first_chunk: Optional[float] = None
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def headroom(self) -> float:
+        """Share of the tightest per-minute budget left (1.0 without a quota)"""
+        shares = [
+            bucket.tokens / bucket.capacity
+            for bucket in (self.requests, self.tokens)
+            if bucket.capacity
+        ]
+        return min(shares) if shares else 1.0
+
+    def stats(self, now: float) -> Dict:
+        return {
+            'model': self.model,
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+            'first_chunk_ms': round(self.first_chunk * 1000) if self.first_chunk is not None else None,
+            'in_flight': self.in_flight,
+            'cooling_for': round(max(self.cooldown_until - now, 0.0), 1),
+            'rpm_left': round(self.requests.tokens, 1) if self.requests.capacity else None,
+            'tpm_left': round(self.tokens.tokens) if self.tokens.capacity else None
+        }
+
+class KeyPool(ModelBackend):
+    """Spreads model calls over several API keys, each with its own quota.
+
+    Every call goes to the member with the lowest observed latency scaled
+    by its load and divided by the share of its per-key quota left, so
+    fast keys with spare quota take most of the traffic. A key answering
+    429 or 5xx is taken out of rotation for `cooldown` seconds (doubled
+    for each further failure in a row, up to `max_cooldown`) and the call
+    moves on to the next key; only when every key failed does the error
+    reach GeminiService. When no key has quota left (or all are cooling
+    down) nothing is sent and QuotaExceededError is raised, which the
+    service treats as a local refusal rather than an API failure.
+    Timeouts are not retried here, the service's retry policy owns those.
+    Responses carry the model of the key that served them.
+    """
+
+    name = 'pool'
+
+    def __init__(self, members: List[PoolMember], cooldown: float = 60.0,
+                 max_cooldown: float = 600.0, smoothing: float = 0.2):
+        if not members:
+            raise ValueError("KeyPool needs at least one member")
+        self.members = members
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def _pick(self, tried: List[PoolMember], metric: str) -> Optional[PoolMember]:
+        """Reserve a request on the best member not tried yet, comparing
+        the `metric` latency average ('latency' or 'first_chunk')"""
+        with self._lock:
+            now = time.monotonic()
+            best, best_score = None, None
+            for member in self.members:
+                if member in tried or member.cooldown_until > now:
+                    continue
+                if member.requests.wait_time(1) or member.tokens.wait_time(1):
+                    # Out of quota until its budget refills
+                    continue
+                # Unmeasured keys look fast so each gets tried
+                latency = getattr(member, metric)
+                latency = latency if latency is not None else 0.0
+                score = (latency + 0.001) * (1 + member.in_flight) / max(member.headroom(), 0.01)
+                if best_score is None or score < best_score:
+                    best, best_score = member, score
+            if best is not None:
+                best.requests.take(1)
+                best.in_flight += 1
+                best.calls += 1
+            return best
+
+    def _observe(self, member: PoolMember, metric: str, seconds: float):
+        with self._lock:
+            average = getattr(member, metric)
+            if average is not None:
+                seconds = average + self.smoothing * (seconds - average)
+            setattr(member, metric, seconds)
+            member.failures = 0
+
+    def _settle(self, member: PoolMember, prompt: str, response: Optional[ModelResponse]):
+        with self._lock:
+            member.in_flight -= 1
+            if response is None:
+                return
+            prompt_tokens = response.prompt_tokens or estimate_tokens(prompt)
+            output_tokens = response.output_tokens or estimate_tokens(response.text)
+            member.prompt_tokens += prompt_tokens
+            member.output_tokens += output_tokens
+            member.tokens.take(prompt_tokens + output_tokens)
+
+    def _failed(self, member: PoolMember, error: BaseException) -> bool:
+        """Account a failed call; True when another key should be tried"""
+        code = getattr(error, 'code', None)
+        with self._lock:
+            member.errors += 1
+            if not isinstance(code, int) or (code != 429 and not 500 <= code < 600):
+                return False
+            member.failures += 1
+            pause = min(self.cooldown * 2 ** (member.failures - 1), self.max_cooldown)
+            member.cooldown_until = time.monotonic() + pause
+            if code == 429:
+                member.throttled += 1
+                member.requests.drain()
+                member.tokens.drain()
+        logging.warning(f"Gemini key {member.label} answered {code}, out of rotation for {pause:.0f}s")
+        return True
+
+    def _unavailable(self, error: Optional[BaseException]) -> BaseException:
+        """The last key's error, or QuotaExceededError when no key could
+        take the call, with the time until the first one can"""
+        if error is not None:
+            return error
+        with self._lock:
+            now = time.monotonic()
+            retry_after = min(
+                max(
+                    member.cooldown_until - now,
+                    member.requests.wait_time(1),
+                    member.tokens.wait_time(1)
+                )
+                for member in self.members
+            )
+        return QuotaExceededError(max(retry_after, 0.0))
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        tried, error = [], None
+        while True:
+            member = self._pick(tried, 'latency')
+            if member is None:
+                raise self._unavailable(error)
+            tried.append(member)
+            started = time.monotonic()
+            response = None
+            try:
+                response = member.backend.generate(prompt, generation_config, timeout)
+            except Exception as e:
+                if not self._failed(member, e):
+                    raise
+                error = e
+                continue
+            finally:
+                self._settle(member, prompt, response)
+            self._observe(member, 'latency', time.monotonic() - started)
+            return response._replace(model=member.model)
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        tried, error = [], None
+        while True:
+            member = self._pick(tried, 'first_chunk')
+            if member is None:
+                raise self._unavailable(error)
+            tried.append(member)
+            started = time.monotonic()
+            last = None
+            try:
+                for chunk in member.backend.stream(prompt, generation_config, timeout):
+                    if last is None:
+                        self._observe(member, 'first_chunk', time.monotonic() - started)
+                    last = chunk
+                    yield chunk._replace(model=member.model)
+            except Exception as e:
+                # Part of the plan went out already, another key can't resume it
+                if last is not None or not self._failed(member, e):
+                    raise
+                error = e
+                continue
+            finally:
+                self._settle(member, prompt, last)
+            return
+
+    def stats(self) -> Dict:
+        """Usage and health per key"""
+        now = time.monotonic()
+        with self._lock:
+            return {member.label: member.stats(now) for member in self.members}
+
+def key_label(api_key: str, model: str) -> str:
+    """Key name safe to log: its last characters and the model"""
+    return f"…{api_key[-4:]}/{model}"
+
+def create_key_pool(keys: List[tuple], make_backend) -> KeyPool:
+    """KeyPool over (api_key, model) pairs configured in bot.config;
+    make_backend(api_key, model, index) builds each member's backend"""
+    from bot.config import GEMINI_RPM, GEMINI_TPM, GEMINI_KEY_COOLDOWN
+    members = [
+        PoolMember(key_label(api_key, model), model, make_backend(api_key, model, index), GEMINI_RPM, GEMINI_TPM)
+        for index, (api_key, model) in enumerate(keys)
+    ]
+    return KeyPool(members, cooldown=GEMINI_KEY_COOLDOWN)
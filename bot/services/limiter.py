@@ -1,28 +1,120 @@
-from datetime import datetime, timedelta
-from bot.services.firestore import FirestoreService
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
 
 class LimiterService:
-    @staticmethod
-    async def can_generate(user_id: int) -> bool:
-        """Check if user can generate a meal plan"""
-        profile = await FirestoreService.get_profile(user_id)
-        
-        if not profile:
+    """Per-user token buckets limiting free generations.
+
+    Each user may generate `capacity` plans, refilled continuously over
+    `period` seconds (1 per day by default). Buckets live in memory, so a
+    check is a dict lookup; changed buckets are written to the rate_limits
+    table every `persist_interval` seconds and loaded back on start, which
+    makes the limit survive restarts (up to the last persist).
+    A user without a bucket has a full one.
+    """
+
+    def __init__(self, db=None, capacity: int = 1, period: float = 24 * 60 * 60,
+                 persist_interval: float = 30.0):
+        self.db = db
+        self.capacity = max(capacity, 1)
+        self.period = period
+        self.rate = self.capacity / period
+        self.persist_interval = persist_interval
+        self.allowed_total = 0
+        self.limited_total = 0
+        # user_id -> [tokens, updated_at]
+        self._buckets: Dict[int, List[float]] = {}
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _tokens(self, user_id: int, now: float) -> float:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return float(self.capacity)
+        tokens, updated_at = bucket
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def can_generate(self, user_id: int) -> bool:
+        """Whether a generation would be allowed now, without using it up"""
+        return self._tokens(user_id, time.time()) >= 1
+
+    def consume(self, user_id: int) -> bool:
+        """Take one generation from the user's bucket; False if it is empty"""
+        now = time.time()
+        tokens = self._tokens(user_id, now)
+        if tokens < 1:
+            self.limited_total += 1
             return False
-            
-        if profile.get('is_subscribed', False):
-            return True
-            
-        last_generation = profile.get('last_generation')
-        if not last_generation:
-            return True
-            
-        last_generation_date = datetime.fromisoformat(last_generation)
-        return datetime.now() - last_generation_date > timedelta(days=1)
-
-    @staticmethod
-    async def update_last_generation(user_id: int):
-        """Update last generation timestamp"""
-        await FirestoreService.save_profile(user_id, {
-            'last_generation': datetime.now().isoformat()
-        }) 
\ No newline at end of file
+        self._buckets[user_id] = [tokens - 1, now]
+        self._dirty.add(user_id)
+        self.allowed_total += 1
+        return True
+
+    def refund(self, user_id: int):
+        """Give back a generation that was not delivered"""
+        now = time.time()
+        self._buckets[user_id] = [min(self.capacity, self._tokens(user_id, now) + 1), now]
+        self._dirty.add(user_id)
+
+    def retry_after(self, user_id: int) -> float:
+        """Seconds until the next generation is allowed"""
+        return max(0.0, (1 - self._tokens(user_id, time.time())) / self.rate)
+
+    async def load(self):
+        """Restore buckets that have not refilled yet"""
+        if not self.db:
+            return
+        rows = await self.db.load_rate_limits(time.time() - self.period)
+        for user_id, tokens, updated_at in rows:
+            self._buckets[user_id] = [tokens, updated_at]
+        logging.info(f"Loaded {len(rows)} rate limit buckets")
+
+    async def persist(self):
+        """Write changed buckets; full ones are dropped from memory and the table"""
+        now = time.time()
+        # Refilled buckets are the same as no bucket
+        for user_id in [u for u, (tokens, updated_at) in self._buckets.items()
+                        if u not in self._dirty and now - updated_at >= self.period]:
+            del self._buckets[user_id]
+        if not self.db:
+            self._dirty.clear()
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [(user_id, *self._buckets[user_id]) for user_id in dirty if user_id in self._buckets]
+        if rows and not await self.db.save_rate_limits(rows):
+            # Try again on the next pass
+            self._dirty |= dirty
+        await self.db.prune_rate_limits(now - self.period)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="limiter-persist")
+
+    async def stop(self):
+        """Stop the persist loop and write the remaining changes"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.persist()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                await self.persist()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error persisting rate limits: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'buckets': len(self._buckets),
+            'allowed': self.allowed_total,
+            'limited': self.limited_total
+        }
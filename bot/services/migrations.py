@@ -0,0 +1,416 @@
+import sqlite3
+import logging
+from typing import Callable, List, Optional, Tuple
+
+# DEFAULT expression for INTEGER epoch timestamp columns
+EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Six-hour buckets indexed by hour // 6
+HOUR_BUCKETS = ('night', 'morning', 'day', 'evening')
+
+# Counter columns of the user_stats rollup, in table order
+PLAN_TYPES = ('daily', 'weekly')
+STATS_COLUMNS = (
+    'total',
+    *(f'plan_{plan_type}' for plan_type in PLAN_TYPES),
+    *(f'weekday_{day}' for day in range(7)),
+    *(f'hour_{bucket}' for bucket in HOUR_BUCKETS),
+)
+
+# Largest SQLite INTEGER, closes the last user id range of a rebuild
+MAX_USER_ID = 2 ** 63 - 1
+
+# Same counters computed from generation_history, used to backfill user_stats
+REBUILD_USER_STATS_SQL = f"""
+    INSERT INTO user_stats (user_id, {', '.join(STATS_COLUMNS)}, first_at, last_at)
+    SELECT
+        user_id,
+        COUNT(*),
+        {', '.join(f"SUM(plan_type = '{plan_type}')" for plan_type in PLAN_TYPES)},
+        {', '.join(f'SUM(weekday = {day})' for day in range(7))},
+        {', '.join(f'SUM(quarter = {i})' for i in range(len(HOUR_BUCKETS)))},
+        MIN(created_at),
+        MAX(created_at)
+    FROM (
+        SELECT
+            user_id,
+            plan_type,
+            created_at,
+            (CAST(strftime('%w', created_at, 'unixepoch', 'localtime') AS INTEGER) + 6) % 7 AS weekday,
+            CAST(strftime('%H', created_at, 'unixepoch', 'localtime') AS INTEGER) / 6 AS quarter
+        FROM generation_history
+        WHERE user_id > ? AND user_id <= ?
+    )
+    GROUP BY user_id
+"""
+
+# Only users without a rollup yet, for the migration backfill
+BACKFILL_USER_STATS_SQL = REBUILD_USER_STATS_SQL.replace(
+    "WHERE user_id > ? AND user_id <= ?",
+    "WHERE user_id > ? AND user_id <= ?\n          AND user_id NOT IN (SELECT user_id FROM user_stats)"
+)
+
+def rebuild_user_stats_batch(conn: sqlite3.Connection, after: int, batch_size: int,
+                             missing_only: bool = False) -> Tuple[int, int]:
+    """Recompute the rollups of the next batch_size users with history after
+    user id `after`, in the caller's transaction. With missing_only users
+    that already have a rollup keep it. Returns the number of users in the
+    batch and the last user id it covered, MAX_USER_ID for the final one."""
+    user_ids = [row[0] for row in conn.execute("""
+        SELECT DISTINCT user_id
+        FROM generation_history
+        WHERE user_id > ?
+        ORDER BY user_id
+        LIMIT ?
+    """, (after, batch_size))]
+    upper = user_ids[-1] if len(user_ids) == batch_size else MAX_USER_ID
+    if missing_only:
+        conn.execute(BACKFILL_USER_STATS_SQL, (after, upper))
+    else:
+        # The final range also drops rollups of users without history
+        conn.execute("DELETE FROM user_stats WHERE user_id > ? AND user_id <= ?", (after, upper))
+        conn.execute(REBUILD_USER_STATS_SQL, (after, upper))
+    return len(user_ids), upper
+
+def _create_base_tables(conn: sqlite3.Connection):
+    """Initial schema as it existed before versioned migrations"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            age INTEGER,
+            gender TEXT,
+            weight INTEGER,
+            height INTEGER,
+            goal TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            plan TEXT,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS generation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plan_type TEXT,
+            calories INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT,
+            name TEXT,
+            calories INTEGER,
+            protein INTEGER,
+            carbs INTEGER,
+            fat INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
+        )
+    """)
+
+def _column_type(conn: sqlite3.Connection, table: str, column: str) -> Optional[str]:
+    for row in conn.execute(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+def _rebuild_with_epoch(conn: sqlite3.Connection, table: str, columns_ddl: str, columns: str):
+    """Copy a table into a new one whose created_at is an INTEGER epoch"""
+    if _column_type(conn, table, 'created_at') == 'INTEGER':
+        return
+    conn.execute(f"DROP TABLE IF EXISTS {table}_new")
+    conn.execute(f"""
+        CREATE TABLE {table}_new (
+            {columns_ddl},
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
+        )
+    """)
+    # CURRENT_TIMESTAMP strings are UTC, strftime('%s') converts them as such
+    conn.execute(f"""
+        INSERT INTO {table}_new ({columns}, created_at)
+        SELECT {columns},
+               CASE
+                   WHEN typeof(created_at) IN ('integer', 'real') THEN CAST(created_at AS INTEGER)
+                   ELSE COALESCE(CAST(strftime('%s', created_at) AS INTEGER), {EPOCH_NOW})
+               END
+        FROM {table}
+    """)
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _epoch_created_at(conn: sqlite3.Connection):
+    """Store created_at of history and meals as INTEGER unix time"""
+    _rebuild_with_epoch(
+        conn,
+        'generation_history',
+        """id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plan_type TEXT,
+            calories INTEGER""",
+        "id, user_id, plan_type, calories"
+    )
+    _rebuild_with_epoch(
+        conn,
+        'meals',
+        """id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            type TEXT,
+            name TEXT,
+            calories INTEGER,
+            protein INTEGER,
+            carbs INTEGER,
+            fat INTEGER""",
+        "id, user_id, type, name, calories, protein, carbs, fat"
+    )
+
+def _history_and_meals_indexes(conn: sqlite3.Connection):
+    """Indexes for the per-user 'ORDER BY created_at DESC' lookups"""
+    # Covers get_generation_history entirely, no table access needed
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_generation_history_user_created
+        ON generation_history (user_id, created_at, plan_type, calories)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_meals_user_created
+        ON meals (user_id, created_at)
+    """)
+
+def _user_stats(conn: sqlite3.Connection):
+    """Per-user generation rollups maintained by save_generation,
+    backfilled from the existing history"""
+    weekday_columns = ",\n            ".join(
+        f"weekday_{day} INTEGER NOT NULL DEFAULT 0" for day in range(7)
+    )
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            plan_daily INTEGER NOT NULL DEFAULT 0,
+            plan_weekly INTEGER NOT NULL DEFAULT 0,
+            {weekday_columns},
+            hour_night INTEGER NOT NULL DEFAULT 0,
+            hour_morning INTEGER NOT NULL DEFAULT 0,
+            hour_day INTEGER NOT NULL DEFAULT 0,
+            hour_evening INTEGER NOT NULL DEFAULT 0,
+            first_at INTEGER,
+            last_at INTEGER
+        )
+    """)
+    _backfill_user_stats(conn)
+
+def _backfill_user_stats(conn: sqlite3.Connection, batch_size: int = 500):
+    """Add rollups for users with history but no user_stats row yet,
+    batch_size users per statement"""
+    after = -1
+    while after != MAX_USER_ID:
+        _, after = rebuild_user_stats_batch(conn, after, batch_size, missing_only=True)
+
+def _subscription_expiry(conn: sqlite3.Connection):
+    """Index for the expiry sweeper and a column to track renewal reminders"""
+    if _column_type(conn, 'subscriptions', 'reminded_at') is None:
+        conn.execute("ALTER TABLE subscriptions ADD COLUMN reminded_at INTEGER")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_active_end
+        ON subscriptions (is_active, end_date)
+    """)
+
+def _plan_cache(conn: sqlite3.Connection):
+    """Persistent tier of the generated plan cache"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS plan_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache_key TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW}
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_plan_cache_key_created
+        ON plan_cache (cache_key, created_at)
+    """)
+
+def _plan_pool(conn: sqlite3.Connection):
+    """Diet type in generation history and the pre-generated plan pool"""
+    if _column_type(conn, 'generation_history', 'meal_type') is None:
+        conn.execute("ALTER TABLE generation_history ADD COLUMN meal_type TEXT")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS plan_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bucket_key TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW}
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_plan_pool_bucket_created
+        ON plan_pool (bucket_key, created_at)
+    """)
+
+def _model_calls(conn: sqlite3.Connection):
+    """Per-request model telemetry, durations in ms"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS model_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            model TEXT,
+            plan_type TEXT,
+            outcome TEXT,
+            cache_hit INTEGER NOT NULL DEFAULT 0,
+            wall_ms INTEGER,
+            ttfc_ms INTEGER,
+            prompt_tokens INTEGER,
+            output_tokens INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_model_calls_created
+        ON model_calls (created_at)
+    """)
+
+def _generation_jobs(conn: sqlite3.Connection):
+    """Durable queue of plan generation requests with worker leases"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            days INTEGER NOT NULL,
+            meal_type TEXT,
+            calories INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_until INTEGER,
+            error TEXT,
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            updated_at INTEGER NOT NULL DEFAULT {EPOCH_NOW}
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_status_lease
+        ON generation_jobs (status, lease_until)
+    """)
+
+def _job_priority(conn: sqlite3.Connection):
+    """Scheduling class of a generation job and its precise enqueue time"""
+    if _column_type(conn, 'generation_jobs', 'priority') is None:
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'free'")
+    if _column_type(conn, 'generation_jobs', 'enqueued_at') is None:
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN enqueued_at REAL")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_priority_status
+        ON generation_jobs (priority, status, lease_until)
+    """)
+
+def _rate_limits(conn: sqlite3.Connection):
+    """Persisted free generation token buckets"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            user_id INTEGER PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rate_limits_updated
+        ON rate_limits (updated_at)
+    """)
+
+def _meal_source(conn: sqlite3.Connection):
+    """Tell meals the user entered from meals of plans the bot generated"""
+    if _column_type(conn, 'meals', 'source') is None:
+        conn.execute("ALTER TABLE meals ADD COLUMN source TEXT NOT NULL DEFAULT 'user'")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_meals_user_source_created
+        ON meals (user_id, source, created_at)
+    """)
+
+# Ordered list of (version, description, step). Steps must be idempotent:
+# a step may be re-run if a previous attempt died before recording its version.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "base tables", _create_base_tables),
+    (2, "integer epoch created_at for generation_history and meals", _epoch_created_at),
+    (3, "(user_id, created_at) indexes for generation_history and meals", _history_and_meals_indexes),
+    (4, "user_stats rollup table", _user_stats),
+    (5, "(is_active, end_date) index and reminded_at for subscriptions", _subscription_expiry),
+    (6, "plan_cache table", _plan_cache),
+    (7, "generation_history.meal_type and plan_pool table", _plan_pool),
+    (8, "model_calls telemetry table", _model_calls),
+    (9, "generation_jobs queue table", _generation_jobs),
+    (10, "generation_jobs priority and enqueued_at", _job_priority),
+    (11, "rate_limits table", _rate_limits),
+    (12, "meals.source", _meal_source),
+    # Databases that got version 4 before it backfilled. Users who already
+    # have a rollup keep it, manage.py rebuild-stats recomputes everything
+    (13, "backfill user_stats from generation_history", _backfill_user_stats),
+]
+
+def _ensure_version_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at INTEGER NOT NULL DEFAULT {EPOCH_NOW}
+        )
+    """)
+    conn.commit()
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Return the latest applied schema version (0 for a fresh database)"""
+    _ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def pending_migrations(conn: sqlite3.Connection) -> List[Tuple[int, str]]:
+    """List migrations that have not been applied yet"""
+    version = current_version(conn)
+    return [(v, description) for v, description, _ in MIGRATIONS if v > version]
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations in order, each in its own write transaction.
+
+    Readers keep working in WAL mode while a step runs, so this is safe to
+    call against the live bot database.
+    """
+    _ensure_version_table(conn)
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock in case another process got here first
+            done = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if done:
+                conn.rollback()
+                continue
+            logging.info(f"Applying migration {version}: {description}")
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Migration {version} failed: {e}")
+            raise
+    return applied
@@ -0,0 +1,304 @@
+import json
+import logging
+import math
+import random
+import re
+import socket
+import threading
+import time
+import typing
+import urllib.error
+import urllib.request
+from typing import Dict, Iterator, NamedTuple, Optional
+
+_genai = None
+_genai_lock = threading.Lock()
+
+def _load_genai():
+    """Import and configure the Gemini SDK on first use"""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            from bot.config import GEMINI_API_KEY
+            started = time.perf_counter()
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _genai = genai
+            logging.info(f"Gemini SDK loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return _genai
+
+class ModelAPIError(Exception):
+    """API error with its HTTP status in `code`, like google.api_core errors"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+class ModelResponse(NamedTuple):
+    """Generated text with the usage metadata reported for the call so far;
+    model is set when the backend chose it (a KeyPool member's model)"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    model: Optional[str] = None
+
+class ModelBackend:
+    """Blocking text generation API behind GeminiService.
+
+    Methods are called from GeminiService's worker threads. generation_config
+    uses the SDK's keys (response_mime_type, response_schema). Stream chunks
+    carry cumulative token counts, so the last one has the call's totals.
+    """
+
+    name = 'base'
+
+    def generate(self, prompt: str, generation_config: Optional[Dict] = None,
+                 timeout: Optional[float] = None) -> ModelResponse:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, generation_config: Optional[Dict] = None,
+               timeout: Optional[float] = None) -> Iterator[ModelResponse]:
+        raise NotImplementedError
+
+class GenAIBackend(ModelBackend):
+    """google-generativeai SDK with one long-lived model client"""
+
+    name = 'genai'
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def _get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                self._model = _load_genai().GenerativeModel(self.model_name)
+            return self._model
+
+    @staticmethod
+    def _usage(response) -> Dict:
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return {}
+        return {
+            'prompt_tokens': usage.prompt_token_count,
+            'output_tokens': usage.candidates_token_count
+        }
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        response = self._get_model().generate_content(
+            prompt,
+            generation_config=generation_config,
+            request_options={'timeout': timeout}
+        )
+        if not response:
+            return ModelResponse("")
+        return ModelResponse(response.text, **self._usage(response))
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        response = self._get_model().generate_content(
+            prompt,
+            stream=True,
+            generation_config=generation_config,
+            request_options={'timeout': timeout}
+        )
+        for chunk in response:
+            if chunk.text:
+                yield ModelResponse(chunk.text, **self._usage(chunk))
+
+def json_schema(tp) -> Dict:
+    """REST responseSchema (OpenAPI subset) for a TypedDict/List/str/int annotation"""
+    if typing.get_origin(tp) in (list, typing.List):
+        return {'type': 'ARRAY', 'items': json_schema(typing.get_args(tp)[0])}
+    if isinstance(tp, type) and hasattr(tp, '__annotations__'):
+        hints = typing.get_type_hints(tp)
+        return {
+            'type': 'OBJECT',
+            'properties': {name: json_schema(hint) for name, hint in hints.items()},
+            'required': list(hints)
+        }
+    return {int: {'type': 'INTEGER'}, float: {'type': 'NUMBER'}, bool: {'type': 'BOOLEAN'}}.get(tp, {'type': 'STRING'})
+
+def _response(payload: Dict) -> ModelResponse:
+    candidates = payload.get('candidates') or []
+    parts = (candidates[0].get('content') or {}).get('parts') or [] if candidates else []
+    usage = payload.get('usageMetadata') or {}
+    return ModelResponse(
+        ''.join(part.get('text', '') for part in parts),
+        usage.get('promptTokenCount'),
+        usage.get('candidatesTokenCount')
+    )
+
+class RestBackend(ModelBackend):
+    """generateContent / streamGenerateContent over plain HTTP (urllib).
+
+    Talks to the public API or to a stand-in such as fake_gemini_server
+    via `endpoint`; needs no SDK.
+    """
+
+    name = 'rest'
+
+    def __init__(self, model_name: str, api_key: Optional[str] = None,
+                 endpoint: str = "https://generativelanguage.googleapis.com"):
+        self.model_name = model_name
+        self.api_key = api_key or ""
+        self.endpoint = endpoint.rstrip('/')
+
+    def _request(self, method: str, prompt: str, generation_config: Optional[Dict],
+                 timeout: Optional[float], query: str = ""):
+        body = {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+        if generation_config:
+            config = {}
+            if 'response_mime_type' in generation_config:
+                config['responseMimeType'] = generation_config['response_mime_type']
+            if 'response_schema' in generation_config:
+                config['responseSchema'] = json_schema(generation_config['response_schema'])
+            body['generationConfig'] = config
+        request = urllib.request.Request(
+            f"{self.endpoint}/v1beta/models/{self.model_name}:{method}{query}",
+            data=json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json', 'x-goog-api-key': self.api_key},
+            method='POST'
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', {}).get('message', e.reason)
+            except ValueError:
+                message = e.reason
+            raise ModelAPIError(e.code, message) from None
+        except socket.timeout as e:
+            raise TimeoutError(str(e)) from None
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        with self._request('generateContent', prompt, generation_config, timeout) as response:
+            return _response(json.load(response))
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        with self._request('streamGenerateContent', prompt, generation_config, timeout, '?alt=sse') as response:
+            for line in response:
+                line = line.strip()
+                if line.startswith(b'data:'):
+                    chunk = _response(json.loads(line[5:]))
+                    if chunk.text:
+                        yield chunk
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for fakes, about 4 characters per token"""
+    return max(len(text) // 4, 1)
+
+class FakeBackend(ModelBackend):
+    """Offline stand-in for load tests: plans from the offline planner.
+
+    Latency to the first token is log-normal around `latency_median`
+    seconds; streams then emit `chunk_size` characters every
+    `chunk_interval` seconds. `error_rate` of the calls fail with a
+    503 (or 429, a third of the time) before producing anything.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency_median: float = 2.0, latency_sigma: float = 0.5,
+                 chunk_interval: float = 0.05, chunk_size: int = 80,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        from bot.services.planner import OfflinePlanner
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.chunk_interval = chunk_interval
+        self.chunk_size = max(chunk_size, 1)
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._planner = OfflinePlanner(seed=seed)
+
+    def _draw(self):
+        """Latency and whether the call fails, drawn under a lock for reproducibility"""
+        with self._lock:
+            self.calls += 1
+            latency = self._rng.lognormvariate(math.log(max(self.latency_median, 1e-6)), self.latency_sigma)
+            failure = None
+            if self._rng.random() < self.error_rate:
+                failure = 429 if self._rng.random() < 1 / 3 else 503
+        return latency, failure
+
+    def render(self, prompt: str, generation_config: Optional[Dict] = None) -> str:
+        """A plan shaped after the prompt's calories and day count"""
+        from bot.services.plan_render import compact_json, render_plan
+        calories = re.search(r"Калории в день: (\d+)", prompt)
+        days = re.search(r"на (\d+) (?:день|дня|дн)", prompt)
+        plan = self._planner.plan(
+            {'calories': int(calories.group(1)) if calories else 2000},
+            int(days.group(1)) if days else 1
+        )
+        if generation_config and generation_config.get('response_mime_type') == 'application/json':
+            return compact_json(plan)
+        return '\n\n'.join(render_plan(plan))
+
+    def _wait(self, latency: float, timeout: Optional[float], failure: Optional[int]):
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake backend call exceeded {timeout}s")
+        time.sleep(latency)
+        if failure:
+            raise ModelAPIError(failure, "Fake backend error")
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        latency, failure = self._draw()
+        self._wait(latency, timeout, failure)
+        text = self.render(prompt, generation_config)
+        return ModelResponse(text, estimate_tokens(prompt), estimate_tokens(text))
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        latency, failure = self._draw()
+        self._wait(latency, timeout, failure)
+        text = self.render(prompt, generation_config)
+        for start in range(0, len(text), self.chunk_size):
+            if start:
+                time.sleep(self.chunk_interval)
+            end = start + self.chunk_size
+            yield ModelResponse(text[start:end], estimate_tokens(prompt), estimate_tokens(text[:end]))
+
+def create_fake_backend(seed_offset: int = 0) -> FakeBackend:
+    """FakeBackend configured in bot.config"""
+    from bot.config import (
+        FAKE_LATENCY_MEDIAN,
+        FAKE_LATENCY_SIGMA,
+        FAKE_CHUNK_INTERVAL,
+        FAKE_CHUNK_SIZE,
+        FAKE_ERROR_RATE,
+        FAKE_SEED
+    )
+    return FakeBackend(
+        latency_median=FAKE_LATENCY_MEDIAN,
+        latency_sigma=FAKE_LATENCY_SIGMA,
+        chunk_interval=FAKE_CHUNK_INTERVAL,
+        chunk_size=FAKE_CHUNK_SIZE,
+        error_rate=FAKE_ERROR_RATE,
+        seed=FAKE_SEED + seed_offset if FAKE_SEED is not None else None
+    )
+
+def create_backend(model_name: str) -> ModelBackend:
+    """The ModelBackend selected by GEMINI_BACKEND (genai, rest or fake),
+    a KeyPool of them when GEMINI_API_KEYS lists several keys"""
+    from bot.config import GEMINI_BACKEND, GEMINI_API_KEY, GEMINI_API_KEYS, GEMINI_API_ENDPOINT
+    if GEMINI_BACKEND not in ('genai', 'rest', 'fake'):
+        raise ValueError(f"Unknown GEMINI_BACKEND: {GEMINI_BACKEND}")
+
+    def single(api_key: Optional[str], model: str, index: int = 0) -> ModelBackend:
+        if GEMINI_BACKEND == 'fake':
+            return create_fake_backend(index)
+        # genai.configure binds the SDK to GEMINI_API_KEY for the whole
+        # process, other keys talk to the same API over REST
+        if GEMINI_BACKEND == 'rest' or api_key != GEMINI_API_KEY:
+            return RestBackend(model, api_key, GEMINI_API_ENDPOINT)
+        return GenAIBackend(model)
+
+    from bot.services.key_pool import create_key_pool, parse_api_keys
+    keys = parse_api_keys(GEMINI_API_KEYS, model_name)
+    if len(keys) <= 1:
+        api_key, model = keys[0] if keys else (GEMINI_API_KEY, model_name)
+        return single(api_key, model)
+    return create_key_pool(keys, single)
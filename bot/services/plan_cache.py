@@ -0,0 +1,140 @@
+import hashlib
+import json
+import random
+import time
+from typing import Dict, Optional
+
+from bot.services.cache import MISSING, TTLCache
+
+# Bump when the prompt changes so old plans stop matching
+PROMPT_VERSION = 1
+
+def _bucket(value, step: int):
+    try:
+        return int(round(float(value) / step) * step) if step > 1 else int(value)
+    except (TypeError, ValueError):
+        return value
+
+class PlanCache:
+    """Two-tier cache of generated plans: in-process LRU over the plan_cache table.
+
+    Profiles are bucketed (weight, height, age, calories) so that nearly
+    identical requests share an entry. Up to `variants` plans are kept per
+    key; until that many exist a lookup is a miss so the caller generates
+    another one, afterwards a random variant is served.
+    """
+
+    def __init__(self, db, maxsize: int = 1000, ttl: float = 7 * 24 * 60 * 60,
+                 variants: int = 3, max_rows: int = 50000, weight_step: int = 5,
+                 height_step: int = 5, age_step: int = 10, calories_step: int = 100):
+        self.db = db
+        self.ttl = ttl
+        self.variants = max(variants, 1)
+        self.max_rows = max_rows
+        self.steps = {
+            'weight': weight_step,
+            'height': height_step,
+            'age': age_step,
+            'calories': calories_step
+        }
+        self.hits = 0
+        self.misses = 0
+        self._memory = TTLCache(maxsize, min(ttl, 60 * 60))
+
+    def canonical_profile(self, profile: Dict) -> Dict:
+        """Profile with numeric fields rounded to their bucket"""
+        canonical = dict(profile)
+        for field, step in self.steps.items():
+            if field in canonical:
+                canonical[field] = _bucket(canonical[field], step)
+        return canonical
+
+    def key(self, profile: Dict, days: int, meal_type: str, plan_format: str = 'text') -> str:
+        """Fingerprint of everything that shapes the prompt"""
+        canonical = self.canonical_profile(profile)
+        fingerprint = {
+            'v': PROMPT_VERSION,
+            'days': days,
+            'meal_type': meal_type,
+            'goal': canonical.get('goal'),
+            'gender': canonical.get('gender'),
+            'age': canonical.get('age'),
+            'weight': canonical.get('weight'),
+            'height': canonical.get('height'),
+            'calories': canonical.get('calories', 2000)
+        }
+        # Text keys predate the format field, keep them unchanged
+        if plan_format != 'text':
+            fingerprint['format'] = plan_format
+        raw = json.dumps(fingerprint, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    async def _variants(self, key: str) -> list:
+        min_created_at = int(time.time() - self.ttl)
+        variants = self._memory.get(key)
+        if variants is MISSING:
+            # A put() racing the read makes the result stale, don't keep it
+            token = self._memory.token()
+            variants = await self.db.get_cached_plans(key, min_created_at)
+            self._memory.set(key, variants, token=token)
+        return [plan for created_at, plan in variants if created_at >= min_created_at]
+
+    async def get(self, key: str) -> Optional[str]:
+        """A cached plan, or None when the key needs another variant"""
+        variants = await self._variants(key)
+        if len(variants) < self.variants:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return random.choice(variants)
+
+    async def any(self, key: str) -> Optional[str]:
+        """Any fresh variant, however few exist; used as a fallback"""
+        variants = await self._variants(key)
+        return random.choice(variants) if variants else None
+
+    async def put(self, key: str, plan: str):
+        await self.db.save_cached_plan(
+            key,
+            plan,
+            self.variants,
+            self.max_rows,
+            int(time.time() - self.ttl)
+        )
+        self._memory.invalidate(key)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory': self._memory.stats()
+        }
+
+def create_plan_cache(db) -> Optional[PlanCache]:
+    """Build the PlanCache configured in bot.config (None when disabled)"""
+    from bot.config import (
+        PLAN_CACHE_ENABLED,
+        PLAN_CACHE_SIZE,
+        PLAN_CACHE_TTL,
+        PLAN_CACHE_VARIANTS,
+        PLAN_CACHE_MAX_ROWS,
+        PLAN_CACHE_WEIGHT_STEP,
+        PLAN_CACHE_HEIGHT_STEP,
+        PLAN_CACHE_AGE_STEP,
+        PLAN_CACHE_CALORIES_STEP
+    )
+    if not PLAN_CACHE_ENABLED:
+        return None
+    return PlanCache(
+        db,
+        maxsize=PLAN_CACHE_SIZE,
+        ttl=PLAN_CACHE_TTL,
+        variants=PLAN_CACHE_VARIANTS,
+        max_rows=PLAN_CACHE_MAX_ROWS,
+        weight_step=PLAN_CACHE_WEIGHT_STEP,
+        height_step=PLAN_CACHE_HEIGHT_STEP,
+        age_step=PLAN_CACHE_AGE_STEP,
+        calories_step=PLAN_CACHE_CALORIES_STEP
+    )
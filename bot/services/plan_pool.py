@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from bot.services.plan_cache import _bucket
+
+class PlanPool:
+    """Ready-made daily plans for the most requested profile buckets.
+
+    A bucket is goal × gender × calorie band × diet type. Plans are taken
+    (removed) when served, so each one reaches a single user; plans older
+    than `max_age` seconds are never served.
+    """
+
+    def __init__(self, db, depth: int = 3, max_age: float = 36 * 60 * 60,
+                 calories_step: int = 100):
+        self.db = db
+        self.depth = max(depth, 1)
+        self.max_age = max_age
+        self.calories_step = calories_step
+        self.hits = 0
+        self.misses = 0
+
+    def bucket_key(self, goal: str, gender: str, calories, meal_type: str,
+                   plan_format: str = 'text') -> str:
+        band = _bucket(calories or 2000, self.calories_step)
+        key = f"{goal}|{gender}|{band}|{meal_type}"
+        return key if plan_format == 'text' else f"{key}|{plan_format}"
+
+    def min_created_at(self) -> int:
+        return int(time.time() - self.max_age)
+
+    async def take(self, profile: Dict, meal_type: str, plan_format: str = 'text') -> Optional[str]:
+        """A pre-generated plan matching the profile, or None"""
+        key = self.bucket_key(
+            profile.get('goal'), profile.get('gender'), profile.get('calories'), meal_type, plan_format
+        )
+        plan = await self.db.take_pool_plan(key, self.min_created_at())
+        if plan:
+            self.hits += 1
+            logging.info(f"Serving meal plan from pool: {key}")
+        else:
+            self.misses += 1
+        return plan
+
+    async def put(self, key: str, plan: str):
+        await self.db.add_pool_plan(key, plan)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+def _parse_hours(hours: str) -> Tuple[int, int]:
+    """'2-7' -> (2, 7); the window may wrap around midnight ('22-6')"""
+    start, end = hours.split('-')
+    return int(start) % 24, int(end) % 24
+
+class PoolFiller:
+    """Background task that tops up the plan pool during off-peak hours.
+
+    Each pass drops stale plans, mines the `top_buckets` most requested
+    daily buckets of the last `history_days` and generates plans for the
+    ones below the pool depth, most popular first. At most `daily_budget`
+    Gemini requests are spent per day, `concurrency` at a time so user
+    requests keep most of the concurrency cap.
+    """
+
+    def __init__(self, pool: PlanPool, gemini, interval: float = 600.0,
+                 hours: str = "2-7", top_buckets: int = 20, history_days: int = 14,
+                 daily_budget: int = 200, concurrency: int = 2):
+        self.pool = pool
+        self.gemini = gemini
+        self.interval = interval
+        self.hours = _parse_hours(hours)
+        self.top_buckets = top_buckets
+        self.history_days = history_days
+        self.daily_budget = daily_budget
+        self.concurrency = max(concurrency, 1)
+        self.generated_total = 0
+        self.failed_total = 0
+        self.pruned_total = 0
+        self.skipped_total = 0
+        self._budget_day: Optional[date] = None
+        self._budget_used = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="plan-pool-filler")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_off_peak(self, now: Optional[datetime] = None) -> bool:
+        hour = (now or datetime.now()).hour
+        start, end = self.hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def budget_left(self) -> int:
+        today = date.today()
+        if self._budget_day != today:
+            self._budget_day = today
+            self._budget_used = 0
+        return max(self.daily_budget - self._budget_used, 0)
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_off_peak():
+                    await self.fill_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in plan pool filler: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _deficits(self) -> List[Tuple[str, Dict, int, str]]:
+        """(bucket_key, average profile, missing plans, diet type) by popularity"""
+        since = int(time.time() - self.history_days * 24 * 60 * 60)
+        buckets = await self.pool.db.get_top_buckets(since, self.top_buckets, self.pool.calories_step)
+        counts = await self.pool.db.count_pool_plans(self.pool.min_created_at())
+        deficits = []
+        for bucket in buckets:
+            key = self.pool.bucket_key(
+                bucket['goal'], bucket['gender'], bucket['calories'], bucket['meal_type'], self.gemini.plan_format
+            )
+            missing = self.pool.depth - counts.get(key, 0)
+            if missing > 0:
+                profile = {
+                    'age': bucket['age'],
+                    'gender': bucket['gender'],
+                    'weight': bucket['weight'],
+                    'height': bucket['height'],
+                    'goal': bucket['goal'],
+                    'calories': bucket['calories']
+                }
+                deficits.append((key, profile, missing, bucket['meal_type']))
+        return deficits
+
+    async def fill_once(self) -> int:
+        """Run one pass, return the number of plans added to the pool"""
+        pruned = await self.pool.db.prune_pool(self.pool.min_created_at())
+        self.pruned_total += pruned
+
+        # Round-robin over buckets so the budget is spread by popularity
+        jobs = []
+        deficits = await self._deficits()
+        for round_ in range(self.pool.depth):
+            for key, profile, missing, meal_type in deficits:
+                if round_ < missing:
+                    jobs.append((key, profile, meal_type))
+        jobs = jobs[:self.budget_left()]
+        if not jobs:
+            return 0
+        self._budget_used += len(jobs)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fill(key: str, profile: Dict, meal_type: str) -> bool:
+            async with semaphore:
+                # Only spare quota goes to the pool, users' calls come first
+                quota = getattr(self.gemini, 'quota', None)
+                if quota and not quota.available():
+                    self.skipped_total += 1
+                    self._budget_used -= 1
+                    return False
+                plan = await self.gemini.pregenerate(profile, 1, meal_type)
+            if not plan:
+                self.failed_total += 1
+                return False
+            await self.pool.put(key, plan)
+            return True
+
+        results = await asyncio.gather(*[fill(*job) for job in jobs])
+        added = sum(results)
+        self.generated_total += added
+        logging.info(
+            f"Plan pool filled: {added} plans added, {len(jobs) - added} failed or skipped, "
+            f"{pruned} stale removed, {self.budget_left()} requests left today"
+        )
+        return added
+
+    def stats(self) -> Dict:
+        return {
+            **self.pool.stats(),
+            'generated': self.generated_total,
+            'failed': self.failed_total,
+            'pruned': self.pruned_total,
+            'skipped': self.skipped_total,
+            'budget_left': self.budget_left()
+        }
+
+def create_plan_pool(db) -> Optional[PlanPool]:
+    """Build the PlanPool configured in bot.config (None when disabled)"""
+    from bot.config import (
+        PLAN_POOL_ENABLED,
+        PLAN_POOL_DEPTH,
+        PLAN_POOL_MAX_AGE,
+        PLAN_CACHE_CALORIES_STEP
+    )
+    if not PLAN_POOL_ENABLED:
+        return None
+    return PlanPool(
+        db,
+        depth=PLAN_POOL_DEPTH,
+        max_age=PLAN_POOL_MAX_AGE,
+        calories_step=PLAN_CACHE_CALORIES_STEP
+    )
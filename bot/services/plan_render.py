@@ -0,0 +1,135 @@
+import json
+import logging
+from typing import Dict, List, Optional, TypedDict
+
+# Telegram allows 4096 characters per message, keep a margin
+MESSAGE_LIMIT = 4000
+
+# Response schema of structured generation. Day totals are not requested,
+# they are summed locally.
+
+class Meal(TypedDict):
+    type: str
+    time: str
+    name: str
+    calories: int
+    protein: int
+    carbs: int
+    fat: int
+    ingredients: List[str]
+
+class Day(TypedDict):
+    day: int
+    meals: List[Meal]
+
+class Plan(TypedDict):
+    days: List[Day]
+    tips: List[str]
+
+MEAL_EMOJI = {
+    'завтрак': '🍳',
+    'обед': '🍲',
+    'ужин': '🍽️',
+    'перекус': '🍎'
+}
+
+def compact_json(plan: Dict) -> str:
+    return json.dumps(plan, ensure_ascii=False, separators=(',', ':'))
+
+def parse_plan(text: str) -> Optional[Plan]:
+    """Plan from the model's JSON, None when it does not have the expected shape"""
+    try:
+        plan = json.loads(text)
+        days = plan['days']
+        if not isinstance(days, list) or not all(isinstance(day.get('meals'), list) for day in days):
+            raise ValueError("days must be a list of days with meals")
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logging.error(f"Invalid structured plan: {e}")
+        return None
+    plan.setdefault('tips', [])
+    return plan
+
+def merge_plans(plans: List[Plan]) -> Plan:
+    """One plan from parts generated separately, days in the given order"""
+    return {
+        'days': [day for plan in plans for day in plan['days']],
+        'tips': [tip for plan in plans for tip in plan.get('tips', [])]
+    }
+
+def _number(value) -> int:
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+def render_meal(meal: Meal) -> str:
+    meal_type = str(meal.get('type', '')).strip()
+    emoji = MEAL_EMOJI.get(meal_type.lower(), '🍴')
+    header = f"{emoji} {meal_type.upper()}"
+    if meal.get('time'):
+        header += f" ({meal['time']})"
+    lines = [
+        header,
+        f"• {meal.get('name', '')}",
+        f"• Калории: {_number(meal.get('calories'))} ккал",
+        f"• БЖУ: {_number(meal.get('protein'))}г белков, "
+        f"{_number(meal.get('carbs'))}г углеводов, {_number(meal.get('fat'))}г жиров"
+    ]
+    if meal.get('ingredients'):
+        lines.append(f"• Ингредиенты: {', '.join(meal['ingredients'])}")
+    return '\n'.join(lines)
+
+def render_totals(day: Day) -> str:
+    meals = day['meals']
+    return '\n'.join([
+        "📊 СТАТИСТИКА ЗА ДЕНЬ:",
+        f"• Калории: {sum(_number(m.get('calories')) for m in meals)} ккал",
+        f"• Белки: {sum(_number(m.get('protein')) for m in meals)}г",
+        f"• Углеводы: {sum(_number(m.get('carbs')) for m in meals)}г",
+        f"• Жиры: {sum(_number(m.get('fat')) for m in meals)}г"
+    ])
+
+def _pack(blocks: List[str], limit: int) -> List[str]:
+    """Join blocks with blank lines into as few messages as fit the limit"""
+    messages = []
+    current = ""
+    for block in blocks:
+        candidate = f"{current}\n\n{block}" if current else block
+        if current and len(candidate) > limit:
+            messages.append(current)
+            current = block
+        else:
+            current = candidate
+    if current:
+        messages.append(current)
+    # A single oversized block is cut at the limit as a last resort
+    return [m[i:i + limit] for m in messages for i in range(0, len(m), limit)]
+
+def render_plan(plan: Plan, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Telegram messages for a plan: one per day (split at meals if a day is
+    too long), recommendations last"""
+    messages = []
+    for index, day in enumerate(plan['days'], start=1):
+        blocks = [f"🍽️ ДЕНЬ {day.get('day') or index}"]
+        blocks += [render_meal(meal) for meal in day['meals']]
+        blocks.append(render_totals(day))
+        messages += _pack(blocks, limit)
+    if plan.get('tips'):
+        tips = "👨‍🍳 РЕКОМЕНДАЦИИ:\n" + '\n'.join(f"• {tip}" for tip in plan['tips'])
+        messages += _pack([tips], limit)
+    return messages
+
+def plan_meals(plan: Plan) -> List[Dict]:
+    """Meals of a plan in the shape DatabaseService.save_meal expects"""
+    return [
+        {
+            'type': meal.get('type', ''),
+            'name': meal.get('name', ''),
+            'calories': _number(meal.get('calories')),
+            'protein': _number(meal.get('protein')),
+            'carbs': _number(meal.get('carbs')),
+            'fat': _number(meal.get('fat'))
+        }
+        for day in plan['days']
+        for meal in day['meals']
+    ]
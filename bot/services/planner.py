@@ -0,0 +1,285 @@
+import random
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from bot.services.plan_render import Day, Meal, Plan
+
+class Dish(NamedTuple):
+    name: str
+    slot: str
+    protein: float
+    carbs: float
+    fat: float
+    tags: Tuple[str, ...]
+    # (ingredient, grams) of one portion
+    ingredients: Tuple[Tuple[str, int], ...]
+
+    @property
+    def calories(self) -> float:
+        return 4 * self.protein + 4 * self.carbs + 9 * self.fat
+
+# Bundled dish table, macros in grams per portion
+FOODS: Tuple[Dish, ...] = (
+    # Завтраки
+    Dish("Овсяная каша с бананом", 'breakfast', 11, 60, 7, ('veg',),
+         (("овсянка", 60), ("молоко", 200), ("банан", 100))),
+    Dish("Омлет с овощами", 'breakfast', 21, 8, 20, ('egg', 'lowcarb'),
+         (("яйца", 150), ("помидор", 80), ("шпинат", 40), ("оливковое масло", 5))),
+    Dish("Творог с ягодами", 'breakfast', 28, 20, 6, ('dairy', 'lowcarb'),
+         (("творог 5%", 200), ("ягоды", 100))),
+    Dish("Греческий йогурт с орехами и медом", 'breakfast', 20, 28, 14, ('dairy', 'med'),
+         (("греческий йогурт", 200), ("грецкие орехи", 15), ("мед", 10))),
+    Dish("Гречка с яйцом", 'breakfast', 15, 45, 10, ('egg',),
+         (("гречка", 60), ("яйцо", 50), ("сливочное масло", 5))),
+    Dish("Сырники со сметаной", 'breakfast', 24, 38, 14, ('dairy',),
+         (("творог", 180), ("мука", 25), ("яйцо", 50), ("сметана 10%", 30))),
+    Dish("Тост с авокадо и яйцом пашот", 'breakfast', 16, 30, 22, ('egg', 'med'),
+         (("цельнозерновой хлеб", 60), ("авокадо", 70), ("яйцо", 50))),
+    Dish("Скрэмбл с лососем", 'breakfast', 28, 3, 26, ('fish', 'lowcarb', 'med'),
+         (("яйца", 120), ("слабосоленый лосось", 60), ("зелень", 10))),
+    Dish("Гранола с йогуртом", 'breakfast', 14, 55, 14, ('dairy',),
+         (("гранола", 60), ("натуральный йогурт", 150))),
+    Dish("Протеиновые блины", 'breakfast', 30, 35, 8, ('egg', 'dairy'),
+         (("овсяная мука", 40), ("яичные белки", 120), ("творог", 100))),
+    # Обеды
+    Dish("Куриная грудка с рисом и овощами", 'lunch', 45, 55, 10, ('poultry',),
+         (("куриная грудка", 150), ("рис", 70), ("овощи", 150))),
+    Dish("Гречка с говядиной", 'lunch', 38, 55, 18, ('meat',),
+         (("говядина", 130), ("гречка", 70), ("лук", 30))),
+    Dish("Лосось с киноа и брокколи", 'lunch', 38, 40, 26, ('fish', 'med'),
+         (("лосось", 140), ("киноа", 60), ("брокколи", 150))),
+    Dish("Индейка с булгуром", 'lunch', 40, 50, 14, ('poultry',),
+         (("филе индейки", 150), ("булгур", 65), ("овощи", 100))),
+    Dish("Чечевичный суп с хлебом", 'lunch', 24, 65, 8, ('legume', 'veg', 'med'),
+         (("чечевица", 80), ("овощи", 150), ("цельнозерновой хлеб", 40))),
+    Dish("Салат с тунцом и фасолью", 'lunch', 34, 30, 18, ('fish', 'legume', 'med'),
+         (("тунец", 120), ("фасоль", 100), ("листья салата", 80), ("оливковое масло", 10))),
+    Dish("Паста с курицей и томатами", 'lunch', 40, 70, 14, ('poultry', 'med'),
+         (("паста из твердых сортов", 80), ("куриное филе", 120), ("томаты", 150))),
+    Dish("Говяжий стейк с салатом", 'lunch', 45, 10, 32, ('meat', 'lowcarb'),
+         (("говяжий стейк", 180), ("овощной салат", 200), ("оливковое масло", 10))),
+    Dish("Курица с тушеными овощами", 'lunch', 42, 15, 16, ('poultry', 'lowcarb'),
+         (("куриное бедро без кожи", 170), ("кабачок", 150), ("перец", 100))),
+    Dish("Нут с овощами и кускусом", 'lunch', 20, 80, 12, ('legume', 'veg', 'med'),
+         (("нут", 100), ("кускус", 60), ("овощи", 150))),
+    Dish("Треска с картофелем", 'lunch', 35, 50, 10, ('fish',),
+         (("треска", 180), ("картофель", 200), ("сливочное масло", 5))),
+    Dish("Креветки с рисом и овощами", 'lunch', 35, 55, 10, ('seafood', 'med'),
+         (("креветки", 150), ("рис", 65), ("овощи", 150))),
+    # Ужины
+    Dish("Запеченная рыба с овощами", 'dinner', 38, 18, 18, ('fish', 'lowcarb', 'med'),
+         (("белая рыба", 200), ("овощи", 200), ("оливковое масло", 10))),
+    Dish("Куриные котлеты с салатом", 'dinner', 40, 15, 20, ('poultry', 'lowcarb'),
+         (("куриный фарш", 180), ("овощной салат", 150))),
+    Dish("Творожная запеканка", 'dinner', 32, 30, 12, ('dairy',),
+         (("творог", 200), ("манка", 20), ("яйцо", 50))),
+    Dish("Фасоль с индейкой", 'dinner', 38, 35, 14, ('legume', 'poultry'),
+         (("филе индейки", 130), ("фасоль", 120), ("томаты", 100))),
+    Dish("Омлет с сыром и зеленью", 'dinner', 26, 5, 28, ('egg', 'dairy', 'lowcarb'),
+         (("яйца", 150), ("сыр", 30), ("зелень", 20))),
+    Dish("Говядина с тушеными овощами", 'dinner', 40, 20, 22, ('meat', 'lowcarb'),
+         (("говядина", 150), ("овощи", 200))),
+    Dish("Лосось с салатом", 'dinner', 34, 8, 30, ('fish', 'lowcarb', 'med'),
+         (("лосось", 150), ("листья салата", 100), ("огурец", 100))),
+    Dish("Киноа с овощами и фетой", 'dinner', 16, 50, 18, ('veg', 'dairy', 'med'),
+         (("киноа", 70), ("овощи", 150), ("фета", 40))),
+    Dish("Индейка с брокколи", 'dinner', 42, 12, 16, ('poultry', 'lowcarb'),
+         (("филе индейки", 170), ("брокколи", 200))),
+    Dish("Кальмары с овощами", 'dinner', 32, 15, 16, ('seafood', 'lowcarb', 'med'),
+         (("кальмары", 180), ("овощи", 150), ("оливковое масло", 10))),
+    Dish("Гречневая лапша с курицей", 'dinner', 35, 55, 11, ('poultry',),
+         (("гречневая лапша", 70), ("куриное филе", 120), ("овощи", 100))),
+    Dish("Тофу с овощами и рисом", 'dinner', 22, 50, 14, ('legume', 'veg'),
+         (("тофу", 150), ("рис", 60), ("овощи", 150))),
+    # Перекусы
+    Dish("Яблоко с арахисовой пастой", 'snack', 5, 25, 9, ('veg',),
+         (("яблоко", 150), ("арахисовая паста", 15))),
+    Dish("Греческий йогурт", 'snack', 15, 6, 5, ('dairy', 'lowcarb', 'med'),
+         (("греческий йогурт", 150),)),
+    Dish("Миндаль", 'snack', 6, 6, 15, ('veg', 'lowcarb', 'med'),
+         (("миндаль", 30),)),
+    Dish("Банан", 'snack', 1, 27, 0, ('veg',),
+         (("банан", 120),)),
+    Dish("Протеиновый коктейль", 'snack', 25, 10, 3, ('dairy',),
+         (("сывороточный протеин", 30), ("молоко", 150))),
+    Dish("Хумус с морковью", 'snack', 6, 20, 8, ('legume', 'veg', 'med'),
+         (("хумус", 60), ("морковь", 100))),
+    Dish("Кефир", 'snack', 6, 8, 5, ('dairy',),
+         (("кефир 2.5%", 200),)),
+    Dish("Сыр с цельнозерновым хлебцем", 'snack', 10, 15, 9, ('dairy',),
+         (("сыр", 30), ("хлебцы", 25))),
+)
+
+# (dish slot, meal title, time, share of daily calories)
+SLOTS = (
+    ('breakfast', "Завтрак", "08:00", 0.25),
+    ('lunch', "Обед", "13:00", 0.35),
+    ('dinner', "Ужин", "19:00", 0.30),
+    ('snack', "Перекус", "16:00", 0.10),
+)
+
+# Share of calories from protein, carbs and fat per diet type
+MACRO_SPLITS = {
+    'balanced': (0.25, 0.50, 0.25),
+    'high_protein': (0.35, 0.40, 0.25),
+    'low_carb': (0.30, 0.20, 0.50),
+    'mediterranean': (0.20, 0.45, 0.35),
+}
+
+# Shift of the split for the profile goal
+GOAL_SHIFTS = {
+    'lose_weight': (0.05, -0.05, 0.0),
+    'gain_muscle': (0.05, 0.0, -0.05),
+    'maintain': (0.0, 0.0, 0.0),
+}
+
+# Dishes with the tag are preferred for the diet type
+DIET_TAGS = {
+    'low_carb': 'lowcarb',
+    'mediterranean': 'med',
+}
+
+PORTIONS = (0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0, 2.5, 3.0)
+
+# Error added per dish already served earlier in the plan
+REPEAT_PENALTY = 0.5
+
+TIPS = {
+    'lose_weight': [
+        "Готовьте на пару, запекайте или тушите без лишнего масла",
+        "Взвешивайте порции, особенно крупы и орехи",
+        "Пейте воду перед едой, это помогает не переедать"
+    ],
+    'gain_muscle': [
+        "Распределяйте белок равномерно по приемам пищи",
+        "Ешьте в течение 1-2 часов после тренировки",
+        "Готовьте крупы заранее на несколько дней"
+    ],
+    'maintain': [
+        "Держите разнообразие: меняйте источники белка в течение недели",
+        "Добавляйте овощи к каждому основному приему пищи",
+        "Готовьте крупы заранее на несколько дней"
+    ],
+}
+
+class _Candidate(NamedTuple):
+    dish: Dish
+    portion: float
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    repeated: bool
+
+class OfflinePlanner:
+    """Meal plans from the bundled dish table, without a network call.
+
+    For each meal slot the dishes closest to the slot's calorie share are
+    taken at the best fitting portion size; the top `candidates` per slot
+    (by fit, diet preference and variety) are then searched exhaustively
+    for the combination whose day totals best match the calorie target
+    and the macro split of the diet type, shifted for the goal.
+    """
+
+    def __init__(self, foods: Sequence[Dish] = FOODS, candidates: int = 5,
+                 seed: Optional[int] = None):
+        self.candidates = max(candidates, 1)
+        self._rng = random.Random(seed)
+        self._by_slot: Dict[str, List[Dish]] = {}
+        for dish in foods:
+            self._by_slot.setdefault(dish.slot, []).append(dish)
+
+    def targets(self, calories: float, meal_type: str, goal: str) -> Tuple[float, float, float, float]:
+        """(kcal, protein g, carbs g, fat g) per day"""
+        split = MACRO_SPLITS.get(meal_type, MACRO_SPLITS['balanced'])
+        shift = GOAL_SHIFTS.get(goal, GOAL_SHIFTS['maintain'])
+        protein, carbs, fat = (share + delta for share, delta in zip(split, shift))
+        return calories, calories * protein / 4, calories * carbs / 4, calories * fat / 9
+
+    def _slot_candidates(self, slot: str, slot_calories: float, macro_shares: Tuple[float, float, float],
+                         diet_tag: Optional[str], used: set) -> List[_Candidate]:
+        scored = []
+        for dish in self._by_slot.get(slot, ()):
+            portion = min(PORTIONS, key=lambda p: abs(dish.calories * p - slot_calories))
+            calories = dish.calories * portion
+            fit = abs(calories - slot_calories) / slot_calories
+            # Distance of the dish's own macro split from the target split
+            shares = (4 * dish.protein / dish.calories, 4 * dish.carbs / dish.calories, 9 * dish.fat / dish.calories)
+            shape = sum(abs(a - b) for a, b in zip(shares, macro_shares))
+            score = fit + shape
+            if diet_tag and diet_tag in dish.tags:
+                score -= 0.2
+            repeated = dish.name in used
+            if repeated:
+                score += REPEAT_PENALTY
+            # Jitter so equally good dishes take turns
+            score += self._rng.uniform(0, 0.15)
+            scored.append((score, _Candidate(
+                dish, portion, calories,
+                dish.protein * portion, dish.carbs * portion, dish.fat * portion, repeated
+            )))
+        scored.sort(key=lambda item: item[0])
+        return [candidate for _, candidate in scored[:self.candidates]]
+
+    def _day(self, targets: Tuple[float, float, float, float], meal_type: str, goal: str, used: set) -> List[_Candidate]:
+        kcal, protein, carbs, fat = targets
+        macro_shares = (4 * protein / kcal, 4 * carbs / kcal, 9 * fat / kcal)
+        diet_tag = DIET_TAGS.get(meal_type)
+        options = [
+            self._slot_candidates(slot, kcal * share, macro_shares, diet_tag, used)
+            for slot, _, _, share in SLOTS
+        ]
+        # Running totals are extended one slot at a time instead of summing
+        # every full combination: (kcal, protein, carbs, fat, repeats), dishes
+        combos = [((0.0, 0.0, 0.0, 0.0, 0), ())]
+        for slot_options in options:
+            combos = [
+                ((k + c.calories, p + c.protein, cb + c.carbs, f + c.fat, r + c.repeated), chosen + (c,))
+                for (k, p, cb, f, r), chosen in combos
+                for c in slot_options
+            ]
+        # Overshooting hurts weight loss, undershooting hurts muscle gain
+        over_weight = 2 if goal == 'lose_weight' else 1
+        under_weight = 2 if goal == 'gain_muscle' else 1
+        best, best_error = None, float('inf')
+        for (total_kcal, total_protein, total_carbs, total_fat, repeats), chosen in combos:
+            kcal_error = (total_kcal - kcal) / kcal
+            kcal_error *= over_weight if kcal_error > 0 else under_weight
+            protein_error = (total_protein - protein) / protein
+            carbs_error = (total_carbs - carbs) / carbs
+            fat_error = (total_fat - fat) / fat
+            error = (
+                4 * kcal_error * kcal_error
+                + protein_error * protein_error
+                + carbs_error * carbs_error
+                + fat_error * fat_error
+                + REPEAT_PENALTY * repeats
+            )
+            if error < best_error:
+                best, best_error = chosen, error
+        return list(best)
+
+    def plan(self, profile: Dict, days: int = 1, meal_type: str = 'balanced') -> Plan:
+        """A plan in the plan_render.Plan shape"""
+        goal = profile.get('goal', 'maintain')
+        targets = self.targets(float(profile.get('calories') or 2000), meal_type, goal)
+        used = set()
+        plan_days: List[Day] = []
+        for day_number in range(1, days + 1):
+            meals: List[Meal] = []
+            for candidate, (_, title, time_, _) in zip(self._day(targets, meal_type, goal, used), SLOTS):
+                dish, portion = candidate.dish, candidate.portion
+                used.add(dish.name)
+                meals.append({
+                    'type': title,
+                    'time': time_,
+                    'name': dish.name,
+                    'calories': round(candidate.calories),
+                    'protein': round(candidate.protein),
+                    'carbs': round(candidate.carbs),
+                    'fat': round(candidate.fat),
+                    'ingredients': [f"{name} {round(grams * portion)} г" for name, grams in dish.ingredients]
+                })
+            # Snack goes between lunch and dinner
+            meals.sort(key=lambda meal: meal['time'])
+            plan_days.append({'day': day_number, 'meals': meals})
+        return {'days': plan_days, 'tips': list(TIPS.get(goal, TIPS['maintain']))}
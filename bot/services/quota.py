@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from bot.services.model_backends import estimate_tokens
+
+class QuotaExceededError(Exception):
+    """Raised instead of calling the model when the quota can't serve the call soon enough"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gemini quota exhausted, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def quota_message(retry_after: float) -> str:
+    minutes = max(int(retry_after // 60) + 1, 1)
+    return (
+        "❌ Сервис генерации сейчас перегружен.\n"
+        f"Пожалуйста, попробуйте через {minutes} мин."
+    )
+
+class TokenBucket:
+    """Budget of `capacity` units per minute that may go into debt.
+
+    Callers reserve before they wait, so the tokens left (negative while
+    calls are queued) give the wait of the next caller directly and calls
+    are admitted in arrival order. capacity 0 means unlimited.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        # A single call larger than the bucket only needs it full
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self._refill()
+            self.tokens -= amount
+
+    def give(self, amount: float):
+        if self.capacity:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        if self.capacity:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+class QuotaGovernor:
+    """Keeps all model calls of the process under the RPM and TPM quota
+    of its keys.
+
+    Every call reserves one request and its estimated tokens (prompt plus
+    an average of recent outputs) and waits for both budgets; the estimate
+    is corrected from the response's usage metadata. A call that would
+    wait longer than `max_wait` seconds is refused with QuotaExceededError
+    instead of being sent to fail with a 429. A 429 from the API empties
+    both budgets so the following calls back off.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_wait: float = 30.0,
+                 output_tokens: int = 1500):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.output_estimate = float(output_tokens)
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.throttled_total = 0
+        self.waited_seconds = 0.0
+
+    def estimate(self, prompt: str) -> int:
+        """Tokens a call with this prompt is expected to use"""
+        return estimate_tokens(prompt) + int(self.output_estimate)
+
+    def eta(self, requests: int = 1, tokens: Optional[int] = None) -> float:
+        """Seconds before `requests` calls of `tokens` total could start now"""
+        if tokens is None:
+            tokens = requests * int(self.output_estimate * 1.5)
+        return max(self.requests.wait_time(requests), self.tokens.wait_time(tokens))
+
+    def available(self) -> bool:
+        """Whether a typical call would start without waiting"""
+        return self.eta() == 0
+
+    async def acquire(self, tokens: int) -> int:
+        """Reserve a call of `tokens` tokens and wait for its turn.
+
+        Returns the reserved amount, to be passed to settle().
+        """
+        wait = self.eta(1, tokens)
+        if wait > self.max_wait:
+            self.rejected_total += 1
+            raise QuotaExceededError(wait)
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted_total += 1
+        if wait > 0:
+            self.waited_seconds += wait
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # The call is not made after all
+                self.requests.give(1)
+                self.tokens.give(tokens)
+                raise
+        return tokens
+
+    def settle(self, reserved: int, prompt_tokens: Optional[int], output_tokens: Optional[int]):
+        """Correct the token budget with the usage a call actually reported"""
+        if output_tokens is not None:
+            # Moving average of the output size for future estimates
+            self.output_estimate += 0.1 * (output_tokens - self.output_estimate)
+        if prompt_tokens is None or output_tokens is None:
+            return
+        used = prompt_tokens + output_tokens
+        if used > reserved:
+            self.tokens.take(used - reserved)
+        else:
+            self.tokens.give(reserved - used)
+
+    def release(self, reserved: int):
+        """Give back the tokens of a call that used none: it failed, was
+        cancelled or lost a hedge race"""
+        self.tokens.give(reserved)
+
+    def throttle(self):
+        """The API answered 429: stop admitting until the budgets refill"""
+        self.throttled_total += 1
+        self.requests.drain()
+        self.tokens.drain()
+        logging.warning("Gemini quota exceeded (429), pausing new calls")
+
+    def stats(self) -> Dict:
+        return {
+            'rpm_left': round(self.requests.tokens, 1) if self.requests.capacity else None,
+            'tpm_left': round(self.tokens.tokens) if self.tokens.capacity else None,
+            'output_estimate': round(self.output_estimate),
+            'admitted': self.admitted_total,
+            'rejected': self.rejected_total,
+            'throttled': self.throttled_total,
+            'waited_seconds': round(self.waited_seconds, 1)
+        }
+
+def create_quota_governor() -> Optional[QuotaGovernor]:
+    """QuotaGovernor configured in bot.config, None when no quota is set.
+    The quota is per key, so a key pool gets the sum of its keys'."""
+    from bot.config import GEMINI_RPM, GEMINI_TPM, GEMINI_QUOTA_MAX_WAIT, GEMINI_API_KEYS
+    from bot.services.key_pool import parse_api_keys
+    if not GEMINI_RPM and not GEMINI_TPM:
+        return None
+    keys = max(len(parse_api_keys(GEMINI_API_KEYS, '')), 1)
+    return QuotaGovernor(rpm=GEMINI_RPM * keys, tpm=GEMINI_TPM * keys, max_wait=GEMINI_QUOTA_MAX_WAIT)
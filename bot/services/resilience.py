@@ -0,0 +1,153 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+# HTTP statuses of google.api_core errors worth another attempt
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection errors and 408/429/5xx API errors"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code in RETRYABLE_CODES
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n sleeps U(0, base * 2**n)"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class LatencyTracker:
+    """Rolling window of call durations; its percentile is the hedging delay"""
+
+    def __init__(self, window: int = 200, percentile: float = 95.0, min_samples: int = 20):
+        self.percentile_rank = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, rank: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(len(ordered) * rank / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, None until warmed up"""
+        if len(self._samples) < self.min_samples:
+            return None
+        return self.percentile(self.percentile_rank)
+
+    def stats(self) -> Dict:
+        return {
+            'samples': len(self._samples),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+class CircuitBreaker:
+    """Stops calls after `failure_threshold` consecutive failures.
+
+    While open every call fails fast; after `recovery_time` seconds one
+    trial call is let through (half-open) and its outcome closes or
+    reopens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.opened_total = 0
+        self.rejected_total = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_time:
+            self.state = self.HALF_OPEN
+            self._trial_running = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        self.rejected_total += 1
+        return False
+
+    def release_trial(self):
+        """Give back the half-open trial slot of a call that ended without
+        an outcome (refused before sending, or cancelled)"""
+        if self.state == self.HALF_OPEN:
+            self._trial_running = False
+
+    def record_success(self):
+        self._failures = 0
+        self._trial_running = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_total += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'opened': self.opened_total,
+            'rejected': self.rejected_total
+        }
+
+def create_resilience() -> Dict:
+    """GeminiService keyword arguments configured in bot.config"""
+    from bot.config import (
+        GEMINI_RETRY_ATTEMPTS,
+        GEMINI_RETRY_BASE_DELAY,
+        GEMINI_RETRY_MAX_DELAY,
+        GEMINI_HEDGE_ENABLED,
+        GEMINI_HEDGE_PERCENTILE,
+        GEMINI_HEDGE_MIN_SAMPLES,
+        GEMINI_BREAKER_THRESHOLD,
+        GEMINI_BREAKER_RECOVERY
+    )
+    return {
+        'retry_policy': RetryPolicy(
+            attempts=GEMINI_RETRY_ATTEMPTS,
+            base_delay=GEMINI_RETRY_BASE_DELAY,
+            max_delay=GEMINI_RETRY_MAX_DELAY
+        ),
+        'latency': LatencyTracker(
+            percentile=GEMINI_HEDGE_PERCENTILE,
+            min_samples=GEMINI_HEDGE_MIN_SAMPLES
+        ) if GEMINI_HEDGE_ENABLED else None,
+        'stream_latency': LatencyTracker(
+            percentile=GEMINI_HEDGE_PERCENTILE,
+            min_samples=GEMINI_HEDGE_MIN_SAMPLES
+        ) if GEMINI_HEDGE_ENABLED else None,
+        'breaker': CircuitBreaker(
+            failure_threshold=GEMINI_BREAKER_THRESHOLD,
+            recovery_time=GEMINI_BREAKER_RECOVERY
+        ) if GEMINI_BREAKER_THRESHOLD > 0 else None
+    }
@@ -0,0 +1,171 @@
+import asyncio
+import functools
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+class _Broadcast:
+    """Chunks of one running stream, replayed to every subscriber"""
+
+    def __init__(self):
+        self.chunks: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.pump: Optional[asyncio.Task] = None
+        self._cond = asyncio.Condition()
+
+    async def publish(self, chunk):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator:
+        position = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: position < len(self.chunks) or self.done)
+                pending = self.chunks[position:]
+                finished, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self.chunks):
+                if error:
+                    raise error
+                return
+
+class _Subscription:
+    """One caller's iterator over a shared stream.
+
+    Closing it (or running it to its end) leaves the stream; the stream is
+    stopped once nobody is left. Unlike an async generator it counts as
+    subscribed before the first chunk is requested, so a caller that
+    never starts iterating must close it.
+    """
+
+    def __init__(self, broadcast: _Broadcast, on_close: Callable[[], None]):
+        self._broadcast = broadcast
+        self._iterator = broadcast.subscribe()
+        self._on_close = on_close
+        self._closed = False
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """The stream's exception once it has failed, before it is read up to it"""
+        return self._broadcast.error
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            await self._iterator.aclose()
+            self._on_close()
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The shared work runs in its own task, so a caller being cancelled does
+    not cancel it for the others; its result or exception goes to everyone.
+    Work nobody waits for any more is cancelled.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        # Callers awaiting each running call
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        # Strong references so running stream pumps are not garbage collected
+        self._pumps = set()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, self._calls, key))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                # The last caller went away before the result; a new caller
+                # starts over instead of joining the cancelled call
+                task.cancel()
+                self._forget(self._calls, key, task)
+
+    @staticmethod
+    def _forget(running: Dict, key: Hashable, value):
+        """Drop a finished call unless a newer one took its key already"""
+        if running.get(key) is value:
+            del running[key]
+
+    def stream(self, key: Hashable, func: Callable[[], AsyncIterator]) -> _Subscription:
+        """Like do() for async iterators: late joiners get the chunks so far,
+        then the rest. The subscription must be iterated to its end or closed."""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.executed += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+
+            async def pump():
+                try:
+                    async for chunk in func():
+                        await broadcast.publish(chunk)
+                    await broadcast.close()
+                except asyncio.CancelledError as e:
+                    # Stopped, not failed: whoever still reads gets cancelled
+                    # rather than a model error to fall back from
+                    await broadcast.close(e)
+                    raise
+                except Exception as e:
+                    await broadcast.close(e)
+                finally:
+                    self._forget(self._streams, key, broadcast)
+
+            task = asyncio.ensure_future(pump())
+            broadcast.pump = task
+            self._pumps.add(task)
+            task.add_done_callback(self._pumps.discard)
+        else:
+            self.coalesced += 1
+        broadcast.subscribers += 1
+
+        def leave():
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers:
+                # Nobody reads the stream any more
+                broadcast.pump.cancel()
+                self._forget(self._streams, key, broadcast)
+
+        return _Subscription(broadcast, leave)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls) + len(self._streams)
+        }
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+SubscriptionEvent = Callable[[List[Dict]], Awaitable[None]]
+
+class SubscriptionSweeper:
+    """Background task that deactivates lapsed subscriptions.
+
+    Each pass clears is_active on expired rows in batches and hands them to
+    on_expired. With remind_before set, subscriptions ending within that many
+    seconds are passed once to on_reminder.
+    """
+
+    def __init__(self, db, interval: float = 60.0, batch_size: int = 500,
+                 on_expired: Optional[SubscriptionEvent] = None,
+                 remind_before: Optional[float] = None,
+                 on_reminder: Optional[SubscriptionEvent] = None):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_expired = on_expired
+        self.remind_before = remind_before
+        self.on_reminder = on_reminder
+        self.expired_total = 0
+        self.reminded_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="subscription-sweeper")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in subscription sweeper: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep_once(self) -> int:
+        """Run one pass, return the number of deactivated subscriptions"""
+        expired_count = 0
+        while True:
+            expired = await self.db.deactivate_expired_subscriptions(self.batch_size)
+            if not expired:
+                break
+            expired_count += len(expired)
+            for event in expired:
+                logging.info(f"Subscription expired: user {event['user_id']}, plan {event['plan']}")
+            if self.on_expired:
+                await self.on_expired(expired)
+            if len(expired) < self.batch_size:
+                break
+        self.expired_total += expired_count
+
+        if self.remind_before and self.on_reminder:
+            due = await self.db.get_subscriptions_to_remind(self.remind_before, self.batch_size)
+            if due:
+                await self.on_reminder(due)
+                await self.db.mark_subscriptions_reminded([s['user_id'] for s in due])
+                self.reminded_total += len(due)
+        return expired_count
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from bot.services.plan_render import MESSAGE_LIMIT
+
+class TelegramStreamWriter:
+    """Shows streamed text in a Telegram message that is edited as chunks arrive.
+
+    Edits are throttled to one per `edit_interval` seconds. When the text
+    outgrows the message limit the current message is finalized (split at
+    the last line break) and writing continues in a new one.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: Optional[int] = None,
+                 limit: int = MESSAGE_LIMIT, edit_interval: float = 1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.limit = limit
+        self.edit_interval = edit_interval
+        self._message_id = message_id
+        self._text = ""
+        self._shown = None
+        self._last_edit = 0.0
+        self._parts: List[str] = []
+
+    async def write(self, chunk: str):
+        self._text += chunk
+        while len(self._text) > self.limit:
+            cut = self._text.rfind('\n', 0, self.limit)
+            if cut <= 0:
+                cut = self.limit
+            head, self._text = self._text[:cut], self._text[cut:].lstrip('\n')
+            await self._show(head, force=True)
+            self._parts.append(head)
+            # The rest goes into a fresh message
+            self._message_id = None
+            self._shown = None
+        await self._show(self._text)
+
+    async def finish(self) -> str:
+        """Show the final text and return everything written"""
+        await self._show(self._text, force=True)
+        return '\n'.join(self._parts + [self._text])
+
+    async def _show(self, text: str, force: bool = False):
+        if not text.strip() or text == self._shown:
+            return
+        # The first chunk is shown at once to cut time to first content
+        if not force and self._shown is not None and time.monotonic() - self._last_edit < self.edit_interval:
+            return
+        while True:
+            try:
+                if self._message_id is None:
+                    message = await self.bot.send_message(self.chat_id, text)
+                    self._message_id = message.message_id
+                else:
+                    await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self._message_id)
+                break
+            except TelegramRetryAfter as e:
+                if not force:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                # "message is not modified" and similar are harmless here
+                logging.warning(f"Could not update streamed message: {e}")
+                break
+        self._shown = text
+        self._last_edit = time.monotonic()
@@ -0,0 +1,127 @@
+import bisect
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+from bot.services.database import WriteBehindQueue
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(ordered: Sequence[float], rank: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not ordered:
+        return None
+    index = min(int(len(ordered) * rank / 100), len(ordered) - 1)
+    return ordered[index]
+
+class Histogram:
+    """Counts in log-spaced buckets, so memory stays fixed however many
+    values are observed. Percentiles are the upper bound of the bucket
+    they fall in, i.e. accurate to about `factor`."""
+
+    def __init__(self, start: float = 1.0, factor: float = 1.25, buckets: int = 64):
+        self.bounds = [start * factor ** i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, rank: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = max(self.count * rank / 100, 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict:
+        summary = {'count': self.count, 'avg': round(self.total / self.count) if self.count else None}
+        for rank in PERCENTILES:
+            value = self.percentile(rank)
+            summary[f'p{rank}'] = round(value) if value is not None else None
+        return summary
+
+class Telemetry:
+    """Records one row per plan request served by GeminiService.
+
+    Rows go to the model_calls table through a write-behind queue that
+    never blocks the caller (rows are dropped while it is full) and feed
+    in-process histograms per plan type.
+    """
+
+    METRICS = ('wall_ms', 'ttfc_ms', 'prompt_tokens', 'output_tokens')
+
+    def __init__(self, db=None, flush_interval_ms: int = 1000, max_batch: int = 500,
+                 max_pending: int = 10000):
+        self.dropped = 0
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._outcomes: Dict[str, Counter] = {}
+        self._queue = None
+        if db is not None:
+            self._db = db
+            self._queue = WriteBehindQueue(
+                self._write,
+                flush_interval_ms=flush_interval_ms,
+                max_batch=max_batch,
+                max_pending=max_pending
+            )
+
+    def _write(self, batch: Dict[str, List[tuple]]):
+        self._db.save_model_calls(batch['model_call'])
+
+    def record(self, call: Dict):
+        """Account a finished request: plan_type, model, outcome, cache_hit,
+        wall_ms, ttfc_ms (None if nothing was produced), token counts"""
+        plan_type = call['plan_type']
+        histograms = self._histograms.setdefault(plan_type, {metric: Histogram() for metric in self.METRICS})
+        for metric in self.METRICS:
+            if call.get(metric) is not None:
+                histograms[metric].observe(call[metric])
+        self._outcomes.setdefault(plan_type, Counter())[call['outcome']] += 1
+        if self._queue and not self._queue.put('model_call', (
+            int(time.time()),
+            call['model'],
+            plan_type,
+            call['outcome'],
+            int(call.get('cache_hit', False)),
+            call.get('wall_ms'),
+            call.get('ttfc_ms'),
+            call.get('prompt_tokens'),
+            call.get('output_tokens')
+        ), block=False):
+            self.dropped += 1
+
+    def stats(self) -> Dict:
+        """Outcome counts and metric percentiles per plan type"""
+        return {
+            plan_type: {
+                'outcomes': dict(self._outcomes[plan_type]),
+                **{metric: histogram.snapshot() for metric, histogram in histograms.items()}
+            }
+            for plan_type, histograms in self._histograms.items()
+        }
+
+    def close(self):
+        """Write out queued rows"""
+        if self._queue:
+            self._queue.close()
+            self._queue = None
+        if self.dropped:
+            logging.warning(f"Telemetry dropped {self.dropped} rows while the write queue was full")
+
+def create_telemetry(db) -> Optional[Telemetry]:
+    """Telemetry configured in bot.config, None when disabled"""
+    from bot.config import TELEMETRY_ENABLED, TELEMETRY_FLUSH_INTERVAL_MS
+    if not TELEMETRY_ENABLED:
+        return None
+    return Telemetry(db.sync, flush_interval_ms=TELEMETRY_FLUSH_INTERVAL_MS)
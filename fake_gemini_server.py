@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Локальная заглушка Gemini API для нагрузочных и сквозных тестов.
+
+Отвечает на POST /v1beta/models/<model>:generateContent и
+:streamGenerateContent (?alt=sse) планами офлайн-планировщика с
+настраиваемой задержкой, скоростью потока и долей ошибок.
+
+    python fake_gemini_server.py --port 8089 --latency 2 --error-rate 0.05
+
+Бот подключается к ней так:
+
+    GEMINI_BACKEND=rest GEMINI_API_ENDPOINT=http://127.0.0.1:8089 python -m bot.main
+"""
+import argparse
+import itertools
+import json
+import logging
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bot.services.model_backends import FakeBackend, ModelAPIError, ModelResponse
+
+PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)")
+
+STATUS_NAMES = {
+    400: 'INVALID_ARGUMENT',
+    404: 'NOT_FOUND',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+    504: 'DEADLINE_EXCEEDED',
+}
+
+def _payload(response: ModelResponse, model: str, final: bool = True) -> dict:
+    return {
+        'candidates': [{
+            'content': {'role': 'model', 'parts': [{'text': response.text}]},
+            'finishReason': 'STOP' if final else None,
+            'index': 0
+        }],
+        'usageMetadata': {
+            'promptTokenCount': response.prompt_tokens,
+            'candidatesTokenCount': response.output_tokens,
+            'totalTokenCount': response.prompt_tokens + response.output_tokens
+        },
+        'modelVersion': model
+    }
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    backend: FakeBackend = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, code: int, message: str):
+        self._send_json(code, {'error': {
+            'code': code,
+            'message': message,
+            'status': STATUS_NAMES.get(code, 'UNKNOWN')
+        }})
+
+    def do_POST(self):
+        match = PATH_RE.match(self.path)
+        if not match:
+            self._send_error(404, f"Unknown path {self.path}")
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            prompt = ''.join(
+                part.get('text', '')
+                for content in request.get('contents', [])
+                for part in content.get('parts', [])
+            )
+        except ValueError as e:
+            self._send_error(400, f"Invalid JSON payload: {e}")
+            return
+        generation_config = request.get('generationConfig') or {}
+        config = {'response_mime_type': generation_config.get('responseMimeType')}
+        model = match.group('model')
+
+        try:
+            if match.group('method') == 'generateContent':
+                response = self.backend.generate(prompt, config)
+                self._send_json(200, _payload(response, model))
+                return
+            chunks = self.backend.stream(prompt, config)
+            # The first chunk carries the latency and any injected error
+            first = next(chunks, None)
+        except ModelAPIError as e:
+            self._send_error(e.code, str(e))
+            return
+        except TimeoutError as e:
+            self._send_error(504, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for chunk in itertools.chain([first] if first else [], chunks):
+                self.wfile.write(f"data: {json.dumps(_payload(chunk, model, final=False), ensure_ascii=False)}\r\n\r\n".encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=2.0, help="median seconds to first token")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="log-normal sigma of the latency")
+    parser.add_argument('--chunk-interval', type=float, default=0.05, help="seconds between stream chunks")
+    parser.add_argument('--chunk-size', type=int, default=80, help="characters per stream chunk")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls failing with 429/503")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    FakeGeminiHandler.backend = FakeBackend(
+        latency_median=args.latency,
+        latency_sigma=args.latency_sigma,
+        chunk_interval=args.chunk_interval,
+        chunk_size=args.chunk_size,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    server = ThreadingHTTPServer((args.host, args.port), FakeGeminiHandler)
+    server.daemon_threads = True
+    print(f"Fake Gemini API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
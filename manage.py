@@ -6,6 +6,9 @@ import subprocess
 import time
 import psutil
 
+# Тот же путь к базе, что и у бота (с учетом .env)
+from bot.config import DB_PATH
+
 BOT_PROCESS = None
 LOG_FILE = "bot.log"
 
@@ -82,6 +85,88 @@ def show_logs(lines=10):
     except FileNotFoundError:
         print("❌ Файл логов не найден")
 
+def migrate_db():
+    """Применить миграции схемы базы данных"""
+    from bot.services.database import ConnectionPool
+    from bot.services.migrations import current_version, pending_migrations, migrate
+
+    pool = ConnectionPool(DB_PATH, size=1)
+    try:
+        with pool.connection() as conn:
+            pending = pending_migrations(conn)
+            if not pending:
+                print(f"✅ Схема актуальна (версия {current_version(conn)})")
+                return
+            for version, description in pending:
+                print(f"🔄 Миграция {version}: {description}")
+            migrate(conn)
+            print(f"✅ Миграции применены, версия схемы: {current_version(conn)}")
+    except Exception as e:
+        print(f"❌ Ошибка при применении миграций: {str(e)}")
+    finally:
+        pool.close()
+
+def rebuild_stats():
+    """Пересчитать агрегаты аналитики из истории генераций"""
+    from bot.services.database import DatabaseService
+
+    db = DatabaseService(DB_PATH, pool_size=1)
+    try:
+        print("🔄 Пересчет статистики пользователей...")
+        users = db.rebuild_user_stats()
+        print(f"✅ Статистика пересчитана для {users} пользователей")
+    except Exception as e:
+        print(f"❌ Ошибка при пересчете статистики: {str(e)}")
+    finally:
+        db.close()
+
+def _format_percentiles(values):
+    from bot.services.telemetry import PERCENTILES, percentile
+
+    ordered = sorted(v for v in values if v is not None)
+    if not ordered:
+        return "нет данных"
+    return ", ".join(f"p{rank} {percentile(ordered, rank):.0f}" for rank in PERCENTILES)
+
+def model_report(days=7):
+    """Отчет по вызовам модели: задержки и токены по типам планов"""
+    from collections import Counter, defaultdict
+    from bot.services.database import DatabaseService
+
+    db = DatabaseService(DB_PATH, pool_size=1)
+    try:
+        calls = db.get_model_calls(int(time.time() - days * 86400))
+    finally:
+        db.close()
+    if not calls:
+        print(f"❌ Нет вызовов модели за {days} дн.")
+        return
+
+    groups = defaultdict(list)
+    for call in calls:
+        groups[(call['model'], call['plan_type'])].append(call)
+
+    print(f"📊 Вызовы модели за {days} дн.: {len(calls)}")
+    for (model, plan_type), rows in sorted(groups.items(), key=lambda item: str(item[0])):
+        outcomes = Counter(row['outcome'] for row in rows)
+        cache_hits = sum(row['cache_hit'] for row in rows)
+        # Задержки и токены считаем только по запросам, дошедшим до модели
+        generated = [row for row in rows if row['outcome'] == 'ok']
+        prompt_tokens = [row['prompt_tokens'] for row in generated if row['prompt_tokens'] is not None]
+        output_tokens = [row['output_tokens'] for row in generated if row['output_tokens'] is not None]
+
+        print(f"\n🔹 {plan_type} ({model}): {len(rows)} запросов, из кэша {cache_hits / len(rows):.0%}")
+        print(f"   Исходы: {', '.join(f'{k} {v}' for k, v in outcomes.most_common())}")
+        print(f"   Время ответа, мс:          {_format_percentiles(row['wall_ms'] for row in generated)}")
+        print(f"   Время до первой части, мс: {_format_percentiles(row['ttfc_ms'] for row in generated)}")
+        print(f"   Все запросы, мс:           {_format_percentiles(row['wall_ms'] for row in rows)}")
+        if prompt_tokens:
+            print(f"   Токены запроса:  в среднем {sum(prompt_tokens) / len(prompt_tokens):.0f}, "
+                  f"{_format_percentiles(prompt_tokens)}, всего {sum(prompt_tokens)}")
+        if output_tokens:
+            print(f"   Токены ответа:   в среднем {sum(output_tokens) / len(output_tokens):.0f}, "
+                  f"{_format_percentiles(output_tokens)}, всего {sum(output_tokens)}")
+
 def main():
     """Основная функция"""
     if len(sys.argv) < 2:
@@ -91,6 +176,9 @@ def main():
         print("  python manage.py restart  - Перезапустить бота")
         print("  python manage.py status   - Показать статус")
         print("  python manage.py logs     - Показать логи")
+        print("  python manage.py migrate  - Применить миграции базы данных")
+        print("  python manage.py rebuild-stats - Пересчитать статистику аналитики")
+        print("  python manage.py model-report [дней] - Отчет по задержкам и токенам модели")
         return
 
     command = sys.argv[1].lower()
@@ -105,6 +193,12 @@ def main():
         show_status()
     elif command == 'logs':
         show_logs()
+    elif command == 'migrate':
+        migrate_db()
+    elif command == 'rebuild-stats':
+        rebuild_stats()
+    elif command == 'model-report':
+        model_report(int(sys.argv[2]) if len(sys.argv) > 2 else 7)
     else:
         print(f"❌ Неизвестная команда: {command}")
 
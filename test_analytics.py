@@ -0,0 +1,69 @@
+import os
+import time
+from datetime import datetime
+
+from bot.services.database import DatabaseService
+
+DB_PATH = "test_analytics.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+def test_generation_stats():
+    """Totals per plan type and the last week's count, computed in SQL"""
+    _remove_db()
+    db = DatabaseService(DB_PATH, pool_size=1)
+    try:
+        db.save_generation(1, 'daily', 2000)
+        db.save_generation(1, 'daily', 2100)
+        db.save_generation(1, 'weekly', 2000)
+        # A generation from a month ago counts in the totals only
+        month_ago = int(time.time()) - 30 * 24 * 60 * 60
+        with db._pool.connection() as conn:
+            db._insert_generations(conn, [(1, 'daily', 1900, month_ago, None)])
+
+        stats = db.get_generation_stats(1)
+        assert stats['total'] == 4
+        assert stats['plan_types'] == {'daily': 3, 'weekly': 1}
+        assert stats['last_week'] == 3
+        assert stats['first_at'] == month_ago
+        assert 'weekdays' not in stats
+
+        assert db.get_generation_stats(2) == {
+            'total': 0, 'plan_types': {}, 'first_at': None, 'last_at': None, 'last_week': 0
+        }
+        print("✅ Generation stats")
+    finally:
+        db.close()
+        _remove_db()
+
+def test_user_stats_rollup():
+    """Every saved generation, direct or write-behind, updates the user's rollup"""
+    _remove_db()
+    db = DatabaseService(DB_PATH, pool_size=1, write_behind=True, flush_interval_ms=60000)
+    try:
+        db.save_generation(1, 'daily', 2000, durable=True)
+        db.save_generation(1, 'weekly', 2000)
+        db.save_generation(1, 'daily', 2000)
+        db.flush()
+        now = datetime.now()
+        stats = db.get_generation_stats(1, detailed=True)
+        assert stats['total'] == 3
+        assert stats['weekdays'][now.weekday()] == 3 and sum(stats['weekdays']) == 3
+        assert stats['hours'][('night', 'morning', 'day', 'evening')[now.hour // 6]] == 3
+
+        with db._pool.connection() as conn:
+            rollup = conn.execute("SELECT total, plan_daily, plan_weekly FROM user_stats WHERE user_id = 1").fetchone()
+        assert rollup == (3, 2, 1)
+        assert db.rebuild_user_stats() == 1
+        assert db.get_generation_stats(1, detailed=True) == stats
+        print("✅ user_stats rollup")
+    finally:
+        db.close()
+        _remove_db()
+
+if __name__ == "__main__":
+    test_generation_stats()
+    test_user_stats_rollup()
@@ -0,0 +1,55 @@
+import os
+
+from bot.services.cache import MISSING, TTLCache
+from bot.services.database import DatabaseService
+
+def test_ttl_cache():
+    """LRU eviction, expiry and stale reads dropped after an invalidation"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache.set('expired', 1, ttl=0)
+    assert cache.get('expired') is MISSING
+
+    token = cache.token()
+    cache.invalidate('a')
+    cache.set('a', 'stale', token=token)
+    assert cache.get('a') is MISSING
+    assert cache.stats()['hits'] == 3
+    print("✅ TTL cache")
+
+def test_writes_invalidate_cached_reads():
+    """Profile and subscription reads are cached until the user's next write"""
+    db = DatabaseService("test_cache.db", pool_size=1)
+    try:
+        profile = {'age': 25, 'gender': 'male', 'weight': 70, 'height': 175, 'goal': 'lose_weight'}
+        assert db.get_profile(1) is None
+        db.save_profile(1, profile)
+        assert db.get_profile(1)['weight'] == 70
+        # Callers may change the returned dict without touching the cache
+        db.get_profile(1)['calories'] = 1800
+        assert 'calories' not in db.get_profile(1)
+        db.save_profile(1, dict(profile, weight=68))
+        assert db.get_profile(1)['weight'] == 68
+
+        assert not db.get_subscription_status(1)
+        assert db.cached_subscription_status(1) is False
+        db.update_subscription(1, "month", 30)
+        assert db.cached_subscription_status(1) is None
+        assert db.get_subscription_status(1)
+        assert db.cache_stats()['profile']['hits'] >= 2
+    finally:
+        db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_cache.db" + suffix):
+                os.remove("test_cache.db" + suffix)
+    print("✅ Writes invalidate cached reads")
+
+if __name__ == "__main__":
+    test_ttl_cache()
+    test_writes_invalidate_cached_reads()
@@ -1,6 +1,14 @@
-from bot.services.database import DatabaseService
+from bot.services.database import AsyncDatabaseService, DatabaseService, WriteBehindQueue
+import asyncio
 import os
 
+PROFILE = {'age': 25, 'gender': 'female', 'weight': 60, 'height': 165, 'goal': 'maintain'}
+
+def _remove_db(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
 def test_database():
     """Test database functionality"""
     # Initialize database
@@ -64,5 +72,124 @@ def test_database():
     except:
         print("\n❌ Failed to clean up test database")
 
+def test_durable_write_rollback():
+    """A failing durable write rolls back and leaves the connection at NORMAL sync"""
+    db = DatabaseService("test_durable.db", pool_size=1)
+    try:
+        db.save_profile(1, {'age': 30})
+        try:
+            with db._durable_connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO subscriptions (user_id, plan, end_date, is_active) VALUES (?, ?, ?, ?)",
+                    (1, "month", 0, True)
+                )
+                raise ValueError("payment failed")
+        except ValueError:
+            print("✅ The original error reached the caller")
+        with db._pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0] == 0
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        print("✅ Durable write rolled back, synchronous back to NORMAL")
+
+        assert db.update_subscription(1, "month", 30)
+        assert db.get_subscription_status(1)
+        with db._pool.connection() as conn:
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        print("✅ Durable write committed")
+    finally:
+        db.close()
+        _remove_db("test_durable.db")
+
+def test_async_pool():
+    """Concurrent awaitable queries share a few WAL connections"""
+    async def run():
+        db = AsyncDatabaseService("test_async.db", pool_size=2)
+        try:
+            await asyncio.gather(*(db.save_profile(user_id, PROFILE) for user_id in range(20)))
+            profiles = await asyncio.gather(*(db.get_profile(user_id) for user_id in range(20)))
+            assert all(profile['goal'] == 'maintain' for profile in profiles)
+            assert db.sync._pool._created <= 2
+            with db.sync._pool.connection() as conn:
+                assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        finally:
+            await db.close()
+            _remove_db("test_async.db")
+
+    asyncio.run(run())
+    print("✅ Async pooled queries")
+
+def test_write_behind():
+    """Queued inserts land in one batch on flush and on close"""
+    batches = []
+    queue = WriteBehindQueue(batches.append, flush_interval_ms=60000, max_batch=100, max_pending=100)
+    for i in range(3):
+        queue.put('generation', (i,))
+    queue.put('meal', ('m',))
+    queue.flush()
+    assert batches == [{'generation': [(0,), (1,), (2,)], 'meal': [('m',)]}]
+    # A full buffer drops rows instead of blocking when asked to
+    for i in range(100):
+        queue.put('meal', (i,))
+    assert not queue.put('meal', ('dropped',), block=False)
+    queue.close()
+    assert sum(len(batch.get('meal', [])) for batch in batches) == 101
+
+    db = DatabaseService("test_write_behind.db", write_behind=True, flush_interval_ms=60000)
+    try:
+        db.save_generation(1, 'daily', 2000)
+        db.save_meal(1, {'type': 'Обед', 'name': 'Суп', 'calories': 300, 'protein': 10, 'carbs': 30, 'fat': 8})
+        db.save_generation(1, 'weekly', 2100, durable=True)
+        assert len(db.get_generation_history(1)) == 1
+        db.flush()
+        assert len(db.get_generation_history(1)) == 2
+        assert db.get_generation_stats(1)['total'] == 2
+        assert len(db.get_user_meals(1)) == 1
+    finally:
+        db.close()
+        _remove_db("test_write_behind.db")
+    print("✅ Write-behind batches")
+
+def test_user_context():
+    """Profile, subscription and the user's own recent meals in one call"""
+    db = DatabaseService("test_context.db", pool_size=1)
+    try:
+        assert db.get_user_context(1) == {'profile': None, 'is_subscribed': False, 'meals': []}
+        db.save_profile(1, PROFILE)
+        db.update_subscription(1, "month", 30)
+        meal = {'type': 'Обед', 'name': 'Суп', 'calories': 300, 'protein': 10, 'carbs': 30, 'fat': 8}
+        for name in ('Суп', 'Салат', 'Рыба'):
+            db.save_meal(1, dict(meal, name=name))
+        db.save_meals(1, [dict(meal, name='Из плана')], source='plan')
+
+        context = db.get_user_context(1, meals_limit=2)
+        assert context['profile'] == PROFILE
+        assert context['is_subscribed']
+        assert len(context['meals']) == 2
+        assert 'Из плана' not in [m['name'] for m in db.get_user_context(1, meals_limit=10)['meals']]
+        # Served from the caches the call filled
+        assert db.get_user_context(1, meals_limit=0)['is_subscribed']
+    finally:
+        db.close()
+        _remove_db("test_context.db")
+    print("✅ User context")
+
+def test_lazy_init():
+    """The schema is created on first use, not when the service is built"""
+    db = DatabaseService("test_lazy.db")
+    try:
+        assert not os.path.exists("test_lazy.db")
+        assert db.get_profile(1) is None
+        with db._pool.connection() as conn:
+            assert conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    finally:
+        db.close()
+        _remove_db("test_lazy.db")
+    print("✅ Lazy schema init")
+
 if __name__ == "__main__":
-    test_database() 
\ No newline at end of file
+    test_database()
+    test_durable_write_rollback()
+    test_async_pool()
+    test_write_behind()
+    test_user_context()
+    test_lazy_init() 
\ No newline at end of file
@@ -1,19 +1,14 @@
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
+from bot.config import GEMINI_MODEL
+from bot.services.model_backends import create_backend
 
-load_dotenv()
-
-# Configure the API
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-
-# Create a model
-model = genai.GenerativeModel('gemini-pro')
+# The backend from GEMINI_BACKEND: the live API by default,
+# GEMINI_BACKEND=fake or a local fake_gemini_server.py to test offline
+backend = create_backend(GEMINI_MODEL)
 
 # Test the API
 try:
-    response = model.generate_content("Hello, how are you?")
+    response = backend.generate("Hello, how are you?", timeout=60)
     print("Gemini API Test Response:", response.text)
     print("✅ Gemini API работает корректно")
 except Exception as e:
-    print("❌ Ошибка Gemini API:", str(e)) 
\ No newline at end of file
+    print("❌ Ошибка Gemini API:", str(e)) 
@@ -0,0 +1,88 @@
+import asyncio
+import re
+import threading
+import time
+
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelAPIError, ModelBackend, ModelResponse
+
+PROFILE = {'age': 30, 'gender': 'male', 'weight': 80, 'height': 180, 'goal': 'maintain', 'calories': 2500}
+
+class PartsBackend(ModelBackend):
+    """Answers with the day range the prompt asks for after `delay` seconds,
+    failing the part that starts on `fail_day`; tracks concurrent calls"""
+
+    def __init__(self, delay=0.05, fail_day=None):
+        self.delay = delay
+        self.fail_day = fail_day
+        self.calls = 0
+        self.finished = 0
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        part = re.search(r"дни с (\d+) по (\d+)", prompt)
+        first_day = int(part.group(1)) if part else 1
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            if first_day == self.fail_day:
+                raise ModelAPIError(400, "bad request")
+            time.sleep(self.delay)
+            return ModelResponse(f"дни {part.group(1)}-{part.group(2)}" if part else "план")
+        finally:
+            with self._lock:
+                self.running -= 1
+                if first_day != self.fail_day:
+                    self.finished += 1
+
+def test_concurrency_cap():
+    """No more model calls run at once than max_concurrency"""
+    async def run():
+        backend = PartsBackend()
+        service = GeminiService(backend=backend, max_concurrency=2)
+        results = await asyncio.gather(*(service._call_model(f"prompt {i}") for i in range(6)))
+        assert results == ["план"] * 6
+        assert backend.peak == 2 and service.in_flight == 0
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Concurrency cap")
+
+def test_weekly_plan_in_parts():
+    """A week is generated as concurrent parts joined in day order"""
+    async def run():
+        backend = PartsBackend()
+        service = GeminiService(backend=backend, days_per_part=2)
+        plan = await service.generate_meal_plan(PROFILE, 7)
+        assert plan == "дни 1-2\n\nдни 3-4\n\nдни 5-6\n\nдни 7-7"
+        assert backend.calls == 4 and backend.peak == 4
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Weekly plan generated in parts")
+
+def test_failed_part_stops_the_others():
+    """One failing part fails the plan without waiting for the rest"""
+    async def run():
+        backend = PartsBackend(delay=0.3, fail_day=3)
+        service = GeminiService(backend=backend, days_per_part=2, max_concurrency=2)
+        started = time.perf_counter()
+        plan = await service.generate_meal_plan(PROFILE, 7)
+        assert plan.startswith("❌")
+        # The parts queued behind the failed one never reached the model
+        assert backend.calls < 4
+        assert time.perf_counter() - started < 0.6
+        assert service.stats()['coalescing']['in_flight'] == 0
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Failed part stops the plan")
+
+if __name__ == "__main__":
+    test_concurrency_cap()
+    test_weekly_plan_in_parts()
+    test_failed_part_stops_the_others()
@@ -0,0 +1,82 @@
+import asyncio
+
+from bot.services.generation import GenerationPipeline
+from bot.services.limiter import LimiterService
+from bot.services.plan_render import MESSAGE_LIMIT
+
+class FakeBot:
+    """Records what the pipeline sends instead of calling Telegram"""
+
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.edited.append((message_id, text))
+
+class FakeDatabase:
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.generations = []
+
+    async def get_user_context(self, user_id, meals_limit=5):
+        return {'profile': dict(self.profile) if self.profile else None, 'is_subscribed': True, 'meals': []}
+
+    async def save_generation(self, user_id, plan_type, calories, meal_type=None):
+        self.generations.append((user_id, plan_type, calories))
+
+class FakeGemini:
+    structured = False
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    async def generate_meal_plan(self, profile, days, meals, meal_type=None):
+        return self.plan
+
+PROFILE = {'age': 30, 'gender': 'male', 'weight': 80, 'height': 180, 'goal': 'maintain'}
+
+def _job(**fields):
+    job = {'id': 1, 'user_id': 7, 'chat_id': 7, 'message_id': 42, 'days': 1,
+           'meal_type': None, 'calories': 2000, 'priority': 'free'}
+    job.update(fields)
+    return job
+
+def test_long_plan_replaces_status_message():
+    """The first part of a long plan replaces the status message, the rest follows"""
+    bot, db = FakeBot(), FakeDatabase(PROFILE)
+    plan = "а" * MESSAGE_LIMIT + "б" * 10
+    pipeline = GenerationPipeline(bot, db, FakeGemini(plan), streaming=False)
+    asyncio.run(pipeline.run(_job()))
+    assert bot.edited == [(42, "а" * MESSAGE_LIMIT)]
+    assert bot.sent == ["б" * 10]
+    assert db.generations == [(7, 'daily', 2000)]
+    print("✅ Status message replaced by the plan")
+
+def test_undelivered_plan_refunds_free_generation():
+    """A free generation goes back to the bucket when the user got an error"""
+    limiter = LimiterService(capacity=1)
+    assert limiter.consume(7)
+    bot = FakeBot()
+    pipeline = GenerationPipeline(bot, FakeDatabase(), FakeGemini("plan"), streaming=False, limiter=limiter)
+    asyncio.run(pipeline.run(_job()))
+    assert bot.edited and bot.edited[0][1].startswith("❌")
+    assert limiter.can_generate(7)
+
+    # Paid jobs never took a token
+    assert limiter.consume(7)
+    asyncio.run(pipeline.run(_job(priority='paid')))
+    assert not limiter.can_generate(7)
+
+    # Nor is one given back for a delivered plan
+    pipeline.db = FakeDatabase(PROFILE)
+    asyncio.run(pipeline.run(_job()))
+    assert not limiter.can_generate(7)
+    print("✅ Free generation refunded only when nothing was delivered")
+
+if __name__ == "__main__":
+    test_long_plan_replaces_status_message()
+    test_undelivered_plan_refunds_free_generation()
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+
+from bot.services.database import AsyncDatabaseService
+from bot.services.jobs import GenerationQueue
+
+DB_PATH = "test_jobs.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def test_jobs_retried_then_failed():
+    """A failing job is retried up to max_attempts, then reported failed"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        attempts, failed = [], []
+
+        async def handler(job):
+            attempts.append((job['id'], job['attempts']))
+            if job['user_id'] == 2:
+                raise RuntimeError("model down")
+
+        async def on_failed(job, error):
+            failed.append((job['id'], error))
+
+        queue = GenerationQueue(db, handler, workers=2, max_attempts=3, poll_interval=0.05, on_failed=on_failed)
+        try:
+            queue.start()
+            ok = await queue.enqueue(1, 1, None, 1, 'balanced', 2000)
+            bad = await queue.enqueue(2, 2, None, 1, 'balanced', 2000)
+            await _wait_for(lambda: queue.done_total == 1 and queue.failed_total == 1)
+            assert [attempt for job_id, attempt in attempts if job_id == bad] == [1, 2, 3]
+            assert [attempt for job_id, attempt in attempts if job_id == ok] == [1]
+            assert failed == [(bad, "model down")] and queue.retried_total == 2
+            assert await db.count_jobs() == {'done': 1, 'failed': 1}
+        finally:
+            await queue.stop()
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Jobs retried, then failed")
+
+def test_expired_lease_is_taken_over():
+    """A job whose worker died is leased again once its lease runs out"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        seen = []
+
+        async def handler(job):
+            seen.append(job['attempts'])
+
+        queue = GenerationQueue(db, handler, poll_interval=0.05)
+        try:
+            job_id = await db.enqueue_job(1, 1, None, 1, 'balanced', 2000)
+            # A worker of a process that died holds the lease
+            assert [job['id'] for job in await db.lease_jobs(1, 60)] == [job_id]
+            assert await db.lease_jobs(1, 60) == []
+            with db.sync._pool.connection() as conn:
+                conn.execute("UPDATE generation_jobs SET lease_until = ? WHERE id = ?", (int(time.time()) - 1, job_id))
+
+            queue.start()
+            await _wait_for(lambda: queue.done_total == 1)
+            assert seen == [2]
+            assert await db.count_jobs() == {'done': 1}
+        finally:
+            await queue.stop()
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Expired lease taken over")
+
+def test_stop_releases_running_jobs():
+    """Jobs interrupted by a shutdown go back to the queue without losing an attempt"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        queue = GenerationQueue(db, handler, poll_interval=0.05)
+        try:
+            queue.start()
+            await queue.enqueue(1, 1, None, 1, 'balanced', 2000)
+            await asyncio.wait_for(started.wait(), 5)
+            await queue.stop()
+            assert await db.count_jobs() == {'queued': 1}
+            assert (await db.lease_jobs(1, 60))[0]['attempts'] == 1
+        finally:
+            await queue.stop()
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Running jobs released on stop")
+
+def test_weighted_fair_order():
+    """Under contention paid jobs get three workers for every free one"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        order = []
+
+        async def handler(job):
+            order.append(job['priority'])
+
+        queue = GenerationQueue(db, handler, workers=1, poll_interval=0.05)
+        try:
+            for user_id in range(8):
+                await queue.enqueue(user_id, user_id, None, 1, 'balanced', 2000, 'free')
+            for user_id in range(8, 12):
+                await queue.enqueue(user_id, user_id, None, 1, 'balanced', 2000, 'paid')
+            queue.start()
+            await _wait_for(lambda: queue.done_total == 12)
+            # Paid jobs were enqueued last, yet take 3 of every 4 slots until they run out
+            assert order[:4].count('paid') == 3
+            assert order[:5].count('paid') == 4 and order[5:] == ['free'] * 7
+            assert (await queue.stats())['classes']['paid']['wait_ms']['count'] == 4
+        finally:
+            await queue.stop()
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Weighted fair order")
+
+def test_reserved_worker():
+    """A reserved worker takes a paid job while free jobs hold the rest"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        running = {'free': 0, 'paid': 0}
+        peak_free = 0
+        release = asyncio.Event()
+
+        async def handler(job):
+            nonlocal peak_free
+            running[job['priority']] += 1
+            peak_free = max(peak_free, running['free'])
+            try:
+                if job['priority'] == 'free':
+                    await release.wait()
+            finally:
+                running[job['priority']] -= 1
+
+        queue = GenerationQueue(db, handler, workers=3, poll_interval=0.05, reserved={'paid': 1})
+        try:
+            queue.start()
+            for user_id in range(5):
+                await queue.enqueue(user_id, user_id, None, 1, 'balanced', 2000, 'free')
+            await _wait_for(lambda: running['free'] == 2)
+            await queue.enqueue(9, 9, None, 1, 'balanced', 2000, 'paid')
+            # Served while every free job is still stuck
+            await _wait_for(lambda: queue.done_total == 1)
+            assert running['free'] == 2
+            release.set()
+            await _wait_for(lambda: queue.done_total == 6)
+            assert peak_free == 2
+        finally:
+            await queue.stop()
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Reserved worker")
+
+if __name__ == "__main__":
+    test_jobs_retried_then_failed()
+    test_expired_lease_is_taken_over()
+    test_stop_releases_running_jobs()
+    test_weighted_fair_order()
+    test_reserved_worker()
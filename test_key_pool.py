@@ -0,0 +1,105 @@
+from bot.services.key_pool import KeyPool, PoolMember, parse_api_keys
+from bot.services.model_backends import ModelAPIError, ModelBackend, ModelResponse
+from bot.services.quota import QuotaExceededError
+
+class KeyBackend(ModelBackend):
+    """Answers (or fails with `error`) and counts its calls"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return ModelResponse("plan", prompt_tokens=100, output_tokens=50, model="unknown")
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        yield ModelResponse("pl")
+        yield ModelResponse("an", prompt_tokens=100, output_tokens=50)
+
+def _member(label, backend, rpm=0, tpm=0, latency=None):
+    member = PoolMember(label, f"model-{label}", backend, rpm, tpm)
+    member.latency = latency
+    return member
+
+def test_parse_api_keys():
+    """Keys without a model get the default one"""
+    assert parse_api_keys(" key1, key2:gemini-pro ,", "gemini-flash") == [
+        ('key1', 'gemini-flash'), ('key2', 'gemini-pro')
+    ]
+    print("✅ API keys parsed")
+
+def test_fast_key_takes_the_traffic():
+    """Calls go to the lowest latency key; responses carry its model"""
+    fast, slow = KeyBackend(), KeyBackend()
+    pool = KeyPool([_member('slow', slow, latency=0.5), _member('fast', fast, latency=0.01)])
+    for _ in range(5):
+        assert pool.generate("prompt").model == 'model-fast'
+    assert fast.calls == 5 and slow.calls == 0
+    stats = pool.stats()['fast']
+    assert stats['calls'] == 5 and stats['prompt_tokens'] == 500 and stats['in_flight'] == 0
+
+    # A key with little quota left loses to one with plenty
+    fast_but_spent = _member('spent', KeyBackend(), rpm=100, latency=0.01)
+    fast_but_spent.requests.take(99)
+    pool = KeyPool([fast_but_spent, _member('fresh', KeyBackend(), rpm=100, latency=0.05)])
+    assert pool.generate("prompt").model == 'model-fresh'
+    print("✅ Fast key takes the traffic")
+
+def test_throttled_key_cools_down():
+    """A 429 moves the call to the next key and takes the key out of rotation"""
+    throttled, spare = KeyBackend(ModelAPIError(429, "quota")), KeyBackend()
+    pool = KeyPool([_member('a', throttled, latency=0.01), _member('b', spare, latency=0.5)], cooldown=60)
+    assert pool.generate("prompt").model == 'model-b'
+    assert ''.join(chunk.text for chunk in pool.stream("prompt")) == "plan"
+    assert throttled.calls == 1 and spare.calls == 2
+    stats = pool.stats()['a']
+    assert stats['throttled'] == 1 and stats['cooling_for'] > 59
+
+    # Errors that another key would get as well are not retried
+    bad = KeyPool([_member('a', KeyBackend(ModelAPIError(400, "bad"))), _member('b', spare)])
+    try:
+        bad.generate("prompt")
+        assert False, "a 400 should reach the caller"
+    except ModelAPIError as e:
+        assert e.code == 400
+    assert spare.calls == 2
+    print("✅ Throttled key cools down")
+
+def test_exhausted_pool():
+    """With no quota left nothing is sent; after every key failed the last error is raised"""
+    backend = KeyBackend()
+    pool = KeyPool([_member('a', backend, rpm=1), _member('b', backend, rpm=1)])
+    pool.generate("prompt")
+    pool.generate("prompt")
+    try:
+        pool.generate("prompt")
+        assert False, "the pool is out of quota"
+    except QuotaExceededError as e:
+        assert 0 < e.retry_after <= 60
+    assert backend.calls == 2
+
+    down = KeyPool([_member('a', KeyBackend(ModelAPIError(503, "down"))),
+                    _member('b', KeyBackend(ModelAPIError(503, "down")))])
+    try:
+        down.generate("prompt")
+        assert False, "every key failed"
+    except ModelAPIError as e:
+        assert e.code == 503
+    try:
+        down.generate("prompt")
+        assert False, "both keys are cooling down"
+    except QuotaExceededError:
+        pass
+    print("✅ Exhausted pool")
+
+if __name__ == "__main__":
+    test_parse_api_keys()
+    test_fast_key_takes_the_traffic()
+    test_throttled_key_cools_down()
+    test_exhausted_pool()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+
+from bot.middlewares.limiter import LimiterMiddleware
+from bot.services.database import AsyncDatabaseService
+from bot.services.limiter import LimiterService
+
+DB_PATH = "test_limiter.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeMessage:
+    def __init__(self, user_id, text):
+        self.from_user = FakeUser(user_id)
+        self.text = text
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+class FakeDatabase:
+    def __init__(self, subscribed=()):
+        self.subscribed = set(subscribed)
+
+    def cached_subscription_status(self, user_id):
+        return None
+
+    async def get_subscription_status(self, user_id):
+        return user_id in self.subscribed
+
+def test_consume_and_refund():
+    """One free generation per period, refilled over time, refunded when undelivered"""
+    limiter = LimiterService(capacity=1, period=0.2)
+    assert limiter.can_generate(1) and limiter.retry_after(1) == 0
+    assert limiter.consume(1)
+    assert not limiter.consume(1) and not limiter.can_generate(1)
+    assert 0 < limiter.retry_after(1) <= 0.2
+    # Other users have their own bucket
+    assert limiter.consume(2)
+
+    limiter.refund(1)
+    assert limiter.consume(1)
+    # A refund never fills a bucket past its capacity
+    limiter.refund(3)
+    assert limiter.consume(3) and not limiter.consume(3)
+
+    time.sleep(0.25)
+    assert limiter.consume(1)
+    assert limiter.stats() == {'buckets': 3, 'allowed': 5, 'limited': 2}
+    print("✅ Consume and refund")
+
+def test_buckets_survive_restart():
+    """Buckets persisted on stop are loaded back by the next limiter"""
+    async def run():
+        _remove_db()
+        db = AsyncDatabaseService(DB_PATH, pool_size=1)
+        try:
+            limiter = LimiterService(db)
+            limiter.start()
+            assert limiter.consume(1)
+            await limiter.stop()
+
+            restarted = LimiterService(db)
+            await restarted.load()
+            assert not restarted.can_generate(1) and restarted.can_generate(2)
+            # Refilled buckets are dropped instead of written back
+            refilled = LimiterService(db, period=0.05)
+            await refilled.load()
+            await asyncio.sleep(0.06)
+            await refilled.persist()
+            assert await db.load_rate_limits(0) == []
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Buckets survive a restart")
+
+def test_middleware_stops_free_users():
+    """Free users with an empty bucket are stopped at the command, subscribers pass"""
+    async def run():
+        limiter = LimiterService()
+        middleware = LimiterMiddleware(limiter, FakeDatabase(subscribed={2}))
+        handled = []
+
+        async def handler(event, data):
+            handled.append((event.from_user.id, data.get('limiter')))
+
+        limiter.consume(1)
+        limiter.consume(2)
+        stopped = FakeMessage(1, "/generateforday@nutrition_bot")
+        await middleware(handler, stopped, {})
+        assert handled == [] and stopped.answers[0].startswith("⏳")
+
+        await middleware(handler, FakeMessage(2, "/generateforday"), {})
+        await middleware(handler, FakeMessage(1, "/start"), {})
+        await middleware(handler, FakeMessage(3, "2000"), {'raw_state': 'GenerateStates:waiting_for_calories'})
+        assert handled == [(2, None), (1, None), (3, limiter)]
+
+    asyncio.run(run())
+    print("✅ Middleware stops free users")
+
+if __name__ == "__main__":
+    test_consume_and_refund()
+    test_buckets_survive_restart()
+    test_middleware_stops_free_users()
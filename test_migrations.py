@@ -0,0 +1,121 @@
+import os
+import sqlite3
+
+from bot.services.database import DatabaseService
+from bot.services.migrations import MIGRATIONS, _create_base_tables, current_version, migrate
+
+DB_PATH = "test_migrations.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+def _baseline_db():
+    """Database as the bot created it before versioned migrations"""
+    _remove_db()
+    conn = sqlite3.connect(DB_PATH)
+    _create_base_tables(conn)
+    conn.executemany(
+        "INSERT INTO generation_history (user_id, plan_type, calories, created_at) VALUES (?, ?, ?, ?)",
+        [
+            (1, 'daily', 2000, '2024-01-01 08:00:00'),
+            (1, 'weekly', 2100, '2024-01-02 20:00:00'),
+            (2, 'daily', 1800, '2024-01-03 12:00:00'),
+            (3, 'daily', 2500, '2024-01-04 02:00:00'),
+        ]
+    )
+    conn.execute(
+        "INSERT INTO meals (user_id, type, name, calories, protein, carbs, fat) VALUES (1, 'Завтрак', 'Каша', 300, 10, 50, 5)"
+    )
+    conn.commit()
+    return conn
+
+def _totals(conn):
+    return dict(conn.execute("SELECT user_id, total FROM user_stats ORDER BY user_id").fetchall())
+
+def test_migrate_baseline():
+    """Every migration applies to a pre-migration database, once"""
+    conn = _baseline_db()
+    try:
+        applied = migrate(conn)
+        assert applied == [version for version, _, _ in MIGRATIONS]
+        assert current_version(conn) == MIGRATIONS[-1][0]
+        assert migrate(conn) == []
+
+        # Timestamps became epoch integers, rollups were backfilled
+        assert conn.execute(
+            "SELECT MIN(created_at) FROM generation_history"
+        ).fetchone()[0] == int(conn.execute("SELECT strftime('%s', '2024-01-01 08:00:00')").fetchone()[0])
+        assert conn.execute("SELECT typeof(created_at) FROM meals").fetchone()[0] == 'integer'
+        assert _totals(conn) == {1: 2, 2: 1, 3: 1}
+        assert conn.execute("SELECT plan_daily, plan_weekly FROM user_stats WHERE user_id = 1").fetchone() == (1, 1)
+        assert conn.execute("SELECT source FROM meals").fetchone()[0] == 'user'
+        print("✅ Baseline database migrated")
+    finally:
+        conn.close()
+        _remove_db()
+
+def test_history_lookups_use_indexes():
+    """Per-user history and meals lookups are index range scans, history needs no table"""
+    conn = _baseline_db()
+    try:
+        migrate(conn)
+        plan = ' '.join(row[-1] for row in conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT plan_type, calories, created_at FROM generation_history
+            WHERE user_id = ? ORDER BY created_at DESC
+        """, (1,)))
+        assert 'COVERING INDEX idx_generation_history_user_created' in plan
+        assert 'TEMP B-TREE' not in plan
+        plan = ' '.join(row[-1] for row in conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT type, name FROM meals
+            WHERE user_id = ? AND source = 'user' ORDER BY created_at DESC LIMIT 5
+        """, (1,)))
+        assert 'idx_meals_user_source_created' in plan and 'TEMP B-TREE' not in plan
+        print("✅ History and meals lookups use their indexes")
+    finally:
+        conn.close()
+        _remove_db()
+
+def test_backfill_only_missing_users():
+    """Migration 13 fills rollups of users without one and keeps the rest"""
+    conn = _baseline_db()
+    try:
+        migrate(conn)
+        # As if version 4 had created an empty table and the bot had then
+        # counted one new generation for user 1
+        conn.execute("DELETE FROM user_stats WHERE user_id != 1")
+        conn.execute("UPDATE user_stats SET total = 7 WHERE user_id = 1")
+        conn.execute("DELETE FROM schema_version WHERE version = 13")
+        conn.commit()
+
+        assert migrate(conn) == [13]
+        assert _totals(conn) == {1: 7, 2: 1, 3: 1}
+        print("✅ Backfill added the missing rollups only")
+    finally:
+        conn.close()
+        _remove_db()
+
+def test_rebuild_user_stats_batches():
+    """rebuild_user_stats recomputes every rollup whatever the batch size"""
+    _baseline_db().close()
+    db = DatabaseService(DB_PATH, pool_size=1)
+    try:
+        with db._pool.connection() as conn:
+            conn.execute("UPDATE user_stats SET total = 99")
+            conn.execute("INSERT INTO user_stats (user_id, total) VALUES (4, 5)")
+        assert db.rebuild_user_stats(batch_size=1) == 3
+        with db._pool.connection() as conn:
+            assert _totals(conn) == {1: 2, 2: 1, 3: 1}
+        print("✅ user_stats rebuilt in batches")
+    finally:
+        db.close()
+        _remove_db()
+
+if __name__ == "__main__":
+    test_migrate_baseline()
+    test_history_lookups_use_indexes()
+    test_backfill_only_missing_users()
+    test_rebuild_user_stats_batches()
@@ -0,0 +1,63 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+from bot.services.model_backends import FakeBackend, ModelAPIError, RestBackend
+from bot.services.plan_render import Plan, parse_plan
+from fake_gemini_server import FakeGeminiHandler
+
+PROMPT = "Составь план питания на 2 дня. Калории в день: 1800"
+
+def _fast_backend(**options):
+    return FakeBackend(latency_median=0.001, latency_sigma=0.0, chunk_interval=0.0, seed=1, **options)
+
+def test_fake_backend():
+    """Seeded fake calls are reproducible and shaped after the prompt"""
+    text = _fast_backend().generate(PROMPT).text
+    assert text == _fast_backend().generate(PROMPT).text
+    assert "ДЕНЬ 2" in text and "ДЕНЬ 3" not in text
+
+    chunks = list(_fast_backend(chunk_size=50).stream(PROMPT))
+    assert ''.join(chunk.text for chunk in chunks) == text
+    # Token counts are cumulative, the last chunk has the call's totals
+    assert chunks[-1].output_tokens >= chunks[0].output_tokens
+
+    plan = parse_plan(_fast_backend().generate(PROMPT, {'response_mime_type': 'application/json'}).text)
+    assert plan and len(plan['days']) == 2
+    try:
+        _fast_backend(error_rate=1.0).generate(PROMPT)
+        assert False, "every call should fail"
+    except ModelAPIError as e:
+        assert e.code in (429, 503)
+    print("✅ Fake backend")
+
+def test_rest_backend_against_fake_server():
+    """RestBackend speaks the REST API the local stand-in serves"""
+    FakeGeminiHandler.backend = _fast_backend(chunk_size=200)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeminiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = RestBackend("gemini-test", "key", f"http://127.0.0.1:{server.server_port}")
+        response = backend.generate(PROMPT, timeout=10)
+        assert "ДЕНЬ 1" in response.text and response.prompt_tokens and response.output_tokens
+
+        chunks = list(backend.stream(PROMPT, timeout=10))
+        assert len(chunks) > 1 and "ДЕНЬ 1" in ''.join(chunk.text for chunk in chunks)
+
+        structured = backend.generate(PROMPT, {'response_mime_type': 'application/json', 'response_schema': Plan}, 10)
+        assert parse_plan(structured.text)
+
+        FakeGeminiHandler.backend = _fast_backend(error_rate=1.0)
+        try:
+            backend.generate(PROMPT, timeout=10)
+            assert False, "the server should answer with an error"
+        except ModelAPIError as e:
+            assert e.code in (429, 503)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("✅ REST backend against the fake server")
+
+if __name__ == "__main__":
+    test_fake_backend()
+    test_rest_backend_against_fake_server()
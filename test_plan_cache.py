@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+from bot.services.database import AsyncDatabaseService
+from bot.services.plan_cache import PlanCache
+
+DB_PATH = "test_plan_cache.db"
+
+PROFILE = {'age': 31, 'gender': 'female', 'weight': 62, 'height': 168, 'goal': 'lose_weight', 'calories': 1790}
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+def test_plan_cache():
+    """Nearby profiles share variants, served once enough of them exist"""
+    async def run():
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        try:
+            cache = PlanCache(db, variants=2)
+            key = cache.key(PROFILE, 1, 'balanced')
+            assert cache.key(dict(PROFILE, weight=61, calories=1810), 1, 'balanced') == key
+            assert cache.key(PROFILE, 1, 'vegan') != key
+            assert cache.key(PROFILE, 1, 'balanced', 'json') != key
+
+            assert await cache.get(key) is None
+            await cache.put(key, "plan 1")
+            assert await cache.get(key) is None
+            assert await cache.any(key) == "plan 1"
+            await cache.put(key, "plan 2")
+            assert await cache.get(key) in ("plan 1", "plan 2")
+
+            # The persistent tier outlives the process
+            assert await PlanCache(db, variants=2).get(key) in ("plan 1", "plan 2")
+            assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Plan cache")
+
+def test_put_during_read_is_not_cached():
+    """A variant list read while a put() ran is not kept in memory"""
+    async def run():
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        try:
+            cache = PlanCache(db, variants=1)
+            key = cache.key(PROFILE, 1, 'balanced')
+            read = db.get_cached_plans
+
+            async def slow_read(*args):
+                plans = await read(*args)
+                await cache.put(key, "plan")
+                return plans
+
+            db.get_cached_plans = slow_read
+            assert await cache.get(key) is None
+            db.get_cached_plans = read
+            assert await cache.get(key) == "plan"
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Stale variant list dropped")
+
+if __name__ == "__main__":
+    test_plan_cache()
+    test_put_during_read_is_not_cached()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+from bot.services.database import AsyncDatabaseService
+from bot.services.plan_pool import PlanPool, PoolFiller
+
+DB_PATH = "test_plan_pool.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+class FakeGemini:
+    plan_format = 'text'
+    quota = None
+
+    def __init__(self):
+        self.requests = []
+
+    async def pregenerate(self, profile, days, meal_type):
+        self.requests.append((profile['goal'], profile['calories'], meal_type))
+        return f"plan {len(self.requests)}"
+
+def test_pool_take():
+    """Each pooled plan is served once, oldest first"""
+    async def run():
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        try:
+            pool = PlanPool(db)
+            profile = {'goal': 'maintain', 'gender': 'male', 'calories': 2040}
+            key = pool.bucket_key('maintain', 'male', 2000, 'vegan')
+            await pool.put(key, "first")
+            await pool.put(key, "second")
+            assert await pool.take(profile, 'balanced') is None
+            assert await pool.take(profile, 'vegan') == "first"
+            assert await pool.take(profile, 'vegan') == "second"
+            assert await pool.take(profile, 'vegan') is None
+            assert pool.stats()['hits'] == 2 and pool.stats()['misses'] == 2
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Pool plans served once")
+
+def test_filler_tops_up_popular_buckets():
+    """The filler generates up to the depth for the most requested buckets, within budget"""
+    async def run():
+        db = AsyncDatabaseService(DB_PATH, pool_size=2)
+        try:
+            for user_id, goal in ((1, 'lose_weight'), (2, 'lose_weight'), (3, 'gain_weight')):
+                await db.save_profile(user_id, {'age': 30, 'gender': 'female', 'weight': 60, 'height': 165, 'goal': goal})
+                await db.save_generation(user_id, 'daily', 1800, meal_type='vegan')
+            await db.save_generation(4, 'weekly', 1800)
+
+            pool = PlanPool(db, depth=2)
+            gemini = FakeGemini()
+            filler = PoolFiller(pool, gemini, daily_budget=3)
+            assert await filler.fill_once() == 3
+            # Round-robin by popularity: both buckets get one before the second round
+            assert gemini.requests == [
+                ('lose_weight', 1800, 'vegan'), ('gain_weight', 1800, 'vegan'), ('lose_weight', 1800, 'vegan')
+            ]
+            assert await filler.fill_once() == 0
+            assert filler.stats()['budget_left'] == 0
+
+            counts = await db.count_pool_plans(pool.min_created_at())
+            assert counts == {
+                pool.bucket_key('lose_weight', 'female', 1800, 'vegan'): 2,
+                pool.bucket_key('gain_weight', 'female', 1800, 'vegan'): 1
+            }
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Pool filled for popular buckets")
+
+if __name__ == "__main__":
+    test_pool_take()
+    test_filler_tops_up_popular_buckets()
@@ -0,0 +1,69 @@
+import asyncio
+
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelBackend, ModelResponse
+from bot.services.plan_render import compact_json, merge_plans, parse_plan, plan_meals, render_plan
+
+PLAN = {
+    'days': [
+        {'day': 1, 'meals': [
+            {'type': 'Завтрак', 'time': '08:00', 'name': 'Овсянка', 'calories': 350.4,
+             'protein': 12, 'carbs': 60, 'fat': 7, 'ingredients': ['овсянка', 'молоко']},
+            {'type': 'Ужин', 'time': '19:00', 'name': 'Рыба', 'calories': 500,
+             'protein': 40, 'carbs': 20, 'fat': '15', 'ingredients': []},
+        ]},
+    ],
+    'tips': ['Пейте воду']
+}
+
+class RecordingBackend(ModelBackend):
+    """Returns the plan as JSON and keeps the generation configs it was given"""
+
+    def __init__(self):
+        self.configs = []
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        self.configs.append(generation_config)
+        return ModelResponse(compact_json(PLAN))
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        self.configs.append(generation_config)
+        yield ModelResponse(compact_json(PLAN))
+
+def test_render_plan():
+    """A structured plan parses, renders per day with local totals and maps to meals"""
+    plan = parse_plan(compact_json(PLAN))
+    assert plan is not None
+    assert parse_plan('{"days": "none"}') is None
+    assert parse_plan('not json') is None
+
+    messages = render_plan(plan)
+    assert len(messages) == 2
+    assert messages[0].startswith("🍽️ ДЕНЬ 1")
+    assert "🍳 ЗАВТРАК (08:00)" in messages[0]
+    assert "• Калории: 850 ккал" in messages[0]
+    assert "• Жиры: 22г" in messages[0]
+    assert messages[1] == "👨‍🍳 РЕКОМЕНДАЦИИ:\n• Пейте воду"
+    assert all(len(message) <= 200 for message in render_plan(plan, limit=200))
+
+    assert [meal['calories'] for meal in plan_meals(plan)] == [350, 500]
+    merged = merge_plans([plan, plan])
+    assert len(merged['days']) == 2 and merged['tips'] == ['Пейте воду', 'Пейте воду']
+    print("✅ Structured plan rendered")
+
+def test_structured_calls_send_the_schema():
+    """Both generate and stream calls ask the backend for JSON of the plan schema"""
+    async def run():
+        backend = RecordingBackend()
+        service = GeminiService(backend=backend, structured=True)
+        await service._call_model("prompt")
+        assert [chunk async for chunk in service._stream_model("prompt")] == [compact_json(PLAN)]
+        assert len(backend.configs) == 2
+        assert all(config and config['response_mime_type'] == 'application/json' for config in backend.configs)
+
+    asyncio.run(run())
+    print("✅ Generation config sent with every call")
+
+if __name__ == "__main__":
+    test_render_plan()
+    test_structured_calls_send_the_schema()
@@ -0,0 +1,52 @@
+import asyncio
+
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelAPIError, ModelBackend
+from bot.services.plan_render import compact_json, parse_plan
+from bot.services.planner import OfflinePlanner
+
+class DownBackend(ModelBackend):
+    def generate(self, prompt, generation_config=None, timeout=None):
+        raise ModelAPIError(503, "unavailable")
+
+def test_planner_hits_targets():
+    """Offline plans land near the calorie target with the diet's macro split"""
+    planner = OfflinePlanner(seed=1)
+    for calories, meal_type, goal in ((1600, 'balanced', 'lose_weight'), (2600, 'high_protein', 'gain_muscle'),
+                                      (2000, 'low_carb', 'maintain')):
+        plan = planner.plan({'calories': calories, 'goal': goal}, days=3, meal_type=meal_type)
+        assert [day['day'] for day in plan['days']] == [1, 2, 3]
+        assert plan['tips']
+        for day in plan['days']:
+            total = sum(meal['calories'] for meal in day['meals'])
+            assert abs(total - calories) / calories < 0.15, (calories, meal_type, total)
+        # Dishes vary from day to day
+        names = [tuple(meal['name'] for meal in day['meals']) for day in plan['days']]
+        assert len(set(names)) == 3
+        assert parse_plan(compact_json(plan)) == plan
+
+    def share(meal_type, macro, kcal_per_gram):
+        meals = planner.plan({'calories': 2000, 'goal': 'maintain'}, meal_type=meal_type)['days'][0]['meals']
+        return sum(meal[macro] for meal in meals) * kcal_per_gram / 2000
+
+    assert share('high_protein', 'protein', 4) > share('balanced', 'protein', 4)
+    assert share('low_carb', 'carbs', 4) < share('balanced', 'carbs', 4)
+    assert OfflinePlanner(seed=7).plan({'calories': 2000}) == OfflinePlanner(seed=7).plan({'calories': 2000})
+    print("✅ Offline planner")
+
+def test_planner_is_the_last_fallback():
+    """With the model down and nothing cached, the offline plan is served"""
+    async def run():
+        service = GeminiService(backend=DownBackend(), planner=OfflinePlanner(seed=1))
+        profile = {'age': 30, 'gender': 'female', 'weight': 60, 'height': 165, 'goal': 'maintain', 'calories': 1900}
+        plan = await service.generate_meal_plan(profile, 1)
+        assert plan.startswith("🍽️ ДЕНЬ 1")
+        assert service.fallbacks == 1
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Offline fallback")
+
+if __name__ == "__main__":
+    test_planner_hits_targets()
+    test_planner_is_the_last_fallback()
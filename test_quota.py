@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelAPIError, ModelBackend, ModelResponse
+from bot.services.quota import QuotaExceededError, QuotaGovernor
+
+class SlowBackend(ModelBackend):
+    """Answers after `delay` seconds with fixed usage, or fails with `error`"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return ModelResponse("plan", prompt_tokens=100, output_tokens=200)
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        yield ModelResponse("pl")
+        yield ModelResponse("an", prompt_tokens=100, output_tokens=200)
+
+def _close(tokens, expected, slack=60):
+    """Equal but for what the bucket refilled while the test ran"""
+    return expected <= tokens <= expected + slack
+
+def test_governor_budgets():
+    """Reservations are corrected from usage and refused past max_wait"""
+    async def run():
+        quota = QuotaGovernor(rpm=60, tpm=6000, max_wait=5.0)
+        reserved = await quota.acquire(1000)
+        assert reserved == 1000 and _close(quota.tokens.tokens, 5000)
+        quota.settle(reserved, 100, 200)
+        assert _close(quota.tokens.tokens, 5700)
+        assert quota.output_estimate < 1500
+
+        reserved = await quota.acquire(1000)
+        quota.release(reserved)
+        assert _close(quota.tokens.tokens, 5700)
+
+        quota.throttle()
+        try:
+            await quota.acquire(1000)
+            assert False, "a drained quota should refuse the call"
+        except QuotaExceededError:
+            pass
+        assert quota.stats()['rejected'] == 1 and quota.stats()['throttled'] == 1
+
+    asyncio.run(run())
+    print("✅ Quota budgets")
+
+def test_unused_reservations_are_given_back():
+    """Failed, cancelled and abandoned calls don't keep their tokens"""
+    async def run():
+        # 100 tokens/s refill, little next to a reservation of ~1500
+        quota = QuotaGovernor(rpm=600, tpm=6000)
+        service = GeminiService(backend=SlowBackend(), quota=quota)
+
+        await service._call_model("prompt")
+        assert _close(quota.tokens.tokens, 6000 - 300)
+
+        service.backend = SlowBackend(error=ModelAPIError(503, "unavailable"))
+        try:
+            await service._call_model("prompt")
+            assert False, "the backend error should reach the caller"
+        except ModelAPIError:
+            pass
+        assert _close(quota.tokens.tokens, 6000 - 300)
+
+        # A hedge loser is cancelled like this
+        service.backend = SlowBackend(delay=0.2)
+        call = asyncio.ensure_future(service._call_model("prompt"))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        try:
+            await call
+        except asyncio.CancelledError:
+            pass
+        assert _close(quota.tokens.tokens, 6000 - 300)
+
+        stream = service._stream_model("prompt")
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.05)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        assert _close(quota.tokens.tokens, 6000 - 300)
+
+        service.backend = SlowBackend()
+        assert [chunk async for chunk in service._stream_model("prompt")] == ["pl", "an"]
+        assert _close(quota.tokens.tokens, 6000 - 600)
+
+    asyncio.run(run())
+    print("✅ Unused reservations given back")
+
+if __name__ == "__main__":
+    test_governor_budgets()
+    test_unused_reservations_are_given_back()
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelAPIError, ModelBackend, ModelResponse
+from bot.services.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, RetryPolicy, is_retryable
+
+class ScriptedBackend(ModelBackend):
+    """Plays a list of outcomes, one per call: seconds to sleep before
+    answering, or an exception to raise"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        with self._lock:
+            outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+            self.calls += 1
+            call = self.calls
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return ModelResponse(f"answer {call}")
+
+def test_breaker_transitions():
+    """closed -> open after the threshold -> half-open trial -> closed or open again"""
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial at a time, given back when it ends without an outcome
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened_total == 2
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    assert breaker.stats()['rejected'] == 2
+    print("✅ Circuit breaker transitions")
+
+def test_retries_and_breaker_in_service():
+    """Retryable errors are retried; only they count against the breaker"""
+    async def run():
+        assert is_retryable(ModelAPIError(503, "unavailable")) and not is_retryable(ModelAPIError(400, "bad"))
+        breaker = CircuitBreaker(failure_threshold=3, recovery_time=60)
+        backend = ScriptedBackend([ModelAPIError(503, "unavailable"), 0.0])
+        service = GeminiService(backend=backend, retry_policy=RetryPolicy(attempts=3, base_delay=0), breaker=breaker)
+        assert await service._call_resilient("prompt") == "answer 2"
+        assert service.retries == 1 and breaker.state == CircuitBreaker.CLOSED
+
+        backend.outcomes = [ModelAPIError(400, "bad request")]
+        try:
+            await service._call_resilient("prompt")
+            assert False, "a 400 should not be retried"
+        except ModelAPIError:
+            pass
+        assert service.retries == 1 and breaker.state == CircuitBreaker.CLOSED
+
+        backend.outcomes = [ModelAPIError(503, "unavailable")]
+        try:
+            await service._call_resilient("prompt")
+            assert False, "every attempt failed"
+        except ModelAPIError:
+            pass
+        assert breaker.state == CircuitBreaker.OPEN
+        try:
+            await service._call_resilient("prompt")
+            assert False, "the open breaker should refuse the call"
+        except CircuitOpenError:
+            pass
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Retries and breaker")
+
+def test_hedged_call():
+    """A call slower than the latency percentile is duplicated, the faster answer wins"""
+    async def run():
+        latency = LatencyTracker(min_samples=5)
+        for _ in range(5):
+            latency.record(0.1)
+        # The first call hangs, its hedge answers at once
+        backend = ScriptedBackend([0.5, 0.0])
+        service = GeminiService(backend=backend, latency=latency)
+        started = time.perf_counter()
+        assert await service._hedged_call("prompt") == "answer 2"
+        assert time.perf_counter() - started < 0.4
+        assert service.hedges == 1 and service.hedge_wins == 1
+
+        # Calls within the percentile are not duplicated
+        backend.outcomes, backend.calls = [0.0], 0
+        await service._hedged_call("prompt")
+        assert backend.calls == 1 and service.hedges == 1
+        service.close()
+
+    asyncio.run(run())
+    print("✅ Hedged call")
+
+if __name__ == "__main__":
+    test_breaker_transitions()
+    test_retries_and_breaker_in_service()
+    test_hedged_call()
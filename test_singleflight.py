@@ -0,0 +1,90 @@
+import asyncio
+
+from bot.services.singleflight import SingleFlight
+
+def test_concurrent_calls_share_one_execution():
+    """Callers with the same key get one call's result, or its error"""
+    async def run():
+        flights = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "plan"
+
+        results = await asyncio.gather(*(flights.do('key', work) for _ in range(5)))
+        assert results == ["plan"] * 5
+        assert calls == 1
+        assert flights.stats() == {'executed': 1, 'coalesced': 4, 'in_flight': 0}
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("API error")
+
+        results = await asyncio.gather(*(flights.do('other', fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flights.executed == 2 and flights.coalesced == 6
+
+    asyncio.run(run())
+    print("✅ Concurrent calls coalesced")
+
+def test_cancelled_call_keeps_newer_one():
+    """A call cancelled after its last caller left doesn't drop its successor"""
+    async def run():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do('key', lambda: asyncio.sleep(1, "old")))
+        await asyncio.sleep(0)
+        first.cancel()
+        # The new call takes the key before the old task's done callback runs
+        second = asyncio.ensure_future(flights.do('key', lambda: asyncio.sleep(0.01, "new")))
+        await asyncio.sleep(0)
+        assert flights.stats()['in_flight'] == 1
+        joined = asyncio.ensure_future(flights.do('key', lambda: asyncio.sleep(0.01, "third")))
+        assert await second == "new" and await joined == "new"
+        assert flights.coalesced == 1
+
+    asyncio.run(run())
+    print("✅ Finished call removed only its own entry")
+
+def test_shared_stream():
+    """Late subscribers replay the chunks so far; a stopped pump is not an error"""
+    async def run():
+        flights = SingleFlight()
+
+        async def chunks():
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def read(subscription):
+            return [chunk async for chunk in subscription]
+
+        first = asyncio.ensure_future(read(flights.stream('key', chunks)))
+        await asyncio.sleep(0.015)
+        second = asyncio.ensure_future(read(flights.stream('key', chunks)))
+        assert await first == ["a", "b", "c"] and await second == ["a", "b", "c"]
+        assert flights.executed == 1 and flights.coalesced == 1
+
+        # Cancelling the pump (e.g. on shutdown) cancels the readers
+        subscription = flights.stream('slow', chunks)
+        reader = asyncio.ensure_future(read(subscription))
+        await asyncio.sleep(0.015)
+        subscription._broadcast.pump.cancel()
+        try:
+            await reader
+            assert False, "the reader should have been cancelled"
+        except asyncio.CancelledError:
+            pass
+        assert isinstance(subscription.error, asyncio.CancelledError)
+        assert subscription._broadcast.pump.cancelled()
+        assert flights.stats()['in_flight'] == 0
+
+    asyncio.run(run())
+    print("✅ Stream shared between subscribers")
+
+if __name__ == "__main__":
+    test_concurrent_calls_share_one_execution()
+    test_cancelled_call_keeps_newer_one()
+    test_shared_stream()
@@ -0,0 +1,51 @@
+import asyncio
+import os
+
+from bot.services.database import AsyncDatabaseService
+from bot.services.subscriptions import SubscriptionSweeper
+
+DB_PATH = "test_subscriptions.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+def test_sweeper():
+    """Lapsed subscriptions are deactivated in batches, ending ones reminded once"""
+    async def run():
+        db = AsyncDatabaseService(DB_PATH, pool_size=1)
+        expired, reminded = [], []
+
+        async def on_expired(events):
+            expired.extend(event['user_id'] for event in events)
+
+        async def on_reminder(events):
+            reminded.extend(event['user_id'] for event in events)
+
+        try:
+            for user_id in range(1, 6):
+                await db.update_subscription(user_id, "month", -1)
+            await db.update_subscription(6, "month", 1)
+            await db.update_subscription(7, "month", 30)
+
+            sweeper = SubscriptionSweeper(
+                db, batch_size=2, on_expired=on_expired,
+                remind_before=2 * 24 * 60 * 60, on_reminder=on_reminder
+            )
+            assert await sweeper.sweep_once() == 5
+            assert sorted(expired) == [1, 2, 3, 4, 5]
+            assert reminded == [6]
+            assert not await db.get_subscription_status(1)
+
+            assert await sweeper.sweep_once() == 0
+            assert reminded == [6] and sweeper.expired_total == 5
+        finally:
+            await db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Subscription sweeper")
+
+if __name__ == "__main__":
+    test_sweeper()
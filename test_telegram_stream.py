@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.services.telegram_stream import TelegramStreamWriter
+
+class FakeBot:
+    """Keeps the current text of every message the writer sends or edits"""
+
+    def __init__(self):
+        self.messages = {}
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.messages[message_id] = text
+        self.edits += 1
+
+def test_stream_edits_and_splits():
+    """Chunks edit the status message, throttled, and overflow into new messages"""
+    async def run():
+        bot = FakeBot()
+        bot.messages[1] = "⏳"
+        writer = TelegramStreamWriter(bot, chat_id=7, message_id=1, limit=20, edit_interval=60)
+        await writer.write("первая строка\n")
+        assert bot.messages[1] == "первая строка\n"
+        # Within the edit interval nothing is edited
+        await writer.write("ещё")
+        assert bot.edits == 1
+        await writer.write(" немного\nвторая строка")
+        text = await writer.finish()
+
+        assert bot.messages == {1: "первая строка", 2: "ещё немного", 3: "вторая строка"}
+        assert text == "первая строка\nещё немного\nвторая строка"
+
+    asyncio.run(run())
+    print("✅ Streamed message edits")
+
+if __name__ == "__main__":
+    test_stream_edits_and_splits()
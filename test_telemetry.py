@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+from bot.services.database import DatabaseService
+from bot.services.gemini import GeminiService
+from bot.services.model_backends import ModelBackend, ModelResponse
+from bot.services.telemetry import Histogram, Telemetry, percentile
+
+DB_PATH = "test_telemetry.db"
+
+def _remove_db():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+class CountingBackend(ModelBackend):
+    def generate(self, prompt, generation_config=None, timeout=None):
+        return ModelResponse("🍽️ ДЕНЬ 1", prompt_tokens=120, output_tokens=30)
+
+def test_histogram():
+    """Bucketed percentiles stay within one bucket of the exact ones"""
+    values = list(range(1, 1001))
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    for rank in (50, 95, 99):
+        exact = percentile(values, rank)
+        assert exact <= histogram.percentile(rank) <= exact * 1.25, rank
+    assert histogram.percentile(100) == 1000
+    assert histogram.snapshot()['count'] == 1000 and histogram.snapshot()['avg'] == 500
+    assert Histogram().percentile(50) is None and percentile([], 50) is None
+    print("✅ Histogram percentiles")
+
+def test_requests_are_recorded():
+    """Each plan request leaves a row in model_calls and a histogram sample"""
+    async def run():
+        _remove_db()
+        db = DatabaseService(DB_PATH, pool_size=1)
+        try:
+            telemetry = Telemetry(db, flush_interval_ms=10)
+            service = GeminiService(backend=CountingBackend(), telemetry=telemetry)
+            profile = {'age': 30, 'gender': 'male', 'weight': 80, 'height': 180, 'goal': 'maintain', 'calories': 2500}
+            await service.generate_meal_plan(profile, 1)
+            service.close()
+            telemetry.close()
+
+            rows = db.get_model_calls(0)
+            assert len(rows) == 1
+            assert rows[0]['plan_type'] == 'daily' and rows[0]['outcome'] == 'ok'
+            assert rows[0]['prompt_tokens'] == 120 and rows[0]['output_tokens'] == 30
+            assert rows[0]['wall_ms'] is not None and rows[0]['ttfc_ms'] is not None
+
+            stats = telemetry.stats()['daily']
+            assert stats['outcomes'] == {'ok': 1}
+            assert stats['prompt_tokens']['count'] == 1 and stats['wall_ms']['count'] == 1
+        finally:
+            db.close()
+            _remove_db()
+
+    asyncio.run(run())
+    print("✅ Requests recorded")
+
+if __name__ == "__main__":
+    test_histogram()
+    test_requests_are_recorded()